@@ -0,0 +1,462 @@
+from mqtt_packets import (CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP, SUBACK, PINGREQ, DISCONNECT, connectPacket,
+                          subscribePacket, unsubscribePacket, makePacket, publishPacket, readPacket, PacketReader)
+from routing import TopicRouter, checkTopicFilter
+from collections import deque, namedtuple
+import asyncio
+import itertools
+import os
+import random
+import threading
+import traceback
+
+# MQTT client shared by every component, running on an asyncio event loop instead of a network thread of its own
+# It speaks the same part of MQTT 3.1.1 as the local broker (local_broker.py): QoS 0 publishes and subscriptions,
+# retained messages, keep alives and last will messages. Messages received at QoS 1 or 2 are acknowledged
+#
+# Connection     the client connects in the background and reconnects whenever the connection drops, waiting twice as
+#                long after each failed attempt (with jitter, so a fleet of clients doesn't reconnect all at once)
+# Subscriptions  handlers are registered by topic filter and stored in a topic trie (routing.py), and every filter is
+#                subscribed to again after a reconnect, so components don't need their own on_connect logic
+# Publishing     messages are encoded and queued straight away, and written in batches by the client's writer. The
+#                queue holds messages while the client is reconnecting. When it is full, publish() waits for room,
+#                which slows a publisher to the rate the broker takes messages, and publishNowait() drops the message
+#
+# The client doesn't need a thread, so many clients can share one event loop. ClientThread runs a client on a thread
+# of its own for the GUIs, whose main loop belongs to Tk
+#
+# Limitations, this isn't a general purpose MQTT client:
+#   - There is no TLS, every connection is plain TCP. brokerSettings() exits rather than connecting in plain text
+#     when the settings ask for TLS, use a broker listener without TLS or a TLS proxy (e.g. stunnel) in front of it
+#   - Publishes and subscriptions are QoS 0 only, so messages sent while the connection drops can be lost
+#   - Messages received at QoS 2 are acknowledged but not deduplicated, a redelivered message is handled twice
+
+connectTimeout = 10             # Seconds to wait for the broker to accept a connection
+defaultKeepAlive = 60           # Seconds between pings when nothing else is received
+minBackoff = 1                  # Seconds before the first reconnect attempt, doubling after each failure
+maxBackoff = 60
+maxQueued = 10000               # Messages waiting to be sent before publishing waits or drops messages
+writeBatch = 1000               # Most messages joined into one write
+
+# Settings which mean the broker expects TLS, which the client can't do
+tlsPort = 8883
+tlsSchemes = ("mqtts://", "ssl://", "wss://")
+tlsVariables = ["MQTT_TLS", "MQTT_CA_CERTS"]
+
+# Publish results, 0 for success like the rest of the components expect, and paho's code for a full queue
+publishQueued = 0
+publishQueueFull = 15
+
+# CONNACK return codes, the broker won't accept any of these on a retry so the client stops trying
+connectRefusals = {
+    1: "unacceptable protocol version",
+    2: "client ID rejected",
+    4: "bad username or password",
+    5: "not authorised"
+}
+
+# A received message, with the fields routing.Message and the console read
+Received = namedtuple("Received", ["topic", "payload", "qos", "retain"])
+
+
+def brokerSettings() -> tuple[str, int, str | None, str | None]:
+    """Reads the broker, port, username and password from the environment, exiting if they can't be used"""
+    broker = os.getenv('BROKER')
+    port = os.getenv('BROKER_PORT', '1883')                      # Optional, e.g. for a local broker on another port
+    username = os.getenv('MQTT_USERNAME')
+    password = os.getenv('MQTT_PASSWORD')
+
+    if not broker:
+        print("Missing MQTT BROKER environment variable in .env file")
+        exit(1)
+
+    if not port.isdigit():
+        print("Invalid BROKER_PORT environment variable, expected a port number")
+        exit(1)
+
+    tlsSettings = [name for name in tlsVariables if os.getenv(name)]
+    if broker.lower().startswith(tlsSchemes):
+        tlsSettings.append("BROKER")
+    if int(port) == tlsPort:
+        tlsSettings.append("BROKER_PORT")
+    if tlsSettings:
+        print(f"TLS was asked for by {', '.join(tlsSettings)}, but the MQTT client only connects in plain text")
+        print("Use a broker listener without TLS (usually port 1883), or a TLS proxy in front of the broker")
+        exit(1)
+
+    if not username or not password:
+        username = None
+        password = None
+        print("Missing MQTT_USERNAME and/or MQTT_PASSWORD environment variables in .env file")
+        print("MQTT client will attempt to connect without username and password")
+
+    return broker, int(port), username, password
+
+
+class AsyncMqttClient:
+    """MQTT client which keeps itself connected until closed, see the top of this file
+
+    Handlers are called with a routing.Message on the event loop. Only publishNowait is safe to call from other threads
+    onConnect(returnCode), onDisconnect(error) and onMessage(message) can be set to hear about every connection,
+    disconnection (error is None when closed) and received message
+    """
+    def __init__(self, clientId: str, host: str, port: int = 1883, username: str | None = None,
+                 password: str | None = None, keepAlive: int = defaultKeepAlive,
+                 will: tuple[str, bytes | str, bool] | None = None, maxQueued: int = maxQueued, log=print) -> None:
+        self.clientId = clientId
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.keepAlive = keepAlive
+        self.will = None if will is None else (will[0], will[1].encode() if isinstance(will[1], str) else will[1], will[2])
+        self.maxQueued = maxQueued
+        self.log = log or (lambda message: None)
+
+        self.router = TopicRouter()
+        self.subscriptions = {}         # Topic filter -> number of handlers, subscribed in the order first added
+        self.packetIds = itertools.cycle(range(1, 65536))
+        self.requested = {}             # Packet ID of each SUBSCRIBE waiting for a SUBACK -> its topic filters
+
+        # Encoded PUBLISH packets waiting to be sent. Appending to a deque is thread safe, so other threads can publish
+        self.pending = deque()
+        self.wake = asyncio.Event()     # Set when there is something for the writer to send
+        self.space = asyncio.Event()    # Set when the queue has room
+        self.space.set()
+
+        self.onConnect = None
+        self.onDisconnect = None
+        self.onMessage = None
+
+        self.loop = None
+        self.loopThread = None
+        self.task = None
+        self.closing = False
+        self.writer = None
+        self.connected = asyncio.Event()
+        self.lastReceived = 0.0
+
+        self.published = 0
+        self.dropped = 0
+        self.received = 0
+        self.connections = 0
+
+
+    @property
+    def isConnected(self) -> bool:
+        return self.connected.is_set()
+
+
+    @property
+    def queueFull(self) -> bool:
+        return len(self.pending) >= self.maxQueued
+
+
+    def start(self) -> None:
+        """Starts connecting in the background, this must be called on the event loop the client is to run on"""
+        if self.task is None:
+            self.closing = False
+            self.loop = asyncio.get_running_loop()
+            self.loopThread = threading.get_ident()
+            self.task = self.loop.create_task(self.maintain())
+
+
+    async def connect(self, timeout: float | None = None) -> bool:
+        """Starts the client and waits until it is connected
+
+        Returns False if it wasn't connected within the timeout, or the broker refused the connection, in which case
+        the client has stopped trying
+        """
+        self.start()
+        connected = asyncio.ensure_future(self.connected.wait())
+        try:
+            await asyncio.wait([connected, self.task], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            connected.cancel()
+        return self.isConnected
+
+
+    async def close(self, timeout: float = 5) -> None:
+        """Sends what is still queued (waiting up to the timeout), then disconnects and stops reconnecting"""
+        if self.task is None:
+            return
+
+        deadline = self.loop.time() + timeout
+        while self.pending and self.isConnected and self.loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+        wasConnected = self.isConnected
+        if wasConnected:
+            self.writer.write(makePacket(DISCONNECT, 0))
+            try:
+                await asyncio.wait_for(self.writer.drain(), max(0, deadline - self.loop.time()))
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+
+        self.closing = True
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        if wasConnected:
+            self.log("Successfully disconnected from MQTT Broker")
+            self.callback(self.onDisconnect, None)
+
+
+    def publishNowait(self, topic: str, payload: str | bytes, retain: bool = False) -> int:
+        """Queues a message to be sent, returns publishQueueFull if the queue is full and the message was dropped"""
+        if not topic or "+" in topic or "#" in topic:
+            raise ValueError(f"Invalid topic '{topic}' to publish to")
+        if len(self.pending) >= self.maxQueued:
+            self.dropped += 1
+            return publishQueueFull
+
+        self.pending.append(publishPacket(topic, payload.encode() if isinstance(payload, str) else payload, retain))
+        if self.loop is not None:
+            if threading.get_ident() == self.loopThread:
+                self.wake.set()
+            else:
+                self.loop.call_soon_threadsafe(self.wake.set)
+        return publishQueued
+
+
+    async def publish(self, topic: str, payload: str | bytes, retain: bool = False) -> None:
+        """Queues a message to be sent, waiting for room if the queue is full"""
+        await self.waitForSpace()
+        self.publishNowait(topic, payload, retain)
+
+
+    async def waitForSpace(self) -> None:
+        """Waits until the publish queue has room, for publishers which queue many messages at once"""
+        while len(self.pending) >= self.maxQueued:
+            self.space.clear()
+            await self.space.wait()
+
+
+    def subscribe(self, topicFilter: str, handler) -> None:
+        """Calls handler(message) for every message on a topic matching the filter, for as long as the client runs"""
+        self.router.add(topicFilter, handler)
+        count = self.subscriptions.get(topicFilter, 0)
+        self.subscriptions[topicFilter] = count + 1
+        if count == 0 and self.isConnected:
+            self.sendSubscribe([topicFilter])
+
+
+    def unsubscribe(self, topicFilter: str, handler) -> None:
+        """Stops calling a handler added with subscribe, unsubscribing once the filter has no handlers left"""
+        if topicFilter not in self.subscriptions:
+            return
+
+        self.router.remove(topicFilter, handler)
+        self.subscriptions[topicFilter] -= 1
+        if self.subscriptions[topicFilter] == 0:
+            del self.subscriptions[topicFilter]
+            if self.isConnected:
+                self.writer.write(unsubscribePacket(next(self.packetIds), [topicFilter]))
+
+
+    def sendSubscribe(self, topicFilters: list[str]) -> None:
+        packetId = next(self.packetIds)
+        self.requested[packetId] = topicFilters
+        self.writer.write(subscribePacket(packetId, topicFilters))
+
+
+    def callback(self, callback, *args) -> None:
+        """Calls onConnect, onDisconnect or onMessage if set, an error in one is printed rather than stopping the client"""
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception:
+            print("Error in an MQTT client callback:")
+            traceback.print_exc()
+
+
+    async def maintain(self) -> None:
+        """Connects, and reconnects whenever the connection drops, until the client is closed"""
+        failures = 0
+        while True:
+            if failures == 0:
+                self.log(f"Attempting to connect to {self.host} on port {self.port}")
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), connectTimeout)
+                writer.write(connectPacket(self.clientId, self.keepAlive, self.username, self.password, self.will))
+                packetType, _, body = await asyncio.wait_for(readPacket(reader), connectTimeout)
+                if packetType != CONNACK or len(body) < 2:
+                    raise ValueError("The broker didn't answer with CONNACK")
+
+                returnCode = body[1]
+                self.callback(self.onConnect, returnCode)
+                if returnCode in connectRefusals:
+                    self.log(f"Failed to connect. Reason code: {returnCode} ({connectRefusals[returnCode]})")
+                    return
+                if returnCode != 0:
+                    raise ConnectionError(f"Connection refused with reason code {returnCode}")
+
+                failures = 0
+                await self.session(reader, writer)
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError) as e:
+                # Lost connections are reported once, then each failed attempt to reconnect
+                if isinstance(e, asyncio.IncompleteReadError):
+                    error = "the broker closed the connection"
+                else:
+                    error = str(e) or type(e).__name__
+                if self.isConnected:
+                    self.log(f"Connection to the MQTT broker lost ({error}), reconnecting")
+                else:
+                    self.log(f"Error occurred while connecting to the MQTT broker: {error}")
+            finally:
+                if writer is not None:
+                    writer.close()
+                if self.isConnected:
+                    self.connected.clear()
+                    self.writer = None
+                    if not self.closing:
+                        self.callback(self.onDisconnect, ConnectionError("Connection lost"))
+
+            failures += 1
+            delay = min(maxBackoff, minBackoff * 2 ** (failures - 1))
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+
+    async def session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Runs one connection until it drops"""
+        self.writer = writer
+        self.lastReceived = self.loop.time()
+        self.connections += 1
+        self.connected.set()
+        self.log("Connected to MQTT Broker!")
+
+        # Subscriptions aren't kept by the broker between connections
+        self.requested.clear()
+        if self.subscriptions:
+            self.sendSubscribe(list(self.subscriptions))
+
+        tasks = [asyncio.create_task(self.readLoop(reader)), asyncio.create_task(self.writeLoop(writer))]
+        if self.keepAlive > 0:
+            tasks.append(asyncio.create_task(self.keepAliveLoop(writer)))
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    async def readLoop(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            packetType, flags, body = await readPacket(reader)
+            self.lastReceived = self.loop.time()
+            if packetType == PUBLISH:
+                self.handlePublish(flags, body)
+            elif packetType == PUBREL:
+                self.writer.write(makePacket(PUBCOMP, 0, body[:2]))
+            elif packetType == SUBACK:
+                packet = PacketReader(body)
+                topicFilters = self.requested.pop(packet.uint16(), [])
+                for topicFilter in topicFilters:
+                    if not packet.done() and packet.uint8() == 0x80:
+                        self.log(f"The broker refused the subscription to '{topicFilter}'")
+            # UNSUBACK, PINGRESP and any other acknowledgements need no response
+
+
+    def handlePublish(self, flags: int, body: bytes) -> None:
+        packet = PacketReader(body)
+        topic = packet.string()
+        qos = (flags >> 1) & 0x03
+        if qos:
+            packetId = packet.uint16().to_bytes(2, "big")
+            self.writer.write(makePacket(PUBACK if qos == 1 else PUBREC, 0, packetId))
+
+        self.received += 1
+        message = Received(topic, packet.rest(), qos, bool(flags & 0x01))
+        self.callback(self.onMessage, message)
+        try:
+            self.router.dispatch(message)
+        except Exception:
+            # A handler failing on one message shouldn't drop the connection for every other message
+            print(f"Error handling a message on {topic}:")
+            traceback.print_exc()
+
+
+    async def writeLoop(self, writer: asyncio.StreamWriter) -> None:
+        """Writes queued messages in batches, waiting for the connection to take each batch before the next"""
+        while True:
+            if not self.pending:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+
+            count = min(len(self.pending), writeBatch)
+            writer.write(b"".join([self.pending.popleft() for _ in range(count)]))
+            self.published += count
+            self.space.set()
+            await writer.drain()
+
+
+    async def keepAliveLoop(self, writer: asyncio.StreamWriter) -> None:
+        """Pings the broker, and gives up on the connection if nothing has been received for too long"""
+        while True:
+            await asyncio.sleep(self.keepAlive / 2)
+            if self.loop.time() - self.lastReceived > self.keepAlive * 1.5:
+                raise asyncio.TimeoutError("No response from the broker")
+            writer.write(makePacket(PINGREQ, 0))
+
+
+class ClientThread(threading.Thread):
+    """Runs a client on an event loop in a background thread, for components whose main thread is busy, e.g. with Tk
+
+    Handlers and callbacks are called on this thread. publish, subscribe and unsubscribe are safe to call from any thread
+    """
+    def __init__(self, client: AsyncMqttClient) -> None:
+        super().__init__(daemon=True)
+        self.client = client
+        self.ready = threading.Event()
+        self.loop = None
+        self.stopping = None
+
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.client.start()
+        self.ready.set()
+        await self.stopping.wait()
+        await self.client.close()
+
+
+    def start(self) -> None:
+        """Starts the thread, the client connects in the background"""
+        super().start()
+        self.ready.wait()
+
+
+    def stop(self) -> None:
+        """Disconnects the client and waits for the thread to finish"""
+        if self.loop is not None and self.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.join()
+
+
+    @property
+    def isConnected(self) -> bool:
+        return self.client.isConnected
+
+
+    def publish(self, topic: str, payload: str | bytes, retain: bool = False) -> int:
+        return self.client.publishNowait(topic, payload, retain)
+
+
+    def subscribe(self, topicFilter: str, handler) -> None:
+        # Checked here, so a bad filter is reported to the caller rather than on the client's thread
+        checkTopicFilter(topicFilter)
+        self.loop.call_soon_threadsafe(self.client.subscribe, topicFilter, handler)
+
+
+    def unsubscribe(self, topicFilter: str, handler) -> None:
+        self.loop.call_soon_threadsafe(self.client.unsubscribe, topicFilter, handler)
\ No newline at end of file
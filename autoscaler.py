@@ -0,0 +1,276 @@
+from async_mqtt import AsyncMqttClient, brokerSettings, publishQueued
+from dotenv import load_dotenv
+from cluster import baseTopic, clusterTopic, utilPeriod
+from warning_handler import WarningHandler, monitorCooldown
+from scaling_policy import ScalingPolicy, makePolicy, parseClusterPolicy, policyNames
+from telemetry import decodeSnapshot, decodeTelemetry, decodeServerStates, isBinary, topicClusterId
+from routing import Message
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+# The broker, username and password are stored in a .env file which needs to be made if not already included
+load_dotenv()
+
+# Headless version of the monitor app's autoscaling, so it can run on a server without a display
+# Warnings from the server cluster and every fleet cluster are handled with the same per-cluster cooldowns as the
+# monitor (see warning_handler.py). The monitor app can still be used alongside it as a viewer, with its
+# "Handle warnings" box unticked so each warning isn't handled twice
+#
+# Clusters can instead be scaled by a policy from scaling_policy.py, chosen for every cluster or for each one, which
+# decides from the clusters' telemetry. Warnings from those clusters are then left to the policy
+#
+# The MQTT client (async_mqtt.py) runs on the same asyncio event loop, so every message, warning and cooldown is
+# handled on one thread. Metrics are published as JSON on simulation/autoscaler/metrics, and can also be served
+# over HTTP in the Prometheus text format
+
+# Connection info
+broker, port, username, password = brokerSettings()
+subscribeTopics = [f"{baseTopic}/+/warnings", f"{baseTopic}/warnings"]
+telemetryTopics = [                                                 # Only subscribed to when a policy needs telemetry
+    f"{baseTopic}/servers/#",
+    f"{baseTopic}/+/servers/#",
+    f"{baseTopic}/snapshots/#"
+]
+metricsTopic = f"{baseTopic}/autoscaler/metrics"
+snapshotTimeout = 3 * utilPeriod                                    # Seconds without a snapshot before metric topics are used again
+client_id = f'autoscaler-{random.randint(0, 1000)}'                 # Assign a random ID to the client device
+
+
+class Autoscaler:
+    """Handles cluster warnings on an asyncio event loop"""
+    def __init__(self, client: AsyncMqttClient, cooldown: float = monitorCooldown, verbose: bool = False,
+                 policy: str = "warnings", clusterPolicies: dict[str, str] | None = None) -> None:
+        self.client = client
+        self.verbose = verbose
+        self.loop = asyncio.get_running_loop()
+        self.warnings = asyncio.Queue()
+        self.handler = WarningHandler(self.publish, cooldown, notify=print if verbose else None)
+        self.timers = {}        # Warning topic -> timer ending its cooldown
+
+        # Scaling policy of each cluster, created when the cluster is first heard from
+        self.defaultPolicy = policy
+        self.clusterPolicies = clusterPolicies or {}
+        self.policies = {}
+        self.serversActive = {}     # Cluster ID -> last known active servers
+        self.serversRequested = {}  # Cluster ID -> servers in service or starting, from the states of clusters with boot delays
+        self.snapshotTimes = {}     # Cluster ID -> loop time of its last snapshot
+        self.policyScalings = 0
+
+        for topic in subscribeTopics:
+            client.subscribe(topic, self.queueWarning)
+        if self.usesTelemetry():
+            for topic in telemetryTopics:
+                client.subscribe(topic, lambda message: self.handleTelemetry(message.topic, message.payload))
+        print(f"Subscribed to topics: {list(client.subscriptions)}\n")
+
+        self.startTime = time.monotonic()
+        self.received = 0
+        self.published = 0
+        self.publishFailures = 0
+        self.responseTotal = 0.0    # Seconds between receiving a warning and sending its command
+        self.responseMax = 0.0
+
+
+    def usesTelemetry(self) -> bool:
+        return any(name != "warnings" for name in [self.defaultPolicy, *self.clusterPolicies.values()])
+
+
+    def policyFor(self, clusterId: str | None) -> ScalingPolicy | None:
+        """Returns the scaling policy of a cluster, or None if it is scaled in response to its warnings"""
+        if clusterId not in self.policies:
+            name = self.clusterPolicies.get(clusterId, self.defaultPolicy)
+            self.policies[clusterId] = makePolicy(name, cooldown=self.handler.cooldown)
+        return self.policies[clusterId]
+
+
+    def queueWarning(self, message: Message) -> None:
+        self.warnings.put_nowait((message.topic, message.text, time.monotonic()))
+
+
+    def handleTelemetry(self, topic: str, payload: bytes) -> None:
+        """Passes each cluster's utilisation to its policy, and scales the cluster if the policy decides to"""
+        if topic.endswith("/states"):
+            # Servers which are still starting count towards the size the policy wants, so it doesn't ask for them again
+            states = decodeServerStates(payload)
+            if states is not None:
+                clusterId = topicClusterId(topic)
+                self.serversActive[clusterId] = states.active
+                self.serversRequested[clusterId] = states.active + states.pending + states.booting
+            return
+
+        now = self.loop.time()
+        metricTopic = topic.endswith(("/avg_cpu_util", "/active"))
+        if isBinary(payload):
+            # Binary payloads carry both values, but a metric topic is only used for its own value
+            records = [(record.clusterId,
+                        None if topic.endswith("/active") else record.avgVcpuUtil,
+                        None if topic.endswith("/avg_cpu_util") else record.serversActive)
+                       for record in decodeSnapshot(payload)]
+        else:
+            telemetry = decodeTelemetry(topic, payload)
+            records = [(telemetry.clusterId, telemetry.avgVcpuUtil, telemetry.serversActive)] if telemetry else []
+
+        for clusterId, avgVcpuUtil, serversActive in records:
+            policy = self.policyFor(clusterId)
+            if policy is None:
+                continue
+
+            # With PUBLISH_MODE=both each tick arrives on the metric topics and in a snapshot, so while a cluster is
+            # sending snapshots its utilisation is only taken from them, or its policy would decide twice a tick
+            if not metricTopic:
+                self.snapshotTimes[clusterId] = now
+            elif now - self.snapshotTimes.get(clusterId, -snapshotTimeout) < snapshotTimeout:
+                avgVcpuUtil = None
+
+            if serversActive is not None:
+                self.serversActive[clusterId] = serversActive
+
+            servers = self.serversActive.get(clusterId)
+            if avgVcpuUtil is None or servers is None:
+                continue
+
+            desired = policy.decide(now, avgVcpuUtil, servers, self.serversRequested.get(clusterId))
+            if desired is None:
+                continue
+
+            self.policyScalings += 1
+            self.publish(clusterTopic(clusterId, "commands"), f"!scaleto {desired}")
+            if self.verbose:
+                print(f"Scaling {clusterId or baseTopic} from {servers} to {desired} servers at {avgVcpuUtil}% utilisation")
+
+            # Assume the cluster is now at the desired size, its next report corrects this if it has a lower server cap
+            # Clusters with boot delays keep their active count until the servers start, so only the request is updated
+            if clusterId in self.serversRequested:
+                self.serversRequested[clusterId] = desired
+            else:
+                self.serversActive[clusterId] = desired
+
+
+    def publish(self, topic: str, command: str) -> None:
+        if self.client.publishNowait(topic, command) == publishQueued:
+            self.published += 1
+        else:
+            self.publishFailures += 1
+
+
+    async def handleWarnings(self) -> None:
+        while True:
+            warningTopic, warning, receivedTime = await self.warnings.get()
+            self.received += 1
+
+            # Clusters with a policy are scaled from their telemetry instead
+            levels = warningTopic.split("/")
+            if self.policyFor(levels[1] if len(levels) == 3 else None) is not None:
+                continue
+
+            if self.handler.handleWarning(warningTopic, warning):
+                responseTime = time.monotonic() - receivedTime
+                self.responseTotal += responseTime
+                self.responseMax = max(self.responseMax, responseTime)
+                self.timers[warningTopic] = self.loop.call_later(self.handler.cooldown, self.finishWarning, warningTopic)
+
+
+    def finishWarning(self, warningTopic: str) -> None:
+        del self.timers[warningTopic]
+        self.handler.finishWarning(warningTopic)
+
+
+    def finishAll(self) -> None:
+        """Ends every cooldown early, so logging is stopped when shutting down"""
+        for warningTopic, timer in list(self.timers.items()):
+            timer.cancel()
+            self.finishWarning(warningTopic)
+
+
+    def metrics(self) -> dict[str, float]:
+        handled = self.handler.handled
+        return {
+            "uptime_seconds": round(time.monotonic() - self.startTime, 1),
+            "warnings_received": self.received,
+            "warnings_handled": handled,
+            "warnings_suppressed": self.handler.suppressed,
+            "warnings_ignored": self.handler.ignored,
+            "commands_published": self.published,
+            "publish_failures": self.publishFailures,
+            "clusters_seen": len(self.handler.states),
+            "clusters_cooling_down": self.handler.cooling,
+            "policy_scalings": self.policyScalings,
+            "response_seconds_avg": self.responseTotal / handled if handled else 0.0,
+            "response_seconds_max": self.responseMax
+        }
+
+
+    async def publishMetrics(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.client.publish(metricsTopic, json.dumps(self.metrics()))
+
+
+    async def serveMetrics(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers any HTTP request with the metrics in the Prometheus text format"""
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+
+        body = "".join(f"autoscaler_{name} {value}\n" for name, value in self.metrics().items()).encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        writer.close()
+
+
+async def main(args: argparse.Namespace) -> None:
+    client = AsyncMqttClient(client_id, broker, port, username, password)
+    autoscaler = Autoscaler(client, args.cooldown, args.verbose, args.policy, dict(args.cluster_policy))
+
+    # The client keeps reconnecting in the background, subscribing to every topic again each time
+    # Connecting only fails if the broker refuses the connection
+    if not await client.connect():
+        print("Failed to connect to the MQTT broker. Exiting...")
+        await client.close()
+        exit(1)
+
+    tasks = [asyncio.create_task(autoscaler.handleWarnings())]
+    if args.metrics_interval > 0:
+        tasks.append(asyncio.create_task(autoscaler.publishMetrics(args.metrics_interval)))
+
+    server = None
+    if args.metrics_port:
+        server = await asyncio.start_server(autoscaler.serveMetrics, port=args.metrics_port)
+        print(f"Serving metrics on port {args.metrics_port}")
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        if server:
+            server.close()
+        autoscaler.finishAll()
+        print(f"Handled {autoscaler.handler.handled} warnings, suppressed {autoscaler.handler.suppressed} during cooldowns")
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Responds to server cluster warnings with scaling commands, without a GUI")
+    parser.add_argument("--cooldown", type=float, default=monitorCooldown,
+                        help="seconds after a scaling command during which a cluster's warnings are suppressed")
+    parser.add_argument("--metrics-interval", type=float, default=10,
+                        help=f"seconds between metrics published on {metricsTopic}, 0 to disable")
+    parser.add_argument("--metrics-port", type=int, help="port to serve metrics on over HTTP")
+    parser.add_argument("-p", "--policy", choices=policyNames, default="warnings", help="scaling policy for every cluster")
+    parser.add_argument("--cluster-policy", type=parseClusterPolicy, action="append", default=[],
+                        help="scaling policy for one cluster, e.g. cluster-3=predictive (may be repeated)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every command sent")
+    args = parser.parse_args()
+
+    print("Starting the autoscaler...")
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt detected, disconnecting from MQTT broker...")
+    print("Client disconnected, exiting program.")
\ No newline at end of file
@@ -0,0 +1,486 @@
+from cluster import baseTopic, clusterTopic, warningCommands
+from log_store import LogSession, listSessions
+from routing import Message
+from telemetry import decodeSnapshot, encodeTelemetry, topicClusterId
+from async_mqtt import AsyncMqttClient, ClientThread
+from datetime import datetime
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+# Benchmarks the whole pipeline as the number of clusters grows: a local broker, the cluster fleet publishing binary
+# telemetry, the logger writing binary sessions and the headless autoscaler, each in its own process as they would
+# normally run. For each cluster count a probe client measures:
+#
+#   messages/s          received and sent by the broker, from its $SYS/broker/messages/... stats
+#   publish -> receive  from the timestamp in a sample of the clusters' binary telemetry to the probe receiving it
+#   publish -> log      from the probe publishing a snapshot to the logger logging it, read back from the session files
+#   warning -> command  from a sampled cluster's warning to the autoscaler's command in response, both seen by the probe
+#   CPU and memory      of each component's process, read from /proc (so only reported on Linux)
+#
+# Latencies are reported as p50/p99 in milliseconds, and the results are saved as JSON along with the commit they
+# were measured on, so `python benchmark.py compare old.json new.json` shows what a change did to each number
+
+defaultClusterCounts = [1, 10, 100, 1000, 10000]
+
+# The logger only logs the single cluster topics, so its latency is timed with snapshots from a made up cluster whose
+# active server count is a sequence number. The logger stores it under the probe key with the time it was logged
+probeClusterId = "benchmark-probe"
+probeTopic = f"{baseTopic}/servers/snapshot"
+probeKey = clusterTopic(probeClusterId, "servers/active")
+maxProbes = 65535       # The sequence number is a uint16
+
+# Left alone, the clusters rarely leave the scaling limits, so the fleet is swung up and down to keep warnings coming
+loadPhases = ["!simincrease", "!simdecrease"]
+
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+clockTicks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def freePort() -> int:
+    """Returns a local port nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def waitForPort(port: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Nothing listening on port {port} after {timeout} seconds")
+            time.sleep(0.1)
+
+
+def gitCommit() -> tuple[str | None, bool]:
+    """Returns the commit being benchmarked, and whether the tracked files have uncommitted changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=scriptDir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=scriptDir,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status.strip())
+
+
+def latencyStats(seconds: list[float]) -> dict:
+    """Returns the count, p50, p99 and max of a list of latencies, in milliseconds"""
+    if not seconds:
+        return {"count": 0, "p50": None, "p99": None, "max": None}
+    p50, p99 = np.percentile(np.array(seconds) * 1000, [50, 99])
+    return {"count": len(seconds), "p50": round(float(p50), 2), "p99": round(float(p99), 2),
+            "max": round(max(seconds) * 1000, 2)}
+
+
+class Component:
+    """One of the components run in its own process, with its output written to a file"""
+    def __init__(self, name: str, args: list[str], env: dict, outputDir: str) -> None:
+        self.name = name
+        self.outputPath = os.path.join(outputDir, f"{name}.out")
+        self.output = open(self.outputPath, "w")
+        self.process = subprocess.Popen([sys.executable, "-u", *args], cwd=scriptDir, env=env,
+                                        stdout=self.output, stderr=subprocess.STDOUT)
+        self.startCpu = None
+        self.maxRss = 0
+
+
+    @property
+    def isRunning(self) -> bool:
+        return self.process.poll() is None
+
+
+    def cpuSeconds(self) -> float | None:
+        """User and system CPU time used by the process so far"""
+        try:
+            with open(f"/proc/{self.process.pid}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()     # The name in brackets may contain spaces
+        except OSError:
+            return None
+        return (int(fields[11]) + int(fields[12])) / clockTicks
+
+
+    def rss(self) -> int | None:
+        """Resident memory of the process in bytes"""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+
+    def sample(self) -> None:
+        self.maxRss = max(self.maxRss, self.rss() or 0)
+
+
+    def startWindow(self) -> None:
+        self.startCpu = self.cpuSeconds()
+        self.maxRss = 0
+        self.sample()
+
+
+    def results(self, seconds: float) -> dict:
+        """CPU use and peak memory since startWindow"""
+        cpu = self.cpuSeconds()
+        return {
+            "cpu_percent": round(100 * (cpu - self.startCpu) / seconds, 1) if cpu is not None and self.startCpu is not None else None,
+            "rss_mb": round(self.maxRss / 1024 ** 2, 1) if self.maxRss else None
+        }
+
+
+    def stop(self) -> None:
+        """Stops the process the same way as Ctrl+C, so it disconnects and closes its files"""
+        if self.isRunning:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.output.close()
+
+
+class Probe:
+    """MQTT client which times messages through the broker, the logger and the autoscaler"""
+    def __init__(self, port: int, clusterIds: list[str], cooldown: float) -> None:
+        self.port = port
+        self.cooldown = cooldown
+        self.measuring = False
+        self.connected = threading.Event()
+        self.publishing = threading.Event()     # Set once telemetry arrives from the fleet
+
+        self.brokerStats = {}       # $SYS stat name -> (time received, value)
+        self.windowStats = {}       # The same at the start of the measurement
+        self.telemetryLatency = []
+        self.responseLatency = []
+        self.sendTimes = []         # Time each probe snapshot was sent, indexed by its sequence number
+
+        # Warnings the autoscaler hasn't answered yet, (cluster ID, command asked for) -> time of the first one
+        self.warningSince = {}
+        self.lastCommand = {}       # Cluster ID -> time of its last command
+
+        client = AsyncMqttClient(f"benchmark-{os.getpid()}", "127.0.0.1", port, log=None)
+        client.onConnect = self.onConnect
+        client.subscribe("$SYS/broker/messages/+", self.onBrokerStat)
+        client.subscribe(f"{baseTopic}/commands", self.onLogCommand)
+        for clusterId in clusterIds:
+            client.subscribe(clusterTopic(clusterId, "servers/avg_cpu_util"), self.onTelemetry)
+            client.subscribe(clusterTopic(clusterId, "warnings"), self.onWarning)
+            client.subscribe(clusterTopic(clusterId, "commands"), self.onCommand)
+
+        # The benchmark's main thread sleeps between phases, so the client runs on a thread of its own
+        self.client = ClientThread(client)
+
+
+    def start(self) -> None:
+        self.client.start()
+        if not self.connected.wait(10):
+            raise RuntimeError("Probe couldn't connect to the broker")
+
+
+    def stop(self) -> None:
+        self.client.stop()
+
+
+    def onConnect(self, rc: int) -> None:
+        if rc == 0:
+            self.connected.set()
+
+
+    def onBrokerStat(self, message: Message) -> None:
+        self.brokerStats[message.topic.rsplit("/", 1)[1]] = (time.monotonic(), int(message.payload))
+
+
+    def onLogCommand(self, message: Message) -> None:
+        # The autoscaler stops the log when its last cooldown ends, start it again so every probe can be logged
+        if message.text.strip() == "!stoplog":
+            self.client.publish(f"{baseTopic}/commands", "!startlog")
+
+
+    def onTelemetry(self, message: Message) -> None:
+        now = time.time()
+        self.publishing.set()
+        if self.measuring:
+            self.telemetryLatency.extend(now - record.timestamp for record in decodeSnapshot(message.payload))
+
+
+    def onWarning(self, message: Message) -> None:
+        now = time.monotonic()
+        command = warningCommands.get(message.text)
+        clusterId = topicClusterId(message.topic)
+        if command is None or now - self.lastCommand.get(clusterId, -math.inf) < self.cooldown:
+            return      # The autoscaler doesn't answer these
+        self.warningSince.setdefault((clusterId, command), now)
+
+
+    def onCommand(self, message: Message) -> None:
+        now = time.monotonic()
+        clusterId = topicClusterId(message.topic)
+        command = message.text.strip()
+        warningTime = self.warningSince.pop((clusterId, command), None)
+        for key in warningCommands.values():
+            self.warningSince.pop((clusterId, key), None)    # Warnings suppressed by the cooldown go unanswered
+        self.lastCommand[clusterId] = now
+        if self.measuring and warningTime is not None:
+            self.responseLatency.append(now - warningTime)
+
+
+    def sendProbe(self) -> None:
+        if len(self.sendTimes) < maxProbes:
+            sendTime = time.time()
+            self.client.publish(probeTopic, encodeTelemetry(probeClusterId, 0, len(self.sendTimes), sendTime))
+            self.sendTimes.append(sendTime)
+
+
+    def startWindow(self) -> None:
+        self.windowStats = dict(self.brokerStats)
+        self.measuring = True
+
+
+    def brokerRate(self, name: str) -> float | None:
+        """Messages per second counted by a broker stat since startWindow"""
+        start, end = self.windowStats.get(name), self.brokerStats.get(name)
+        if start is None or end is None or end[0] <= start[0]:
+            return None
+        return round((end[1] - start[1]) / (end[0] - start[0]), 1)
+
+
+    def logLatency(self, logsDir: str) -> tuple[list[float], int]:
+        """Returns the time each probe took to be logged, and how many were never logged"""
+        latency = []
+        for path in listSessions(logsDir):
+            timestamps, sequences = LogSession(path).series(probeKey)
+            latency.extend(timestamp - self.sendTimes[int(sequence)] for timestamp, sequence in zip(timestamps, sequences)
+                           if int(sequence) < len(self.sendTimes))
+        return latency, len(self.sendTimes) - len(latency)
+
+
+def runStep(args: argparse.Namespace, clusters: int, workDir: str) -> dict:
+    """Runs every component against a fresh broker with a number of clusters, and returns the measurements"""
+    stepDir = os.path.join(workDir, f"clusters-{clusters}")
+    logsDir = os.path.join(stepDir, "logs")
+    os.makedirs(logsDir)
+
+    port = freePort()
+    env = {**os.environ, "BROKER": "127.0.0.1", "BROKER_PORT": str(port), "MQTT_USERNAME": "", "MQTT_PASSWORD": "",
+           "CONSOLE_LEVEL": "off", "LOG_FORMAT": "binary", "LOGS_DIR": logsDir}
+
+    # Sample clusters spread evenly over the fleet, with the same zero padded IDs the fleet gives them
+    width = len(str(clusters - 1))
+    sampled = range(0, clusters, max(1, clusters // args.sample_clusters))[:args.sample_clusters]
+    probe = Probe(port, [f"cluster-{i:0{width}d}" for i in sampled], args.cooldown)
+
+    components = {}
+    try:
+        components["broker"] = Component("broker", ["local_broker.py", "--port", str(port), "--stats-interval", "1"], env, stepDir)
+        waitForPort(port)
+        components["logger"] = Component("logger", ["logger.py"], env, stepDir)
+        components["autoscaler"] = Component("autoscaler", ["autoscaler.py", "--cooldown", str(args.cooldown),
+                                                            "--metrics-interval", "0"], env, stepDir)
+        probe.start()
+        components["fleet"] = Component("fleet", ["cluster_fleet.py", "--clusters", str(clusters), "--binary",
+                                                  "--console", "off", "--seed", str(args.seed)], env, stepDir)
+        if not probe.publishing.wait(30):
+            raise RuntimeError(f"The fleet published no telemetry, see {components['fleet'].outputPath}")
+
+        # Phases of the load cycle are sent to every cluster in the fleet at once
+        phase = 0
+        probe.client.publish(f"{baseTopic}/commands", loadPhases[phase])
+        nextPhase = time.monotonic() + args.phase_seconds
+        time.sleep(args.warmup)
+
+        for component in components.values():
+            if not component.isRunning:
+                raise RuntimeError(f"The {component.name} exited early, see {component.outputPath}")
+
+        # Messages from the probe reach the logger in order, so the log is started before the first probe arrives
+        probe.client.publish(f"{baseTopic}/commands", "!startlog")
+        probe.startWindow()
+        for component in components.values():
+            component.startWindow()
+
+        startTime = time.monotonic()
+        nextProbe = nextSample = startTime
+        while (now := time.monotonic()) < startTime + args.duration:
+            if now >= nextProbe:
+                probe.sendProbe()
+                nextProbe += 1 / args.probe_rate
+            if now >= nextPhase:
+                phase += 1
+                probe.client.publish(f"{baseTopic}/commands", loadPhases[phase % len(loadPhases)])
+                nextPhase += args.phase_seconds
+            if now >= nextSample:
+                for component in components.values():
+                    component.sample()
+                nextSample += 1
+            time.sleep(max(0, min(nextProbe, nextSample, nextPhase) - time.monotonic()))
+        seconds = time.monotonic() - startTime
+
+        probe.measuring = False
+        usage = {name: component.results(seconds) for name, component in components.items()}
+        received, sent = probe.brokerRate("received"), probe.brokerRate("sent")
+    finally:
+        probe.stop()
+        # Publishers first, so the logger and broker see everything that was sent
+        for name in ["fleet", "autoscaler", "logger", "broker"]:
+            if name in components:
+                components[name].stop()
+
+    # The logger closes its session when stopped, so every record has been written by now
+    logLatency, unlogged = probe.logLatency(logsDir)
+    return {
+        "clusters": clusters,
+        "seconds": round(seconds, 1),
+        "received_per_second": received,
+        "sent_per_second": sent,
+        "telemetry_latency_ms": latencyStats(probe.telemetryLatency),
+        "log_latency_ms": {**latencyStats(logLatency), "unlogged": unlogged},
+        "response_latency_ms": latencyStats(probe.responseLatency),
+        "components": usage
+    }
+
+
+def stepSummary(result: dict) -> str:
+    """One line summary of a step's results"""
+    def latency(stats: dict) -> str:
+        return f"{stats['p50']}/{stats['p99']}" if stats["count"] else "-"
+
+    usage = ", ".join(f"{name} {values['cpu_percent']}% {values['rss_mb']}MB" for name, values in result["components"].items())
+    return (f"{result['clusters']:>6} clusters: {result['received_per_second']} msgs/s in, {result['sent_per_second']} out | "
+            f"p50/p99 ms publish->receive {latency(result['telemetry_latency_ms'])}, "
+            f"publish->log {latency(result['log_latency_ms'])}, warning->command {latency(result['response_latency_ms'])} | "
+            f"{usage}")
+
+
+def compareMetrics(result: dict) -> dict[str, float | None]:
+    """Flattens a step's results into the numbers compared between runs"""
+    metrics = {
+        "received/s": result["received_per_second"],
+        "sent/s": result["sent_per_second"]
+    }
+    for name, label in [("telemetry_latency_ms", "publish->receive"), ("log_latency_ms", "publish->log"),
+                        ("response_latency_ms", "warning->command")]:
+        metrics[f"{label} p50 ms"] = result[name]["p50"]
+        metrics[f"{label} p99 ms"] = result[name]["p99"]
+    for name, usage in result["components"].items():
+        metrics[f"{name} CPU %"] = usage["cpu_percent"]
+        metrics[f"{name} RSS MB"] = usage["rss_mb"]
+    return metrics
+
+
+def compare(basePath: str, newPath: str) -> None:
+    """Prints the change in every metric between two benchmark results, for the cluster counts both include"""
+    with open(basePath) as file:
+        base = json.load(file)
+    with open(newPath) as file:
+        new = json.load(file)
+
+    print(f"Base {base.get('commit')} ({base.get('date')}), new {new.get('commit')} ({new.get('date')})")
+    newResults = {result["clusters"]: result for result in new["results"]}
+    for baseResult in base["results"]:
+        newResult = newResults.get(baseResult["clusters"])
+        if newResult is None:
+            continue
+
+        print(f"\n{baseResult['clusters']} clusters")
+        newMetrics = compareMetrics(newResult)
+        for name, old in compareMetrics(baseResult).items():
+            value = newMetrics.get(name)
+            change = f"{100 * (value - old) / old:+.1f}%" if old and value is not None else ""
+            print(f"  {name:<26}{old if old is not None else '-':>12}{value if value is not None else '-':>12}{change:>10}")
+
+
+def run(args: argparse.Namespace) -> None:
+    commit, dirty = gitCommit()
+    date = datetime.now()
+    output = args.output or f"benchmark_{commit or 'unknown'}{'-dirty' if dirty else ''}_{date.strftime('%Y%m%d_%H%M%S')}.json"
+
+    workDir = tempfile.mkdtemp(prefix="benchmark-")
+    results = []
+    try:
+        for clusters in args.clusters:
+            print(f"Benchmarking {clusters} clusters for {args.duration} seconds...", file=sys.stderr)
+            result = runStep(args, clusters, workDir)
+            results.append(result)
+            print(stepSummary(result))
+    except RuntimeError as e:
+        print(f"Benchmark failed: {e}", file=sys.stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt detected, saving the results so far...", file=sys.stderr)
+    else:
+        if not args.keep_output:
+            shutil.rmtree(workDir)
+            workDir = None
+    finally:
+        if workDir:
+            print(f"Component output and logs kept in {workDir}", file=sys.stderr)
+
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": date.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "probe_rate": args.probe_rate,
+            "cooldown": args.cooldown,
+            "sample_clusters": args.sample_clusters,
+            "phase_seconds": args.phase_seconds,
+            "seed": args.seed
+        },
+        "results": results
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Saved the results to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the broker, cluster fleet, logger and autoscaler as the number of clusters grows")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    runParser = commands.add_parser("run", help="run the benchmark and save the results as JSON")
+    runParser.add_argument("-n", "--clusters", type=int, nargs="+", default=defaultClusterCounts, help="cluster counts to benchmark")
+    runParser.add_argument("-d", "--duration", type=float, default=30, help="seconds measured at each cluster count")
+    runParser.add_argument("--warmup", type=float, default=5, help="seconds the components run before measuring starts")
+    runParser.add_argument("--probe-rate", type=float, default=10, help="probe snapshots sent to the logger each second")
+    runParser.add_argument("--cooldown", type=float, default=1,
+                           help="the autoscaler's cooldown, shorter cooldowns give more warning->command samples")
+    runParser.add_argument("--sample-clusters", type=int, default=20, help="clusters whose telemetry, warnings and commands are timed")
+    runParser.add_argument("--phase-seconds", type=float, default=30,
+                           help="seconds the fleet's load rises, then falls, for in turn so the clusters keep warning")
+    runParser.add_argument("-s", "--seed", default=0, help="seed for the fleet, the same seed repeats the same load")
+    runParser.add_argument("-o", "--output", help="JSON file to write, defaults to benchmark_<commit>_<time>.json")
+    runParser.add_argument("--keep-output", action="store_true", help="keep each component's output and logs")
+
+    compareParser = commands.add_parser("compare", help="show the change in every metric between two saved results")
+    compareParser.add_argument("base", help="results to compare against, e.g. from the previous commit")
+    compareParser.add_argument("new", help="results to compare")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args.base, args.new)
\ No newline at end of file
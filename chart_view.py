@@ -0,0 +1,331 @@
+from cluster import defaultConfig
+from telemetry import decodeSnapshot, decodeTelemetry, isBinary
+import queue
+import sys
+import time
+import tkinter as tk
+from tkinter import ttk
+import math
+import numpy as np
+
+# Live charts of each cluster's utilisation and active servers for the monitor app
+# Each series is a fixed size NumPy ring buffer, so memory use doesn't grow however long the monitor runs
+# The history is downsampled to the width of the chart, keeping the lowest and highest value in each pixel column so
+# short spikes still show. Points are spaced by their position in the series, since every cluster publishes on a fixed
+# period, so a column always covers the same points and the line never has to be rescaled as it grows
+#
+# Every chart is one Canvas line item, which is only redrawn when its cluster has new data and the tab is visible.
+# A redraw only adds the points appended since the last one, and once the ring is full, columns whose oldest point
+# has been overwritten are dropped off the left and the line is moved along. The whole line is only rebuilt when a
+# different series is shown, the y range grows, points were overwritten before they were drawn or the chart is resized
+#
+# Like the message view, payloads are pushed from the MQTT thread onto a queue and decoded on a Tk timer
+
+defaultCluster = "simulation"   # Name shown for the single cluster in server_cluster.py, which has no cluster ID
+
+
+class RingSeries:
+    """Fixed size buffer of (timestamp, value) points which overwrites the oldest point when full"""
+    def __init__(self, capacity: int) -> None:
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.count = 0
+        self.next = 0
+        self.total = 0      # Points ever appended, so a chart can tell which points it hasn't drawn yet
+
+
+    def append(self, timestamp: float, value: float) -> None:
+        self.times[self.next] = timestamp
+        self.values[self.next] = value
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.total += 1
+
+
+    @property
+    def first(self) -> int:
+        """Index of the oldest point still held, counting every point ever appended"""
+        return self.total - self.count
+
+
+    @property
+    def latest(self) -> float:
+        return float(self.values[self.next - 1])
+
+
+    def ordered(self) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the points oldest first"""
+        if self.count < self.capacity:
+            return self.times[:self.count], self.values[:self.count]
+        return np.roll(self.times, -self.next), np.roll(self.values, -self.next)
+
+
+    def newest(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the newest points oldest first, count must be no more than the points held"""
+        indices = np.arange(self.next - count, self.next) % self.capacity
+        return self.times[indices], self.values[indices]
+
+
+def columnRanges(first: int, values: np.ndarray, pointsPerColumn: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Splits points into columns by their index, returning each column and the lowest and highest value in it
+
+    first is the index of the first point, counting every point ever appended to the series
+    """
+    columns = (first + np.arange(len(values))) // pointsPerColumn
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(columns)) + 1))
+    return columns[starts], np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+
+class Chart:
+    """Canvas with a single line plotting one series, with a y-axis starting at 0"""
+    def __init__(self, parent, title: str, yMax: float, width: int = 520, height: int = 130,
+                 guides: tuple[float, ...] = ()) -> None:
+        self.width = width
+        self.height = height
+        self.yMax = yMax
+        self.left = 35      # Space for the y-axis labels
+        self.top = 20       # Space for the title
+
+        self.canvas = tk.Canvas(parent, width=width, height=height, background="black", highlightthickness=0)
+        self.canvas.create_text(self.left, 3, text=title, anchor=tk.NW, fill="white", font="Calibri, 10 bold")
+        self.valueText = self.canvas.create_text(width - 5, 3, text="", anchor=tk.NE, fill="white", font="Consolas, 9")
+
+        # The axes and guide lines only move if the chart is resized
+        self.frame = self.canvas.create_rectangle(self.left, self.top, width - 1, height - 1, outline="gray40")
+        self.maxText = self.canvas.create_text(self.left - 4, self.top, text=f"{yMax:g}", anchor=tk.E, fill="gray70", font="Consolas, 8")
+        self.zeroText = self.canvas.create_text(self.left - 4, height - 1, text="0", anchor=tk.E, fill="gray70", font="Consolas, 8")
+        self.guides = []
+        for guide in guides:
+            self.guides.append((guide, self.canvas.create_line(0, 0, 0, 0, fill="gray30", dash=(3, 3))))
+        self.placeGuides()
+
+        self.line = self.canvas.create_line(0, 0, 0, 0, fill="lime green", width=1)
+
+        # What the line shows, so a redraw only has to add the points appended since the last one
+        self.series = None
+        self.drawnTotal = 0
+        self.pointsPerColumn = 1
+        self.columnWidth = 1.0
+        self.firstColumn = 0        # Column at the left of the plot, counting from the first point ever appended
+        self.columns = 0            # Columns in the line, each one is a low and a high point
+        self.lastLow = 0.0          # Range of the last column, which gets more points until it is full
+        self.lastHigh = 0.0
+
+        self.canvas.bind("<Configure>", self.resize)
+
+
+    def placeGuides(self) -> None:
+        for guide, item in self.guides:
+            y = self.scaleY(guide)
+            self.canvas.coords(item, self.left, y, self.width - 1, y)
+
+
+    def scaleY(self, value):
+        return self.height - 1 - (value / self.yMax) * (self.height - 1 - self.top)
+
+
+    def resize(self, event) -> None:
+        """Moves everything to fit a new size of canvas"""
+        if (event.width, event.height) == (self.width, self.height):
+            return
+        self.width = event.width
+        self.height = event.height
+        self.canvas.coords(self.frame, self.left, self.top, self.width - 1, self.height - 1)
+        self.canvas.coords(self.valueText, self.width - 5, 3)
+        self.canvas.coords(self.zeroText, self.left - 4, self.height - 1)
+        self.placeGuides()
+
+        # Every point moves, so the line is built again
+        if self.series is not None:
+            self.rebuild(self.series)
+
+
+    def draw(self, series: RingSeries, label: str) -> None:
+        """Updates the line to show a series, only adding the points appended since it was last drawn"""
+        self.canvas.itemconfig(self.valueText, text=label)
+
+        added = series.total - self.drawnTotal
+        if series is not self.series or added > series.count:
+            self.rebuild(series)
+        elif added:
+            self.extend(series, added)
+
+
+    def rebuild(self, series: RingSeries) -> None:
+        """Replaces the line with every point of a series, scaled to fill the chart"""
+        self.series = series
+        self.drawnTotal = series.total
+
+        # Columns are sized so the whole ring fills the plot
+        plotWidth = self.width - 1 - self.left
+        self.pointsPerColumn = max(1, math.ceil(series.capacity / plotWidth))
+        self.columnWidth = plotWidth / max(1, math.ceil(series.capacity / self.pointsPerColumn) - 1)
+
+        # A column is dropped as soon as its oldest point is overwritten, so every column drawn covers the same points
+        # whether the line was built in one go or a few points at a time
+        self.firstColumn = -(-series.first // self.pointsPerColumn)
+        skipped = self.firstColumn * self.pointsPerColumn - series.first
+        times, values = series.ordered()
+        values = values[skipped:]
+        if len(values) == 0:
+            self.columns = 0
+            self.canvas.coords(self.line, 0, 0, 0, 0)
+            return
+
+        self.growY(float(values.max()))
+        columns, lows, highs = columnRanges(series.first + skipped, values, self.pointsPerColumn)
+        self.columns = len(columns)
+        self.lastLow, self.lastHigh = lows[-1], highs[-1]
+        self.canvas.coords(self.line, *self.columnCoords(columns, lows, highs))
+
+
+    def extend(self, series: RingSeries, added: int) -> None:
+        """Adds the newest points to the line, moving it along once the oldest points are overwritten"""
+        times, values = series.newest(added)
+        dropped = -(-series.first // self.pointsPerColumn) - self.firstColumn
+
+        # The line needs at least one column left to add onto, and the y range only ever grows,
+        # e.g. if a cluster is allowed more servers than expected
+        if self.columns - dropped < 2 or values.max() > self.yMax:
+            self.rebuild(series)
+            return
+
+        # Canvas line items index each coordinate separately, and each column is two points
+        if dropped > 0:
+            self.canvas.dchars(self.line, 0, dropped * 4 - 2)
+            self.canvas.move(self.line, -dropped * self.columnWidth, 0)
+            self.firstColumn += dropped
+            self.columns -= dropped
+
+        # The last column is replaced if the new points carry on filling it
+        columns, lows, highs = columnRanges(self.drawnTotal, values, self.pointsPerColumn)
+        if columns[0] == self.firstColumn + self.columns - 1:
+            lows[0] = min(lows[0], self.lastLow)
+            highs[0] = max(highs[0], self.lastHigh)
+            self.canvas.dchars(self.line, self.columns * 4 - 4, self.columns * 4 - 2)
+            self.columns -= 1
+
+        self.canvas.insert(self.line, tk.END, self.columnCoords(columns, lows, highs))
+        self.columns += len(columns)
+        self.lastLow, self.lastHigh = lows[-1], highs[-1]
+        self.drawnTotal = series.total
+
+
+    def columnCoords(self, columns: np.ndarray, lows: np.ndarray, highs: np.ndarray) -> list[float]:
+        """Returns the line coordinates of columns, as a stroke from the lowest to the highest value in each"""
+        xs = np.repeat(self.left + (columns - self.firstColumn) * self.columnWidth, 2)
+        ys = self.scaleY(np.column_stack((lows, highs)).ravel())
+        return np.column_stack((xs, ys)).ravel().tolist()
+
+
+    def growY(self, value: float) -> None:
+        """Raises the top of the y-axis to fit a value"""
+        if value > self.yMax:
+            self.yMax = value
+            self.canvas.itemconfig(self.maxText, text=f"{self.yMax:g}")
+            self.placeGuides()
+
+
+class ChartView(ttk.Frame):
+    """Utilisation and active server charts for one cluster at a time, chosen from every cluster seen"""
+    def __init__(self, parent, capacity: int = 3600, maxClusters: int = 100,
+                 refreshInterval: int = 500, maxQueued: int = 10000) -> None:
+        super().__init__(parent)
+        self.capacity = capacity                    # Points kept for each series
+        self.maxClusters = maxClusters              # Clusters beyond this are not charted, to bound memory use
+        self.refreshInterval = refreshInterval      # Milliseconds between each time the charts are updated
+
+        self.incoming = queue.Queue(maxsize=maxQueued)
+        self.series = {}        # Cluster name -> (utilisation series, active servers series)
+        self.selected = None
+        self.changed = False    # Whether the selected cluster has data which isn't drawn yet
+
+        # Cluster selection
+        clusterLabel = ttk.Label(self, text="Cluster:")
+        clusterLabel.grid(row=0, column=0, padx=(10, 0), pady=(0, 5), sticky=tk.W)
+
+        self.clusterBox = ttk.Combobox(self, state="readonly", width=30)
+        self.clusterBox.grid(row=0, column=0, padx=(70, 0), pady=(0, 5), sticky=tk.W)
+        self.clusterBox.bind("<<ComboboxSelected>>", lambda event: self.select(self.clusterBox.get()))
+
+        # Charts
+        self.utilChart = Chart(self, "Avg CPU utilisation (%)", 100, guides=(defaultConfig.lowLimit, defaultConfig.highLimit))
+        self.utilChart.canvas.grid(row=1, column=0, padx=10, pady=5)
+
+        self.activeChart = Chart(self, "Active servers", defaultConfig.maxServers)
+        self.activeChart.canvas.grid(row=2, column=0, padx=10, pady=5)
+
+        self.after(self.refreshInterval, self.refresh)
+
+
+    def push(self, topic: str, payload: bytes) -> None:
+        """Queues a received payload to be charted if it is telemetry, this is safe to call from any thread"""
+        try:
+            self.incoming.put_nowait((topic, payload, time.time()))
+        except queue.Full:
+            pass
+
+
+    def select(self, name: str) -> None:
+        self.selected = name
+        self.changed = True
+
+
+    def addPoint(self, name: str, timestamp: float, avgVcpuUtil: int | None, serversActive: int | None) -> None:
+        series = self.series.get(name)
+        if series is None:
+            if len(self.series) >= self.maxClusters:
+                return
+            series = self.series[name] = (RingSeries(self.capacity), RingSeries(self.capacity))
+            self.clusterBox.config(values=sorted(self.series))
+            if self.selected is None:
+                self.clusterBox.set(name)
+                self.select(name)
+
+        if avgVcpuUtil is not None:
+            series[0].append(timestamp, avgVcpuUtil)
+        if serversActive is not None:
+            series[1].append(timestamp, serversActive)
+        if name == self.selected:
+            self.changed = True
+
+
+    def decode(self, topic: str, payload: bytes, received: float) -> None:
+        """Adds the values in a payload to the charts"""
+        if isBinary(payload):
+            # Binary payloads carry both values, but a metric topic is only used for its own value,
+            # so the same tick published on both topics isn't charted twice
+            for record in decodeSnapshot(payload):
+                avgVcpuUtil = None if topic.endswith("/active") else record.avgVcpuUtil
+                serversActive = None if topic.endswith("/avg_cpu_util") else record.serversActive
+                self.addPoint(record.clusterId or defaultCluster, record.timestamp, avgVcpuUtil, serversActive)
+            return
+
+        telemetry = decodeTelemetry(topic, payload)
+        if telemetry is not None:
+            self.addPoint(telemetry.clusterId or defaultCluster, received, telemetry.avgVcpuUtil, telemetry.serversActive)
+
+
+    def refresh(self) -> None:
+        """Adds every queued payload to the series, and redraws the charts if they are visible and have changed"""
+        try:
+            while True:
+                topic, payload, received = self.incoming.get_nowait()
+
+                # A malformed payload only loses its own points, rather than every update after it
+                try:
+                    self.decode(topic, payload, received)
+                except Exception as e:
+                    print(f"Failed to chart a message on {topic}: {e!r}", file=sys.stderr)
+        except queue.Empty:
+            pass
+
+        try:
+            if self.changed and self.selected in self.series and self.winfo_viewable():
+                util, active = self.series[self.selected]
+                self.utilChart.draw(util, f"{util.latest:.0f}%" if util.count else "")
+                self.activeChart.draw(active, f"{active.latest:.0f}" if active.count else "")
+                self.changed = False
+        finally:
+            self.after(self.refreshInterval, self.refresh)
\ No newline at end of file
@@ -0,0 +1,333 @@
+from cluster_stats import ClusterStats
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+import random
+
+# The cluster model is kept separate from the MQTT code, so one process can simulate many clusters
+# and the model can be reused without needing a broker connection
+
+baseTopic = "simulation"
+
+# Warning messages published by a cluster, these are matched on by the monitor
+lowWarning = "Warning: CPU utilisation low"
+highWarning = "Warning: CPU utilisation high"
+capacityWarning = "Warning: Servers are at capacity"
+
+# Commands the monitor sends in response to each warning, warnings not in here are not handled
+warningCommands = {
+    lowWarning: "!scalein",
+    highWarning: "!scaleout"
+}
+
+# Seconds between each publish of the utilisation, active servers and cluster stats
+utilPeriod = 2
+activePeriod = 5
+statsPeriod = 10
+
+# How the clusters publish their metrics
+# topics publishes each metric on its own topic, snapshot publishes one combined binary message per tick instead,
+# and both does the two at once for consumers which haven't moved over to snapshots yet
+publishModes = ["topics", "snapshot", "both"]
+
+
+class SimMode(Enum):
+    NORMAL = 1
+    INCREASING = 2
+    DECREASING = 3
+
+
+# Range of the random step applied to the utilisation each tick for each simulation mode
+simModeSteps = {
+    SimMode.NORMAL.value: (-5, 5),
+    SimMode.INCREASING.value: (-5, 15),
+    SimMode.DECREASING.value: (-15, 5)
+}
+
+simModeCommands = {
+    "!simnormal": SimMode.NORMAL.value,
+    "!simincrease": SimMode.INCREASING.value,
+    "!simdecrease": SimMode.DECREASING.value
+}
+
+
+@dataclass(frozen=True)
+class ScalingConfig:
+    """Thresholds which decide when a cluster raises warnings and how far it scales, and how long servers take to change"""
+    lowLimit: int = 20          # Utilisation (%) below which the cluster counts towards a low warning
+    highLimit: int = 80         # Utilisation (%) above which the cluster counts towards a high warning
+    lowStreak: int = 10         # Low ticks in a row needed before warning, this is higher so we don't scale in too early
+    highStreak: int = 5         # High ticks in a row needed before warning
+    scaleOutStep: int = 2       # Servers added on scale out, since 1 isn't enough for a big difference
+    maxServers: int = 8         # Beyond 8 servers, we start getting diminishing returns
+    pendingDelay: int = 0       # Seconds a requested server waits for an instance before it starts booting
+    bootDelay: int = 0          # Seconds a server takes to boot before it takes any load
+    drainDelay: int = 0         # Seconds a removed server keeps running (and costing) while its connections drain
+
+
+defaultConfig = ScalingConfig()
+
+
+def clusterSeed(seed: int | str | None, index: int) -> str | None:
+    """Derives the seed of one cluster in a run, so every cluster gets its own repeatable random stream"""
+    if seed is None:
+        return None
+    return f"{seed}:{index}"
+
+
+def clusterTopic(clusterId: str | None, suffix: str) -> str:
+    """Returns the topic for a cluster, clusters without an ID use the original single cluster topics"""
+    if clusterId is None:
+        return f"{baseTopic}/{suffix}"
+    return f"{baseTopic}/{clusterId}/{suffix}"
+
+
+def takeServers(batches: deque, servers: int) -> int:
+    """Takes up to a number of servers from the newest batches of a server state, returns how many were taken"""
+    taken = 0
+    while batches and taken < servers:
+        batch = batches[-1]
+        count = min(batch[1], servers - taken)
+        batch[1] -= count
+        taken += count
+        if batch[1] == 0:
+            batches.pop()
+    return taken
+
+
+class Cluster:
+    """Simulated server cluster which owns its utilisation, server count and simulation mode"""
+    def __init__(self, clusterId: str | None = None, avgVcpuUtil: int = 10, serversActive: int = 1,
+                 config: ScalingConfig = defaultConfig, seed: int | str | None = None) -> None:
+        self.clusterId = clusterId
+        self.config = config
+        self.avgVcpuUtil = avgVcpuUtil
+        self.serversActive = serversActive      # Servers in service, which the workload is spread across
+        self.simMode = SimMode.NORMAL.value     # Start in normal simulation mode
+
+        # Servers on their way into or out of service, as [due time, servers] batches in the order they were started
+        # With no delays configured servers change state straight away, and these are always empty
+        self.clock = 0                          # Seconds simulated, moved on by each tick
+        self.pending = deque()
+        self.booting = deque()
+        self.draining = deque()
+        self.serversPending = 0
+        self.serversBooting = 0
+        self.serversDraining = 0
+
+        # Each cluster has its own random stream, so a run can be repeated by giving the same seed
+        self.rng = random.Random(seed)
+
+        # Number of consecutive ticks the utilisation has been too low/high
+        self.lowCount = 0
+        self.highCount = 0
+
+        # Running totals of cost and scaling, published on the stats topic
+        self.stats = ClusterStats(config.lowLimit, config.highLimit)
+
+        # Topics are built once, since they are used on every publish
+        self.avgTopic = clusterTopic(clusterId, "servers/avg_cpu_util")
+        self.activeTopic = clusterTopic(clusterId, "servers/active")
+        self.snapshotTopic = clusterTopic(clusterId, "servers/snapshot")
+        self.perServerTopic = clusterTopic(clusterId, "servers/per_server")
+        self.statesTopic = clusterTopic(clusterId, "servers/states")
+        self.statsTopic = clusterTopic(clusterId, "stats")
+        self.warningTopic = clusterTopic(clusterId, "warnings")
+        self.commandTopic = clusterTopic(clusterId, "commands")
+
+
+    @property
+    def serversRequested(self) -> int:
+        """Servers in service or on their way, which is the number scaling commands change"""
+        return self.serversActive + self.serversPending + self.serversBooting
+
+
+    @property
+    def serversRunning(self) -> int:
+        """Servers with a running instance, which is what the cluster costs"""
+        return self.serversActive + self.serversBooting + self.serversDraining
+
+
+    @property
+    def serverStates(self) -> tuple[int, int, int, int]:
+        """Servers active, pending, booting and draining"""
+        return self.serversActive, self.serversPending, self.serversBooting, self.serversDraining
+
+
+    @property
+    def hasServerStates(self) -> bool:
+        """Whether servers spend any time pending, booting or draining"""
+        config = self.config
+        return bool(config.pendingDelay or config.bootDelay or config.drainDelay)
+
+
+    def stepUtil(self) -> str | None:
+        """Advances the utilisation by one tick and returns a warning if one needs to be published"""
+        self.clock += utilPeriod
+        self.advanceServers()
+        self.stepLoad()
+        warning = self.checkLimits()
+
+        self.stats.recordTick(utilPeriod, self.avgVcpuUtil, self.serversRunning)
+        if warning:
+            command = warningCommands.get(warning)
+            self.stats.recordWarning(self.clock, None if command is None else command == "!scaleout")
+        return warning
+
+
+    def stepLoad(self) -> None:
+        """Moves the utilisation by one tick of a random walk biased by the simulation mode"""
+        # Create variation in data based on simulation mode
+        low, high = simModeSteps[self.simMode]
+        self.avgVcpuUtil += self.rng.randint(low, high)
+
+        # Make sure utilisation stays within bounds of 0-100%
+        self.avgVcpuUtil = max(0, min(self.avgVcpuUtil, 100))
+
+
+    def checkLimits(self) -> str | None:
+        """Counts the ticks the utilisation has been past the limits, and returns a warning once a streak is long enough"""
+        config = self.config
+
+        # Check if vCPU usage is too low/high and add to count
+        if self.avgVcpuUtil < config.lowLimit and self.serversRequested > 1:
+            self.lowCount += 1
+        else:
+            self.lowCount = 0
+
+        if self.avgVcpuUtil > config.highLimit:
+            self.highCount += 1
+        else:
+            self.highCount = 0
+
+        # Provide a recommendation to scale in/out
+        # Scaling in too early can cause resources to become overloaded fast, hence it needs to trigger low more times
+        # Scaling out too early can cause too many resources to be created too fast, wasting computational power
+        warning = None
+        if self.lowCount > config.lowStreak and self.serversRequested > 1:
+            warning = lowWarning
+            self.lowCount = 0
+
+        if self.highCount > config.highStreak:
+            # Once at the server cap, scaling out won't help, even if some of the servers are still booting
+            if self.serversRequested < config.maxServers:
+                warning = highWarning
+            else:
+                warning = capacityWarning       # There is no need to handle this warning in the monitor
+            self.highCount = 0
+
+        return warning
+
+
+    def scaleIn(self) -> None:
+        """Handles scaling in by decreasing the number of active servers."""
+        # Ensure at least 1 server is running
+        if self.serversRequested > 1:
+            self.setServers(self.serversRequested - 1)
+
+
+    def scaleOut(self) -> None:
+        """Handles scaling out by increasing the number of active servers."""
+        # Cap the number of servers so we don't get diminishing returns
+        self.setServers(min(self.serversRequested + self.config.scaleOutStep, self.config.maxServers))
+
+
+    def scaleTo(self, serversActive: int) -> None:
+        """Scales straight to a number of servers, kept between 1 and the server cap"""
+        serversActive = max(1, min(serversActive, self.config.maxServers))
+        if serversActive != self.serversRequested:
+            self.setServers(serversActive)
+
+
+    def setServers(self, servers: int) -> None:
+        """Requests a number of servers, starting new servers or draining ones no longer needed"""
+        change = servers - self.serversRequested
+        serversActive = self.serversActive
+        if change:
+            self.stats.recordScale(self.clock, change > 0)
+
+        if change > 0:
+            # Draining servers are still running, so they go straight back into service before any new ones start
+            restored = takeServers(self.draining, change)
+            self.serversDraining -= restored
+            serversActive += restored
+
+            if change > restored:
+                self.pending.append([self.clock + self.config.pendingDelay, change - restored])
+                self.serversPending += change - restored
+        elif change < 0:
+            # The newest servers which haven't finished starting are cancelled first, then servers in service drain
+            removing = -change
+            cancelled = takeServers(self.pending, removing)
+            self.serversPending -= cancelled
+            removing -= cancelled
+
+            cancelled = takeServers(self.booting, removing)
+            self.serversBooting -= cancelled
+            removing -= cancelled
+
+            if removing:
+                self.draining.append([self.clock + self.config.drainDelay, removing])
+                self.serversDraining += removing
+                serversActive -= removing
+
+        if serversActive != self.serversActive:
+            self.rebalance(serversActive)
+        self.advanceServers()
+
+
+    def advanceServers(self) -> None:
+        """Moves on any servers which have finished waiting, booting or draining"""
+        while self.pending and self.pending[0][0] <= self.clock:
+            dueTime, servers = self.pending.popleft()
+            self.serversPending -= servers
+            self.booting.append([dueTime + self.config.bootDelay, servers])
+            self.serversBooting += servers
+
+        booted = 0
+        while self.booting and self.booting[0][0] <= self.clock:
+            booted += self.booting.popleft()[1]
+        self.serversBooting -= booted
+
+        while self.draining and self.draining[0][0] <= self.clock:
+            self.serversDraining -= self.draining.popleft()[1]
+
+        if booted:
+            self.rebalance(self.serversActive + booted)
+
+
+    def rebalance(self, serversActive: int) -> None:
+        """Sets the number of active servers and spreads the current workload across them"""
+        oldServersActive = self.serversActive
+        self.serversActive = serversActive
+
+        # Change the average utilisation proportionally
+        # This assumes that the workload stays constant
+        self.avgVcpuUtil = int(self.avgVcpuUtil * (oldServersActive / self.serversActive))
+
+        # Make sure utilisation stays within bounds of 0-100%
+        self.avgVcpuUtil = max(0, min(self.avgVcpuUtil, 100))
+
+
+    def handleCommand(self, command: str) -> bool:
+        """Executes a command sent to the cluster, returns False if the command is not recognised"""
+        # Remove all whitespace from command and make everything lowercase
+        command = command.strip().lower()
+
+        if command == "!scalein":
+            self.scaleIn()
+        elif command == "!scaleout":
+            self.scaleOut()
+        elif command in simModeCommands:
+            self.simMode = simModeCommands[command]
+        elif command.startswith(("!scaleto ", "!scale ")):
+            # !scaleto <servers> sets the number of servers, !scale <+/-servers> changes it, both in one step
+            name, _, value = command.partition(" ")
+            try:
+                value = int(value)
+            except ValueError:
+                return False
+            self.scaleTo(value if name == "!scaleto" else self.serversRequested + value)
+        else:
+            return False
+        return True
\ No newline at end of file
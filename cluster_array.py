@@ -0,0 +1,130 @@
+from cluster import SimMode, ScalingConfig, defaultConfig, simModeSteps, lowWarning, highWarning, capacityWarning
+import numpy as np
+
+# Vectorised version of the cluster model in cluster.py
+# Every cluster is one element in a set of arrays, so a tick for the whole fleet is a handful of NumPy operations
+# instead of a Python loop over Cluster objects. The behaviour of each element matches Cluster.stepUtil()
+
+# Warning codes returned by ClusterArray.step()
+noWarning = 0
+lowWarningCode = 1
+highWarningCode = 2
+capacityWarningCode = 3
+
+# Index a warning code to get the message a Cluster would publish for it
+warningMessages = [None, lowWarning, highWarning, capacityWarning]
+
+# Lookup tables of the lowest step and number of possible steps for each simulation mode, indexed by the mode value
+stepLows = np.zeros(len(SimMode) + 1, dtype=np.int32)
+stepSpans = np.zeros(len(SimMode) + 1, dtype=np.float64)
+for mode, (low, high) in simModeSteps.items():
+    stepLows[mode] = low
+    stepSpans[mode] = high - low + 1
+
+
+class ClusterArray:
+    """Fleet of simulated clusters stored as arrays, stepped together in one operation"""
+    def __init__(self, count: int, avgVcpuUtil: int = 10, serversActive: int = 1,
+                 config: ScalingConfig = defaultConfig, seed: int | str | None = None) -> None:
+        # Servers change state instantly here, the pending, booting and draining states are only in Cluster
+        if config.pendingDelay or config.bootDelay or config.drainDelay:
+            raise ValueError("ClusterArray doesn't model server delays, use Cluster for pendingDelay, bootDelay and drainDelay")
+        self.config = config
+        self.rng = np.random.default_rng(list(seed.encode()) if isinstance(seed, str) else seed)
+
+        self.avgVcpuUtil = np.full(count, avgVcpuUtil, dtype=np.int32)
+        self.serversActive = np.full(count, serversActive, dtype=np.int32)
+        self.simMode = np.full(count, SimMode.NORMAL.value, dtype=np.int8)
+
+        # Number of consecutive ticks the utilisation has been too low/high
+        self.lowCount = np.zeros(count, dtype=np.int32)
+        self.highCount = np.zeros(count, dtype=np.int32)
+
+        # Reused between ticks, so stepping doesn't allocate new arrays each time
+        self.uniform = np.zeros(count, dtype=np.float64)
+        self.steps = np.zeros(count, dtype=np.int32)
+        self.warnings = np.zeros(count, dtype=np.int8)
+
+
+    def __len__(self) -> int:
+        return len(self.avgVcpuUtil)
+
+
+    def step(self) -> np.ndarray:
+        """Advances every cluster by one tick and returns an array of warning codes, one per cluster"""
+        return self.applySteps(self.randomSteps())
+
+
+    def randomSteps(self) -> np.ndarray:
+        """Draws the change in utilisation of every cluster for one tick, from the range of its simulation mode"""
+        # Scaling uniform floats into each range is several times faster than integers() with per-element bounds
+        self.rng.random(out=self.uniform)
+        self.uniform *= stepSpans[self.simMode]
+        np.copyto(self.steps, self.uniform, casting="unsafe")     # Truncates towards 0, the same as astype()
+        self.steps += stepLows[self.simMode]
+        return self.steps
+
+
+    def applySteps(self, steps: np.ndarray) -> np.ndarray:
+        """Moves the utilisation of every cluster by its step and returns an array of warning codes, one per cluster"""
+        self.avgVcpuUtil += steps
+
+        # Make sure utilisation stays within bounds of 0-100%
+        np.clip(self.avgVcpuUtil, 0, 100, out=self.avgVcpuUtil)
+
+        config = self.config
+
+        # Check if vCPU usage is too low/high and add to count, resetting the count otherwise
+        multipleServers = self.serversActive > 1
+        isLow = (self.avgVcpuUtil < config.lowLimit) & multipleServers
+        isHigh = self.avgVcpuUtil > config.highLimit
+        self.lowCount += 1
+        self.lowCount *= isLow
+        self.highCount += 1
+        self.highCount *= isHigh
+
+        # Provide a recommendation to scale in/out, then reset the count of any cluster that raised a warning
+        lowFired = (self.lowCount > config.lowStreak) & multipleServers
+        highFired = self.highCount > config.highStreak
+        self.lowCount[lowFired] = 0
+        self.highCount[highFired] = 0
+
+        # Once at the server cap, scaling out won't help
+        self.warnings.fill(noWarning)
+        self.warnings[lowFired] = lowWarningCode
+        self.warnings[highFired] = np.where(self.serversActive[highFired] < config.maxServers, highWarningCode, capacityWarningCode)
+
+        return self.warnings
+
+
+    def scaleIn(self, mask: np.ndarray) -> None:
+        """Removes one server from each selected cluster, keeping at least 1 server running"""
+        self.rebalance(mask, np.maximum(self.serversActive - 1, 1))
+
+
+    def scaleOut(self, mask: np.ndarray) -> None:
+        """Adds servers to each selected cluster, capped at the maximum number of servers"""
+        self.rebalance(mask, np.minimum(self.serversActive + self.config.scaleOutStep, self.config.maxServers))
+
+
+    def scaleTo(self, mask: np.ndarray, serversActive: np.ndarray | int) -> None:
+        """Sets the number of servers of each selected cluster in one step, kept between 1 and the server cap"""
+        serversActive = np.clip(np.broadcast_to(serversActive, self.serversActive.shape), 1, self.config.maxServers)
+        self.rebalance(mask, serversActive.astype(self.serversActive.dtype))
+
+
+    def rebalance(self, mask: np.ndarray, serversActive: np.ndarray) -> None:
+        """Sets the active servers of the selected clusters and spreads their current workload across them"""
+        oldServersActive = self.serversActive[mask]
+        newServersActive = serversActive[mask]
+
+        # Change the average utilisation proportionally, assuming the workload stays constant
+        # The float ratio is kept so the results match the scalar model exactly
+        avgVcpuUtil = (self.avgVcpuUtil[mask] * (oldServersActive / newServersActive)).astype(np.int32)
+
+        self.avgVcpuUtil[mask] = np.clip(avgVcpuUtil, 0, 100)
+        self.serversActive[mask] = newServersActive
+
+
+    def setSimMode(self, mask: np.ndarray, simMode: int) -> None:
+        self.simMode[mask] = simMode
\ No newline at end of file
@@ -0,0 +1,250 @@
+from async_mqtt import AsyncMqttClient, brokerSettings
+from dotenv import load_dotenv
+from cluster import Cluster, ScalingConfig, baseTopic, clusterSeed, utilPeriod, activePeriod, statsPeriod, publishModes
+from telemetry import encodeTelemetry, encodeSnapshot, encodeServerUtil, encodeServerStates
+from server_workload import WorkloadCluster, loadBalancers
+from load_trace import traceRates
+from console import Console, consoleLevels
+from routing import Message
+import argparse
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+
+# The broker, username and password are stored in a .env file which needs to be made if not already included
+load_dotenv()
+
+# This runs many independent server clusters in one process, all sharing a single MQTT connection
+# Each cluster publishes under simulation/<cluster_id>/..., and listens for commands on simulation/<cluster_id>/commands
+# Commands sent to simulation/commands are applied to every cluster
+# In snapshot mode, clusters are grouped into batches which each publish one message per tick on simulation/snapshots/batch-<n>
+# A batch size of 1 publishes each cluster's snapshot on simulation/<cluster_id>/servers/snapshot instead
+#
+# The scheduler and the MQTT client (async_mqtt.py) share one asyncio event loop, so commands are applied as they
+# arrive without any locking
+
+# Connection info
+broker, port, username, password = brokerSettings()
+subscribeTopics = [f"{baseTopic}/+/commands", f"{baseTopic}/commands"]
+client_id = f'fleet-{random.randint(0, 1000)}'                      # Assign a random ID to the client device
+eventsPerYield = 100        # Events run before the scheduler lets the client send, when many are due at once
+
+
+class ClusterScheduler:
+    """Drives many clusters from a single event loop, publishing over one shared client"""
+    def __init__(self, client: AsyncMqttClient, clusters: list[Cluster], console: Console, binaryTelemetry: bool = False,
+                 publishMode: str = "topics", batchSize: int = 1, statsPeriod: float = statsPeriod) -> None:
+        self.client = client
+        self.console = console
+        self.binaryTelemetry = binaryTelemetry
+        self.publishMode = publishMode
+        self.clusters = {cluster.clusterId: cluster for cluster in clusters}
+        self.isRunning = True
+
+        # Heap of (due time, sequence, event, cluster), the sequence stops ties from comparing clusters
+        self.events = []
+        self.sequence = itertools.count()
+
+        # Spread the first tick of each cluster over its period, so the clusters don't all publish at once
+        now = time.monotonic()
+        if publishMode != "snapshot":
+            for cluster in clusters:
+                self.schedule(now + random.uniform(0, utilPeriod), self.tickUtil, cluster)
+                self.schedule(now + random.uniform(0, activePeriod), self.tickActive, cluster)
+
+        self.statsPeriod = statsPeriod
+        if statsPeriod > 0:
+            for cluster in clusters:
+                self.schedule(now + random.uniform(0, statsPeriod), self.tickStats, cluster)
+
+        if publishMode != "topics":
+            for i in range(0, len(clusters), batchSize):
+                batch = clusters[i:i + batchSize]
+                topic = batch[0].snapshotTopic if batchSize == 1 else f"{baseTopic}/snapshots/batch-{i // batchSize}"
+                self.schedule(now + random.uniform(0, utilPeriod), self.tickSnapshot, (topic, batch))
+
+
+    def schedule(self, dueTime: float, event, cluster) -> None:
+        heapq.heappush(self.events, (dueTime, next(self.sequence), event, cluster))
+
+
+    def publish(self, topic: str, msg: str | bytes) -> None:
+        self.console.pub(topic, msg, self.client.publishNowait(topic, msg))
+
+
+    def tickUtil(self, dueTime: float, cluster: Cluster) -> None:
+        """Publishes the average CPU utilisation of a cluster and steps its simulation"""
+        if self.binaryTelemetry:
+            self.publish(cluster.avgTopic, encodeTelemetry(cluster.clusterId, cluster.avgVcpuUtil, cluster.serversActive))
+        else:
+            self.publish(cluster.avgTopic, f"Avg CPU utilisation: {cluster.avgVcpuUtil}%")
+        if isinstance(cluster, WorkloadCluster):
+            self.publish(cluster.perServerTopic, encodeServerUtil(cluster.serverUtil, self.binaryTelemetry))
+
+        warning = cluster.stepUtil()
+        if warning:
+            self.publish(cluster.warningTopic, warning)
+
+        self.schedule(dueTime + utilPeriod, self.tickUtil, cluster)
+
+
+    def tickActive(self, dueTime: float, cluster: Cluster) -> None:
+        """Publishes the active servers of a cluster"""
+        if self.binaryTelemetry:
+            self.publish(cluster.activeTopic, encodeTelemetry(cluster.clusterId, cluster.avgVcpuUtil, cluster.serversActive))
+        else:
+            self.publish(cluster.activeTopic, f"Active servers: {cluster.serversActive}")
+        if cluster.hasServerStates:
+            self.publish(cluster.statesTopic, encodeServerStates(cluster.serverStates, self.binaryTelemetry))
+        self.schedule(dueTime + activePeriod, self.tickActive, cluster)
+
+
+    def tickStats(self, dueTime: float, cluster: Cluster) -> None:
+        """Publishes the running totals of a cluster"""
+        self.publish(cluster.statsTopic, cluster.stats.toJson())
+        self.schedule(dueTime + self.statsPeriod, self.tickStats, cluster)
+
+
+    def tickSnapshot(self, dueTime: float, snapshot: tuple[str, list[Cluster]]) -> None:
+        """Publishes the state of a batch of clusters in one message"""
+        topic, batch = snapshot
+        self.publish(topic, encodeSnapshot(batch))
+
+        # When the per-topic messages are also being published, they step the clusters instead
+        if self.publishMode == "snapshot":
+            for cluster in batch:
+                if isinstance(cluster, WorkloadCluster):
+                    self.publish(cluster.perServerTopic, encodeServerUtil(cluster.serverUtil, self.binaryTelemetry))
+                if cluster.hasServerStates:
+                    self.publish(cluster.statesTopic, encodeServerStates(cluster.serverStates, self.binaryTelemetry))
+                warning = cluster.stepUtil()
+                if warning:
+                    self.publish(cluster.warningTopic, warning)
+
+        self.schedule(dueTime + utilPeriod, self.tickSnapshot, snapshot)
+
+
+    def handleCommand(self, message: Message) -> None:
+        """Applies a received command to its clusters"""
+        # simulation/commands goes to all clusters, simulation/<cluster_id>/commands goes to one
+        levels = message.topic.split("/")
+        if len(levels) == 2:
+            targets = self.clusters.values()
+        elif len(levels) == 3 and levels[1] in self.clusters:
+            targets = [self.clusters[levels[1]]]
+        else:
+            return
+
+        for cluster in targets:
+            cluster.handleCommand(message.text)
+
+
+    async def run(self) -> None:
+        """Runs events as they become due until stopped"""
+        ran = 0
+        while self.isRunning:
+            dueTime = self.events[0][0]
+            delay = dueTime - time.monotonic()
+            if delay > 0:
+                # Commands are received and applied while waiting for the next event
+                await asyncio.sleep(delay)
+                continue
+
+            # Thousands of clusters can fall due together, so the client gets a turn every so often to send what
+            # has been queued and read any commands. Publishing never waits, so the clusters keep ticking while the
+            # client is reconnecting, and messages which don't fit in the queue are dropped and counted as failed
+            ran += 1
+            if ran % eventsPerYield == 0:
+                await asyncio.sleep(0)
+
+            _, _, event, cluster = heapq.heappop(self.events)
+            event(dueTime, cluster)
+
+
+    def stop(self) -> None:
+        self.isRunning = False
+
+
+async def main(clusters: list[Cluster], console: Console, args: argparse.Namespace) -> None:
+    client = AsyncMqttClient(client_id, broker, port, username, password)
+    scheduler = ClusterScheduler(client, clusters, console, args.binary, args.publish_mode, args.batch_size, args.stats_period)
+
+    # Every received message is printed, and commands are passed on to the scheduler
+    client.onMessage = console.sub
+    for topic in subscribeTopics:
+        client.subscribe(topic, scheduler.handleCommand)
+    print(f"Subscribed to topics: {subscribeTopics}\n")
+
+    # Without this, publishing would start before the connection is fully established
+    # It only fails if the broker refuses the connection, otherwise the client keeps retrying
+    if not await client.connect():
+        print("Failed to connect to the MQTT broker. Exiting...")
+        await client.close()
+        exit(1)
+
+    try:
+        await scheduler.run()
+    finally:
+        scheduler.stop()
+        if client.dropped:
+            print(f"{client.dropped} messages were dropped while the publish queue was full")
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates many server clusters over one MQTT connection")
+    parser.add_argument("-n", "--clusters", type=int, default=100, help="number of clusters to simulate")
+    parser.add_argument("-s", "--seed", help="seed for the simulation, the same seed repeats the same run")
+    parser.add_argument("-b", "--binary", action="store_true", help="publish compact binary telemetry instead of text")
+    parser.add_argument("-m", "--publish-mode", choices=publishModes, default="topics",
+                        help="publish each metric on its own topic, one snapshot message per tick, or both")
+    parser.add_argument("--batch-size", type=int, default=1, help="number of clusters in each snapshot message")
+    parser.add_argument("--console", choices=consoleLevels, default="summary",
+                        help="print nothing, periodic message rates, or every message")
+    parser.add_argument("--stats-period", type=float, default=statsPeriod,
+                        help="seconds between each cluster's stats messages, 0 turns them off")
+    parser.add_argument("--pending-delay", type=int, default=0, help="seconds a requested server waits before it starts booting")
+    parser.add_argument("--boot-delay", type=int, default=0, help="seconds a server takes to boot before it takes any load")
+    parser.add_argument("--drain-delay", type=int, default=0, help="seconds a removed server keeps running while it drains")
+    parser.add_argument("--balancer", choices=loadBalancers,
+                        help="simulate each server behind this load balancer instead of one averaged utilisation")
+    parser.add_argument("--load-trace", help="request rate trace (CSV or .bin) to replay in a loop, uses the per-server model")
+    parser.add_argument("--trace-scale", type=float, default=1.0, help="multiplier for every rate in the load trace")
+    args = parser.parse_args()
+
+    if args.clusters < 1:
+        parser.error("--clusters must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    print(f"Starting the simulation of {args.clusters} server clusters...")
+
+    # Zero pad the IDs so they sort in order
+    width = len(str(args.clusters - 1))
+    config = ScalingConfig(pendingDelay=args.pending_delay, bootDelay=args.boot_delay, drainDelay=args.drain_delay)
+    balancer = args.balancer or ("round-robin" if args.load_trace else None)
+    if balancer:
+        # Every cluster replays the same trace, which is only read once and shared between them
+        if args.load_trace:
+            rates = itertools.tee(traceRates(args.load_trace, args.trace_scale, loop=True), args.clusters)
+        else:
+            rates = [None] * args.clusters
+        clusters = [WorkloadCluster(f"cluster-{i:0{width}d}", config=config, seed=clusterSeed(args.seed, i), balancer=balancer,
+                                    rates=rates[i]) for i in range(args.clusters)]
+    else:
+        clusters = [Cluster(f"cluster-{i:0{width}d}", config=config, seed=clusterSeed(args.seed, i)) for i in range(args.clusters)]
+
+    console = Console(args.console)
+
+    try:
+        asyncio.run(main(clusters, console, args))
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt detected, disconnecting from MQTT broker...")
+    except Exception as e:
+        print(f"Error during main operation: {e}")
+    finally:
+        console.close()
+        print("Client disconnected, exiting program.")
\ No newline at end of file
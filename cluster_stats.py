@@ -0,0 +1,89 @@
+import json
+
+# Running totals of what a cluster has cost and how well it has been scaled, kept by each Cluster as it ticks
+# Every total is updated as it happens rather than worked out from a history, so each tick is O(1) however long the
+# run, and a snapshot of the totals is published as JSON on simulation/<cluster_id>/stats every statsPeriod seconds
+#
+# Times come from the cluster's own clock, which moves on one tick at a time, so latencies are to the nearest tick
+
+
+class ClusterStats:
+    """Server-seconds, time past the scaling limits, scale events and warning response times of one cluster"""
+    def __init__(self, lowLimit: int, highLimit: int) -> None:
+        self.lowLimit = lowLimit
+        self.highLimit = highLimit
+
+        self.seconds = 0
+        self.serverSeconds = 0          # Seconds of every running server, including booting and draining ones
+        self.utilSeconds = 0            # Utilisation (%) x seconds, for the mean utilisation
+        self.secondsAboveHigh = 0
+        self.secondsBelowLow = 0
+
+        self.warnings = 0
+        self.scaleOuts = 0
+        self.scaleIns = 0
+
+        # Time from a warning to the scale event it asks for, which is the monitor's (or an autoscaler's) response
+        # Keyed by whether the warning asks for a scale out, holding the time of the first warning not yet responded to
+        self.warningSince = {True: None, False: None}
+        self.responses = 0
+        self.responseSeconds = 0
+        self.maxResponseSeconds = 0
+
+
+    def recordTick(self, period: float, avgVcpuUtil: int, serversRunning: int) -> None:
+        """Adds one tick of a cluster's utilisation and servers to the totals"""
+        self.seconds += period
+        self.serverSeconds += serversRunning * period
+        self.utilSeconds += avgVcpuUtil * period
+        if avgVcpuUtil > self.highLimit:
+            self.secondsAboveHigh += period
+        elif avgVcpuUtil < self.lowLimit:
+            self.secondsBelowLow += period
+
+
+    def recordWarning(self, now: float, isScaleOut: bool | None) -> None:
+        """Counts a warning, isScaleOut is None for warnings which no scale event can respond to"""
+        self.warnings += 1
+        if isScaleOut is not None and self.warningSince[isScaleOut] is None:
+            self.warningSince[isScaleOut] = now
+
+
+    def recordScale(self, now: float, isScaleOut: bool) -> None:
+        """Counts a change in the number of servers requested"""
+        if isScaleOut:
+            self.scaleOuts += 1
+        else:
+            self.scaleIns += 1
+
+        warningTime = self.warningSince[isScaleOut]
+        if warningTime is not None:
+            responseSeconds = now - warningTime
+            self.responses += 1
+            self.responseSeconds += responseSeconds
+            self.maxResponseSeconds = max(self.maxResponseSeconds, responseSeconds)
+
+        # A warning the other way is out of date once the cluster has been scaled
+        self.warningSince[True] = self.warningSince[False] = None
+
+
+    def snapshot(self) -> dict:
+        """Returns the totals so far"""
+        seconds = self.seconds or 1
+        return {
+            "seconds": self.seconds,
+            "server_seconds": self.serverSeconds,
+            "mean_util": round(self.utilSeconds / seconds, 2),
+            "seconds_above_high": self.secondsAboveHigh,
+            "seconds_below_low": self.secondsBelowLow,
+            "warnings": self.warnings,
+            "scale_outs": self.scaleOuts,
+            "scale_ins": self.scaleIns,
+            "responses": self.responses,
+            "mean_response_seconds": round(self.responseSeconds / self.responses, 2) if self.responses else None,
+            "max_response_seconds": self.maxResponseSeconds
+        }
+
+
+    def toJson(self) -> str:
+        return json.dumps(self.snapshot())
\ No newline at end of file
@@ -0,0 +1,153 @@
+from telemetry import payloadText
+import queue
+import sys
+import threading
+import time
+
+# Console output for the MQTT components, kept off the publish and receive paths
+# Callers only queue the raw message details, all formatting and printing happens on a background thread,
+# so a slow terminal can never block the MQTT client's event loop
+#
+# Levels:
+#   off      nothing is printed
+#   summary  message rates are printed periodically
+#   verbose  every message is printed in full, as well as the summary
+
+consoleLevels = ["off", "summary", "verbose"]
+
+# Message templates, these are what dedent used to produce for each message
+pubTemplate = """\
+--------------------[PUB]--------------------
+{topic}
+
+{body}
+---------------------------------------------
+"""
+
+subTemplate = """\
+====================[SUB]====================
+{topic}
+QoS: {qos}
+Retained?: {retain}
+
+Message:
+{payload}
+=============================================
+"""
+
+
+class Console:
+    """Prints published and received messages from a background thread at the chosen level of detail"""
+    def __init__(self, level: str = "verbose", summaryPeriod: float = 10, maxQueued: int = 10000) -> None:
+        if level not in consoleLevels:
+            raise ValueError(f"Console level must be one of {consoleLevels}, got '{level}'")
+
+        self.level = level
+        self.verbose = level == "verbose"
+        self.summaryPeriod = summaryPeriod
+
+        # Messages waiting to be printed, when this fills up, messages are dropped rather than blocking the caller
+        self.pending = queue.Queue(maxsize=maxQueued)
+
+        # Counters may miss the odd increment when several threads publish at once, which is fine for rates
+        self.published = 0
+        self.failed = 0
+        self.received = 0
+        self.dropped = 0
+
+        self.isRunning = threading.Event()
+        self.isRunning.set()
+        self.thread = None
+        if level != "off":
+            self.thread = threading.Thread(target=self.printLoop, daemon=True)
+            self.thread.start()
+
+
+    def pub(self, topic: str, payload: str | bytes, status: int) -> None:
+        """Records a published message"""
+        if status == 0:
+            self.published += 1
+        else:
+            self.failed += 1
+
+        if self.verbose:
+            self.enqueue(("pub", topic, payload, status))
+
+
+    def sub(self, msg) -> None:
+        """Records a received MQTT message"""
+        self.received += 1
+
+        if self.verbose:
+            self.enqueue(("sub", msg.topic, msg.payload, msg.qos, msg.retain))
+
+
+    def enqueue(self, entry: tuple) -> None:
+        try:
+            self.pending.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+
+    def format(self, entry: tuple) -> str:
+        if entry[0] == "pub":
+            _, topic, payload, status = entry
+            msg = payloadText(topic, payload) if isinstance(payload, bytes) else payload
+            if status == 0:
+                body = f"Sent:\n{msg}"
+            else:
+                body = f'Error code: {status}\nFailed to publish: "{msg}"'
+            return pubTemplate.format(topic=topic, body=body)
+
+        _, topic, payload, qos, retain = entry
+        return subTemplate.format(topic=topic, qos=qos, retain=retain, payload=payloadText(topic, payload))
+
+
+    def addLine(self, lines: list[str], entry: tuple) -> None:
+        """Formats an entry to be printed, an entry which can't be formatted is skipped instead of stopping the output"""
+        try:
+            lines.append(self.format(entry))
+        except Exception as e:
+            self.dropped += 1
+            print(f"Failed to print a message on {entry[1]}: {e!r}", file=sys.stderr, flush=True)
+
+
+    def printLoop(self) -> None:
+        """Prints queued messages in batches, with a summary every period"""
+        lastSummary = time.monotonic()
+        lastCounts = (0, 0, 0)
+
+        while self.isRunning.is_set() or not self.pending.empty():
+            # Wait for a message, then grab everything else that is already queued so it's written in one go
+            lines = []
+            try:
+                self.addLine(lines, self.pending.get(timeout=0.2))
+                while len(lines) < 1000:
+                    self.addLine(lines, self.pending.get_nowait())
+            except queue.Empty:
+                pass
+
+            if lines:
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
+
+            now = time.monotonic()
+            if now - lastSummary >= self.summaryPeriod:
+                counts = (self.published, self.received, self.failed)
+                self.printSummary(now - lastSummary, counts, lastCounts)
+                lastSummary = now
+                lastCounts = counts
+
+
+    def printSummary(self, elapsed: float, counts: tuple, lastCounts: tuple) -> None:
+        pubRate = (counts[0] - lastCounts[0]) / elapsed
+        subRate = (counts[1] - lastCounts[1]) / elapsed
+        print(f"[{time.strftime('%H:%M:%S')}] PUB {pubRate:.1f} msg/s, SUB {subRate:.1f} msg/s "
+              f"(total {counts[0]} sent, {counts[1]} received, {counts[2]} failed, {self.dropped} not printed)", flush=True)
+
+
+    def close(self) -> None:
+        """Prints anything still queued and stops the printing thread"""
+        self.isRunning.clear()
+        if self.thread:
+            self.thread.join()
\ No newline at end of file
@@ -1,14 +1,21 @@
-from paho.mqtt import client as mqtt_client
+from async_mqtt import AsyncMqttClient, ClientThread, connectRefusals
 import tkinter as tk
 from tkinter import ttk, messagebox
-from socket import gaierror
 from textwrap import dedent
+from message_view import MessageView
+from routing import checkTopicFilter
 import random
 
 # References: https://www.geeksforgeeks.org/python-gui-tkinter/
 #             https://www.w3schools.com/python/python_classes.asp
 #             https://www.geeksforgeeks.org/python-tkinter-messagebox-widget/
 
+# The MQTT client runs on a thread of its own (async_mqtt.ClientThread), as the main thread belongs to Tk
+# Its callbacks only touch Tk through after(), and are removed before the thread is stopped, as Tk can't be called
+# from the client's thread while the main thread is waiting for it to finish
+
+maxMessages = 1000  # Number of received messages kept for the message box
+
 
 class MqttClientGui(tk.Tk):
     def __init__(self) -> None:
@@ -151,26 +158,12 @@ class MqttClientGui(tk.Tk):
 
 
         # Message box
+        # Only the newest messages are kept, and only the ones on screen are drawn, so it doesn't slow down over time
         messagesFrame = ttk.LabelFrame(messageTab, text="Received Messages", padding=(0, 10))
         messagesFrame.grid(row=1, column=1, rowspan=2, padx=(10, 0), pady=10, sticky=tk.W)
-        scrollbar = tk.Scrollbar(messagesFrame)
-        scrollbar.grid(row=0, column=1, sticky=tk.NSEW)
-
-        self.messagesDisplay = tk.Text(
-            messagesFrame,
-            height=20,
-            width=42,
-            font="Consolas, 9",
-            background="black", 
-            foreground="white",
-            insertbackground="white",
-            yscrollcommand=scrollbar.set
-        )
-
-        self.messagesDisplay.grid(row=0, column=0, padx=(10, 0))
-        self.messagesDisplay.insert(tk.END, "=====================================\n")  # This is to create the top of the first message
-        scrollbar.config(command=self.messagesDisplay.yview)                            # Sets the scrollbar to control the y-position in the messages box
-        self.messagesDisplay.config(state=tk.DISABLED)                                  # Disable any input into the messages box
+
+        self.messagesView = MessageView(messagesFrame, maxMessages)
+        self.messagesView.grid(row=0, column=0)
 
 
     def getConnData(self) -> dict[str, str]:
@@ -184,21 +177,28 @@ class MqttClientGui(tk.Tk):
 
 
     def connect_mqtt(self) -> None:
-        """Connects client to the MQTT broker."""
-        def on_connect(client, userdata, flags, rc, properties) -> None:
-            """Callback when connected to the broker."""
+        """Connects client to the MQTT broker, it keeps reconnecting in the background until disconnected"""
+        def on_connect(rc: int) -> None:
+            """Callback when the broker answers a connection attempt, called on the client's thread"""
             if rc == 0:
                 self.isConnected = True
-                self.connStatLabel.config(text="Connected", foreground="green")
+                self.after(0, lambda: self.connStatLabel.config(text="Connected", foreground="green"))
                 self.after(0, lambda: messagebox.showinfo("Connection successful", "Connected to MQTT Broker!"))
             else:
                 self.isConnected = False  # Ensure connected is False in case the first connection was successful
-                self.connStatLabel.config(text="Not Connected", foreground="red")
-                self.client.loop_stop() # If this is not here, with the wrong authentication details it will keep retrying the connection
+                self.after(0, lambda: self.connStatLabel.config(text="Not Connected", foreground="red"))
                 self.after(0, lambda: messagebox.showerror("Connection unsuccessful", f"Failed to connect. Reason code: {rc}\n"))
+                if rc in connectRefusals:
+                    self.after(0, self.stopClient)  # The client gives up on these, e.g. wrong authentication details
+
+        def on_disconnect(error: Exception | None) -> None:
+            """Callback when the connection is lost, the client reconnects by itself"""
+            self.isConnected = False
+            self.after(0, lambda: self.connStatLabel.config(text="Reconnecting...", foreground="red"))
+            self.after(0, lambda: messagebox.showerror("Disconnection with error", f"Disconnected with an error: {error}\n"))
 
-        # Exit if already connected
-        if self.isConnected:
+        # Exit if already connected, or still trying to connect
+        if self.client:
             messagebox.showwarning("Connection active", "Please close the current connection before connecting again")
             return
         
@@ -227,41 +227,41 @@ class MqttClientGui(tk.Tk):
             messagebox.showerror("Input Error", "Port must be between 1 and 65535")
             return
 
-        # Connect client object to MQTT broker
-        self.client = mqtt_client.Client(
-            client_id=f'gui-mqtt-{random.randint(0, 1000)}',
-            callback_api_version=mqtt_client.CallbackAPIVersion.VERSION2
-        )
-        self.client.username_pw_set(username, password)
-        self.client.on_connect = on_connect
-        
-        try:
-            self.client.connect(broker, port)
-            self.client.loop_start()
-        except (TimeoutError, ConnectionRefusedError, gaierror) as e:
-            messagebox.showerror("Connection Error", f"Connection error: {e}")
-        except Exception as e:
-            messagebox.showerror("Unexpected Error", f"An unexpected error occurred: {e}")
+        # Start the client, connection errors are printed while it keeps retrying
+        client = AsyncMqttClient(f'gui-mqtt-{random.randint(0, 1000)}', broker, port, username or None, password or None)
+        client.onConnect = on_connect
+        client.onDisconnect = on_disconnect
+        client.onMessage = self.showMessage
+
+        self.client = ClientThread(client)
+        self.client.start()
+        self.connStatLabel.config(text="Connecting...", foreground="red")
 
 
     def disconnect_mqtt(self) -> None:
         """Disconnects client from the MQTT broker."""
-        def on_disconnect(client, userdata, flags, rc, properties):
-            """Callback when disconnected from the broker."""
-            self.isConnected = False
+        # Only attempt disconnecting if a client has been started, or errors happen
+        if not self.client:
+            return
+
+        wasConnected = self.isConnected
+        self.stopClient()
+        if wasConnected:
+            messagebox.showinfo("Disconnection successful", "Successfully disconnected from MQTT Broker")
 
-            if rc == 0:
-                self.after(0, lambda: messagebox.showinfo("Disconnection successful", "Successfully disconnected from MQTT Broker"))
-            else:
-                self.after(0, lambda: messagebox.showerror("Disconnection with error", f"Disconnected with an error. Reason code: {rc}\n"))
-            
-            self.connStatLabel.config(text="Not Connected", foreground="red")
 
-        self.client.on_disconnect = on_disconnect
+    def stopClient(self) -> None:
+        """Disconnects and stops the client's thread"""
+        if not self.client:
+            return
 
-        # Only attempt disconnecting if client is already connected, or errors happen
-        if self.isConnected:
-            self.client.disconnect()
+        self.client.client.onConnect = None
+        self.client.client.onDisconnect = None
+        self.client.stop()
+        self.client = None
+        self.isConnected = False
+        self.subscribeTopics = []
+        self.connStatLabel.config(text="Not Connected", foreground="red")
 
 
     def publish(self) -> None:
@@ -280,37 +280,32 @@ class MqttClientGui(tk.Tk):
             return
         
         for topic in topics:
-            result = self.client.publish(topic, msg)
-            status = result[0]
+            status = self.client.publish(topic, msg)
             if status == 0:
                 self.after(0, lambda: messagebox.showinfo("Message Published", f"Sent `{msg}` to topic `{topic}`"))
             else:
                 self.after(0, lambda: messagebox.showinfo("Error", f"Failed to send message to topic `{topic}`"))
 
 
-    def subscribe(self) -> None:
-        def on_message(client, userdata, msg) -> None:
-            def updateMsgBox() -> None:
-                # Enable text input and display message
-                self.messagesDisplay.config(state=tk.NORMAL)
-                self.messagesDisplay.insert(tk.END, dedent(f"""\
-                    {msg.topic}
-                    QoS: {msg.qos}
-                    Retained?: {msg.retain}
-                    
-                    Message:
-                    {msg.payload.decode()}
-                    =====================================
-                    """))
-                # This is for auto-scrolling of the message box if the user is at the bottom
-                # Range is because the values for yview are inconsistent
-                # Not a perfect solution, it just snaps back if you don't scroll up enough
-                if self.messagesDisplay.yview()[1] < 1.0 and self.messagesDisplay.yview()[1] >= 0.8:
-                    self.messagesDisplay.yview(tk.END)
-                self.messagesDisplay.config(state=tk.DISABLED)    # Disable text input
-
-            self.after(0, updateMsgBox)
+    def showMessage(self, msg) -> None:
+        """Shows every received message once, however many of the subscribed topics it matches"""
+        # Messages are drawn in batches by the message view's timer, instead of one Tk callback per message
+        self.messagesView.push(msg.topic, dedent(f"""\
+            {msg.topic}
+            QoS: {msg.qos}
+            Retained?: {msg.retain}
+            
+            Message:
+            {msg.payload.decode(errors="replace")}
+            =====================================
+            """))
+
+
+    def ignore(self, message) -> None:
+        """Handler for the subscribed topics, as their messages are already shown by showMessage"""
 
+
+    def subscribe(self) -> None:
         # Make sure connection is established before subscribing
         if not self.isConnected:
             messagebox.showerror("Error", "Please connect to an MQTT broker first")
@@ -321,30 +316,35 @@ class MqttClientGui(tk.Tk):
         if not topics or (len(topics) == 1 and topics[0] == ''):
             messagebox.showerror("Error", "Please input a topic to subscribe to")
             return
+
+        # Make sure every topic is valid before changing any subscriptions
+        try:
+            for topic in topics:
+                checkTopicFilter(topic)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
         # Unsubscribe from previously subscribed topics if any
-        if self.subscribeTopics:
-            self.client.unsubscribe([topic[0] for topic in self.subscribeTopics])
+        for topic in self.subscribeTopics:
+            self.client.unsubscribe(topic, self.ignore)
 
-        # Clear old subscriptions array and add in new subscriptions
-        self.subscribeTopics = [(topic, 0) for topic in topics]     # If adding in multiple topics, the QoS must also be specified
-        self.client.subscribe(self.subscribeTopics)
-        self.client.on_message = on_message
-        messagebox.showinfo("Subscribed to topic", f"Subscribed to {[topic[0] for topic in self.subscribeTopics]}")
+        # Clear old subscriptions array and add in new subscriptions, the client subscribes again after any reconnect
+        self.subscribeTopics = topics
+        for topic in self.subscribeTopics:
+            self.client.subscribe(topic, self.ignore)
+        messagebox.showinfo("Subscribed to topic", f"Subscribed to {self.subscribeTopics}")
 
 
     def onClose(self):
-        if self.isConnected and self.client:
+        if self.client:
             try:
-                self.client.disconnect()
+                self.stopClient()
             except Exception as e:
                 print(f"Error during disconnect: {e}")
-        if self.client:
-            self.client.loop_stop()
         self.destroy()
 
 
 if __name__ == "__main__":
     window = MqttClientGui()
-    window.mainloop()
-    window.client.loop_stop()
\ No newline at end of file
+    window.mainloop()
\ No newline at end of file
@@ -0,0 +1,504 @@
+from cluster import (Cluster, ScalingConfig, clusterSeed, defaultConfig, warningCommands, simModeCommands, utilPeriod,
+                     activePeriod, statsPeriod)
+from cluster_array import ClusterArray, lowWarningCode, highWarningCode
+from server_workload import WorkloadCluster, loadBalancers
+from telemetry import encodeServerUtil, encodeServerStates
+from load_trace import traceRates
+from scaling_policy import ScalingPolicy, makePolicy, parseClusterPolicy, policyNames
+from warning_handler import WarningHandler, monitorCooldown
+import argparse
+import csv
+import heapq
+import itertools
+import numpy as np
+import sys
+import time
+
+# Runs the server cluster model and the monitor's reactions to its warnings on a virtual clock
+# There is no broker and no sleeping, each event jumps the clock straight to the time it is due,
+# so days of simulated load can be replayed in seconds. Every message that would have been published is
+# passed to an optional trace callback as (time, topic, message)
+#
+# Warnings go through the same WarningHandler as the monitor and the autoscaler, with each cooldown timed on the
+# virtual clock, so a headless run sends the same commands the live components would
+
+
+class HeadlessSim:
+    """Simulates clusters and the monitor together on a virtual clock"""
+    def __init__(self, clusters: list[Cluster], trace=None, slaLimit: int = defaultConfig.highLimit,
+                 policies: dict[str | None, ScalingPolicy] | None = None) -> None:
+        self.clusters = clusters
+        self.trace = trace
+        self.slaLimit = slaLimit        # Utilisation (%) above which a cluster counts as overloaded
+
+        # Cluster ID -> scaling policy, clusters without one are scaled by the monitor's response to their warnings
+        self.policies = policies or {}
+        self.now = 0.0
+
+        # Heap of (due time, sequence, event, cluster, argument), the sequence stops ties from comparing clusters
+        self.events = []
+        self.sequence = itertools.count()
+
+        # The monitor handles one warning at a time for each cluster, commands are applied to the cluster they are for
+        self.warningHandler = WarningHandler(self.publishCommand, monitorCooldown)
+        self.commandClusters = {cluster.commandTopic: cluster for cluster in clusters}
+
+        self.published = 0
+        self.scaleIns = 0
+        self.scaleOuts = 0
+
+        # Totals across all clusters, each utilisation tick stands for one period of time
+        self.serverSeconds = 0
+        self.secondsOverHigh = 0
+        self.hotServerSeconds = 0       # Seconds of single servers over the limit, only counted with the per-server model
+
+        # Time to relief, from scaling out an overloaded cluster until its utilisation is back under the limit
+        # With boot delays this includes the time the new servers take to start
+        self.overloadedSince = {}       # Cluster ID -> time of the first scale out since it became overloaded
+        self.reliefCount = 0
+        self.reliefSeconds = 0.0
+        self.maxReliefSeconds = 0.0
+
+        # The publishers start at the same time, just like the threads in server_cluster.py
+        for cluster in clusters:
+            self.schedule(0, self.tickUtil, cluster)
+            self.schedule(0, self.tickActive, cluster)
+            self.schedule(0, self.tickStats, cluster)
+
+
+    def schedule(self, dueTime: float, event, cluster: Cluster, arg=None) -> None:
+        heapq.heappush(self.events, (dueTime, next(self.sequence), event, cluster, arg))
+
+
+    def publish(self, topic: str, msg: str) -> None:
+        self.published += 1
+        if self.trace:
+            self.trace(self.now, topic, msg)
+
+
+    def tickUtil(self, cluster: Cluster, arg=None) -> None:
+        """Publishes the average CPU utilisation of a cluster and steps its simulation"""
+        self.publish(cluster.avgTopic, f"Avg CPU utilisation: {cluster.avgVcpuUtil}%")
+
+        # Servers cost from when they start booting until they finish draining
+        self.serverSeconds += cluster.serversRunning * utilPeriod
+        if cluster.avgVcpuUtil > self.slaLimit:
+            self.secondsOverHigh += utilPeriod
+        elif cluster.clusterId in self.overloadedSince:
+            relief = self.now - self.overloadedSince.pop(cluster.clusterId)
+            self.reliefCount += 1
+            self.reliefSeconds += relief
+            self.maxReliefSeconds = max(self.maxReliefSeconds, relief)
+        if isinstance(cluster, WorkloadCluster):
+            self.publish(cluster.perServerTopic, encodeServerUtil(cluster.serverUtil))
+            self.hotServerSeconds += int((cluster.serverUtil > self.slaLimit).sum()) * utilPeriod
+
+        # The policy decides from the utilisation and server counts just published, like a subscriber would
+        avgVcpuUtil = cluster.avgVcpuUtil
+        serversActive = cluster.serversActive
+        serversRequested = cluster.serversRequested
+        policy = self.policies.get(cluster.clusterId)
+
+        warning = cluster.stepUtil()
+        if warning:
+            self.publish(cluster.warningTopic, warning)
+            if policy is None:
+                self.handleWarning(cluster, warning)
+
+        if policy is not None:
+            desired = policy.decide(self.now, avgVcpuUtil, serversActive, serversRequested)
+            if desired is not None:
+                self.scaleCluster(cluster, desired)
+
+        self.schedule(self.now + utilPeriod, self.tickUtil, cluster)
+
+
+    def tickActive(self, cluster: Cluster, arg=None) -> None:
+        """Publishes the active servers of a cluster"""
+        self.publish(cluster.activeTopic, f"Active servers: {cluster.serversActive}")
+        if cluster.hasServerStates:
+            self.publish(cluster.statesTopic, encodeServerStates(cluster.serverStates))
+        self.schedule(self.now + activePeriod, self.tickActive, cluster)
+
+
+    def tickStats(self, cluster: Cluster, arg=None) -> None:
+        """Publishes the running totals of a cluster"""
+        self.publish(cluster.statsTopic, cluster.stats.toJson())
+        self.schedule(self.now + statsPeriod, self.tickStats, cluster)
+
+
+    def handleWarning(self, cluster: Cluster, warning: str) -> None:
+        """Responds to a warning the same way the monitor app does"""
+        avgVcpuUtil = cluster.avgVcpuUtil   # Before the command rebalances the cluster
+        if not self.warningHandler.handleWarning(cluster.warningTopic, warning):
+            return
+
+        if warningCommands[warning] == "!scalein":
+            self.scaleIns += 1
+        else:
+            self.scaleOuts += 1
+            self.startRelief(cluster, avgVcpuUtil)
+        self.schedule(self.now + self.warningHandler.cooldown, self.finishWarning, cluster)
+
+
+    def scaleCluster(self, cluster: Cluster, desired: int) -> None:
+        """Scales a cluster to the number of servers its policy wants in one command"""
+        if desired < cluster.serversRequested:
+            self.scaleIns += 1
+        else:
+            self.scaleOuts += 1
+            self.startRelief(cluster, cluster.avgVcpuUtil)
+        self.sendCommand(cluster, f"!scaleto {desired}")
+
+
+    def startRelief(self, cluster: Cluster, avgVcpuUtil: int) -> None:
+        """Starts timing the relief of a cluster which is being scaled out while overloaded"""
+        if avgVcpuUtil > self.slaLimit:
+            self.overloadedSince.setdefault(cluster.clusterId, self.now)
+
+
+    @property
+    def meanReliefSeconds(self) -> float:
+        return self.reliefSeconds / self.reliefCount if self.reliefCount else 0.0
+
+
+    # Warnings and responses are counted by each cluster
+    @property
+    def warnings(self) -> int:
+        return sum(cluster.stats.warnings for cluster in self.clusters)
+
+
+    @property
+    def responses(self) -> int:
+        return sum(cluster.stats.responses for cluster in self.clusters)
+
+
+    @property
+    def responseSeconds(self) -> float:
+        return sum(cluster.stats.responseSeconds for cluster in self.clusters)
+
+
+    def finishWarning(self, cluster: Cluster, arg=None) -> None:
+        self.warningHandler.finishWarning(cluster.warningTopic)
+
+
+    def publishCommand(self, topic: str, command: str) -> None:
+        """Publishes a command from the warning handler, applying it to the cluster it is for"""
+        cluster = self.commandClusters.get(topic)
+        if cluster is None:
+            self.publish(topic, command)    # !startlog and !stoplog are only for the logger
+        else:
+            self.sendCommand(cluster, command)
+
+
+    def sendCommand(self, cluster: Cluster, command: str) -> None:
+        """Publishes a command and applies it to the cluster straight away"""
+        self.publish(cluster.commandTopic, command)
+        cluster.handleCommand(command)
+
+
+    def scheduleCommand(self, dueTime: float, command: str) -> None:
+        """Sends a command to every cluster at a given time, e.g. to change the simulation mode"""
+        for cluster in self.clusters:
+            self.schedule(dueTime, self.sendCommand, cluster, command)
+
+
+    def run(self, duration: float) -> None:
+        """Runs every event due within the duration, in seconds of simulated time"""
+        while self.events and self.events[0][0] <= duration:
+            dueTime, _, event, cluster, arg = heapq.heappop(self.events)
+            self.now = dueTime
+            event(cluster, arg)
+
+
+class ArraySim:
+    """Simulates a fleet of clusters and the monitor together on a virtual clock, with the clusters in a ClusterArray
+
+    Every cluster ticks at the same times, so each tick steps the whole fleet at once instead of going through the
+    event heap one cluster at a time. This only covers the monitor's responses to warnings with servers changing
+    state instantly, which is the same as HeadlessSim without policies, load balancers or server delays
+    """
+    def __init__(self, clusters: ClusterArray, slaLimit: int = defaultConfig.highLimit,
+                 cooldown: float = monitorCooldown) -> None:
+        self.clusters = clusters
+        self.slaLimit = slaLimit
+        self.cooldown = cooldown
+        self.commands = []      # Heap of (due time, sequence, command) for commands sent to every cluster
+        self.sequence = itertools.count()
+
+        count = len(clusters)
+        self.everyCluster = np.ones(count, dtype=bool)
+        self.nextUtil = 0.0
+        self.nextActive = 0.0
+        self.nextStats = 0.0
+
+        # Each cluster's clock, which moves on one tick at a time like Cluster.clock
+        self.clock = 0
+
+        # WarningHandler state for every cluster, a cluster in cooldown suppresses its warnings until the cooldown ends
+        self.coolingDown = np.zeros(count, dtype=bool)
+        self.cooldownEnds = np.zeros(count, dtype=np.float64)
+        self.cooling = 0
+
+        self.published = 0
+        self.scaleIns = 0
+        self.scaleOuts = 0
+        self.serverSeconds = 0
+        self.secondsOverHigh = 0
+
+        # Time to relief, NaN for clusters which aren't being timed
+        self.overloadedSince = np.full(count, np.nan)
+        self.reliefCount = 0
+        self.reliefSeconds = 0.0
+        self.maxReliefSeconds = 0.0
+
+        # The ClusterStats totals of warnings and response times, summed across the fleet
+        # Keyed by whether the warning asks for a scale out, NaN for clusters without a warning waiting for a response
+        self.warnings = 0
+        self.warningSince = {True: np.full(count, np.nan), False: np.full(count, np.nan)}
+        self.responses = 0
+        self.responseSeconds = 0
+        self.maxResponseSeconds = 0
+
+
+    @property
+    def meanReliefSeconds(self) -> float:
+        return self.reliefSeconds / self.reliefCount if self.reliefCount else 0.0
+
+
+    def tickUtil(self, now: float) -> None:
+        """Publishes the average CPU utilisation of every cluster, steps them and responds to their warnings"""
+        clusters = self.clusters
+        self.published += len(clusters)
+
+        self.serverSeconds += int(clusters.serversActive.sum()) * utilPeriod
+        overloaded = clusters.avgVcpuUtil > self.slaLimit
+        self.secondsOverHigh += int(overloaded.sum()) * utilPeriod
+        relieved = ~overloaded & ~np.isnan(self.overloadedSince)
+        if relieved.any():
+            relief = now - self.overloadedSince[relieved]
+            self.reliefCount += len(relief)
+            self.reliefSeconds += float(relief.sum())
+            self.maxReliefSeconds = max(self.maxReliefSeconds, float(relief.max()))
+            self.overloadedSince[relieved] = np.nan
+
+        warnings = clusters.step()
+        self.clock += utilPeriod
+        warned = int(np.count_nonzero(warnings))
+        if not warned:
+            return
+        self.published += warned
+        self.warnings += warned
+
+        isLow = warnings == lowWarningCode
+        isHigh = warnings == highWarningCode
+        for isScaleOut, fired in ((True, isHigh), (False, isLow)):
+            since = self.warningSince[isScaleOut]
+            since[fired & np.isnan(since)] = self.clock
+
+        # Warnings from clusters in cooldown are suppressed, the rest get a command and start their cooldown
+        handled = (isLow | isHigh) & ~self.coolingDown
+        count = int(np.count_nonzero(handled))
+        if not count:
+            return
+        if self.cooling == 0:
+            self.published += 1     # !startlog
+        self.cooling += count
+        self.coolingDown |= handled
+        self.cooldownEnds[handled] = now + self.cooldown
+        self.published += count
+
+        scaleOut = handled & isHigh
+        scaleIn = handled & isLow
+        self.scaleOuts += int(np.count_nonzero(scaleOut))
+        self.scaleIns += int(np.count_nonzero(scaleIn))
+
+        # Relief is timed from the utilisation before the command rebalances the cluster
+        startRelief = scaleOut & (clusters.avgVcpuUtil > self.slaLimit) & np.isnan(self.overloadedSince)
+        self.overloadedSince[startRelief] = now
+
+        self.scale(clusters.scaleOut, scaleOut)
+        self.scale(clusters.scaleIn, scaleIn)
+
+
+    def finishWarnings(self, now: float) -> None:
+        """Ends the cooldown of every cluster whose cooldown is over"""
+        if not self.cooling:
+            return
+        finished = self.coolingDown & (self.cooldownEnds <= now)
+        count = int(np.count_nonzero(finished))
+        if count:
+            self.coolingDown &= ~finished
+            self.cooling -= count
+            if self.cooling == 0:
+                self.published += 1     # !stoplog
+
+
+    def scale(self, scale, mask: np.ndarray, *args) -> None:
+        """Scales the selected clusters, counting responses to their warnings the same way ClusterStats does"""
+        before = self.clusters.serversActive.copy()
+        scale(mask, *args)
+        after = self.clusters.serversActive
+        changed = after != before
+        for isScaleOut, direction in ((True, after > before), (False, after < before)):
+            since = self.warningSince[isScaleOut][changed & direction]
+            since = since[~np.isnan(since)]
+            if len(since):
+                responseSeconds = self.clock - since
+                self.responses += len(since)
+                self.responseSeconds += float(responseSeconds.sum())
+                self.maxResponseSeconds = max(self.maxResponseSeconds, float(responseSeconds.max()))
+
+        # A warning the other way is out of date once the cluster has been scaled
+        self.warningSince[True][changed] = np.nan
+        self.warningSince[False][changed] = np.nan
+
+
+    def sendCommand(self, command: str) -> None:
+        """Publishes a command to every cluster and applies it, the same way Cluster.handleCommand() does"""
+        clusters = self.clusters
+        self.published += len(clusters)
+        command = command.strip().lower()
+
+        if command == "!scalein":
+            self.scale(clusters.scaleIn, self.everyCluster)
+        elif command == "!scaleout":
+            self.scale(clusters.scaleOut, self.everyCluster)
+        elif command in simModeCommands:
+            clusters.setSimMode(self.everyCluster, simModeCommands[command])
+        elif command.startswith(("!scaleto ", "!scale ")):
+            name, _, value = command.partition(" ")
+            try:
+                value = int(value)
+            except ValueError:
+                return
+            self.scale(clusters.scaleTo, self.everyCluster, value if name == "!scaleto" else clusters.serversActive + value)
+
+
+    def scheduleCommand(self, dueTime: float, command: str) -> None:
+        """Sends a command to every cluster at a given time, e.g. to change the simulation mode"""
+        heapq.heappush(self.commands, (dueTime, next(self.sequence), command))
+
+
+    def run(self, duration: float) -> None:
+        """Runs every tick due within the duration, in seconds of simulated time"""
+        count = len(self.clusters)
+        while True:
+            now = min(self.nextUtil, self.nextActive, self.nextStats)
+            if now > duration:
+                break
+
+            # Events at the same time run in the order HeadlessSim would run them: commands scheduled up front go
+            # before the ticks (apart from at the start, where the ticks were scheduled first), then cooldowns end
+            while self.commands and (self.commands[0][0] < now or self.commands[0][0] == now > 0):
+                self.sendCommand(heapq.heappop(self.commands)[2])
+            self.finishWarnings(now)
+
+            if self.nextUtil == now:
+                self.tickUtil(now)
+                self.nextUtil += utilPeriod
+            if self.nextActive == now:
+                self.published += count
+                self.nextActive += activePeriod
+            if self.nextStats == now:
+                self.published += count
+                self.nextStats += statsPeriod
+
+        while self.commands and self.commands[0][0] <= duration:
+            self.sendCommand(heapq.heappop(self.commands)[2])
+        self.finishWarnings(duration)
+
+
+def parseCommand(value: str) -> tuple[float, str]:
+    """Parses a scheduled command in the form <seconds>:<command>"""
+    dueTime, _, command = value.partition(":")
+    try:
+        return float(dueTime), command
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected <seconds>:<command>, got '{value}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the server cluster simulation in accelerated time, without a broker")
+    parser.add_argument("--hours", type=float, default=24, help="hours of simulated time to run for")
+    parser.add_argument("-n", "--clusters", type=int, default=1, help="number of clusters to simulate")
+    parser.add_argument("-s", "--seed", help="seed for the simulation, the same seed repeats the same run")
+    parser.add_argument("-c", "--command", type=parseCommand, action="append", default=[],
+                        help="command to send to every cluster at a time, e.g. 600:!simincrease (may be repeated)")
+    parser.add_argument("-p", "--policy", choices=policyNames, default="warnings", help="scaling policy for every cluster")
+    parser.add_argument("--cluster-policy", type=parseClusterPolicy, action="append", default=[],
+                        help="scaling policy for one cluster, e.g. cluster-3=predictive (may be repeated)")
+    parser.add_argument("--pending-delay", type=int, default=0, help="seconds a requested server waits before it starts booting")
+    parser.add_argument("--boot-delay", type=int, default=0, help="seconds a server takes to boot before it takes any load")
+    parser.add_argument("--drain-delay", type=int, default=0, help="seconds a removed server keeps running while it drains")
+    parser.add_argument("--balancer", choices=loadBalancers,
+                        help="simulate each server behind this load balancer instead of one averaged utilisation")
+    parser.add_argument("--load-trace", help="request rate trace (CSV or .bin) to replay, uses the per-server model")
+    parser.add_argument("--trace-scale", type=float, default=1.0, help="multiplier for every rate in the load trace")
+    parser.add_argument("--trace-loop", action="store_true", help="replay the load trace from the start when it ends")
+    parser.add_argument("-t", "--trace", help="CSV file to write every published message to, use - for stdout")
+    parser.add_argument("--vectorised", action="store_true",
+                        help="step every cluster at once with NumPy, for large fleets scaled by the monitor's responses to warnings")
+    args = parser.parse_args()
+
+    if args.vectorised and (args.policy != "warnings" or args.cluster_policy or args.balancer or args.load_trace or args.trace
+                            or args.pending_delay or args.boot_delay or args.drain_delay):
+        parser.error("--vectorised only runs the warnings policy, without server delays, load balancers, load traces or a trace")
+
+    config = ScalingConfig(pendingDelay=args.pending_delay, bootDelay=args.boot_delay, drainDelay=args.drain_delay)
+    balancer = args.balancer or ("round-robin" if args.load_trace else None)
+    traceFile = None
+
+    if args.vectorised:
+        sim = ArraySim(ClusterArray(args.clusters, config=config, seed=args.seed))
+    else:
+        # Every cluster replays the same trace, which is only read once and shared between them
+        if args.load_trace:
+            rates = itertools.tee(traceRates(args.load_trace, args.trace_scale, args.trace_loop), args.clusters)
+        else:
+            rates = [None] * args.clusters
+
+        def makeCluster(clusterId: str | None, seed: str | None, rates) -> Cluster:
+            if balancer:
+                return WorkloadCluster(clusterId, config=config, seed=seed, balancer=balancer, rates=rates)
+            return Cluster(clusterId, config=config, seed=seed)
+
+        # A single cluster uses the same topics as server_cluster.py
+        if args.clusters == 1:
+            clusters = [makeCluster(None, clusterSeed(args.seed, 0), rates[0])]
+        else:
+            clusters = [makeCluster(f"cluster-{i}", clusterSeed(args.seed, i), rates[i]) for i in range(args.clusters)]
+
+        trace = None
+        if args.trace:
+            traceFile = sys.stdout if args.trace == "-" else open(args.trace, "w", newline="")
+            writer = csv.writer(traceFile)
+            writer.writerow(["time", "topic", "message"])
+            trace = lambda now, topic, msg: writer.writerow([now, topic, msg])
+
+        clusterPolicies = dict(args.cluster_policy)
+        policies = {cluster.clusterId: makePolicy(clusterPolicies.get(cluster.clusterId, args.policy), config) for cluster in clusters}
+
+        sim = HeadlessSim(clusters, trace, policies={clusterId: policy for clusterId, policy in policies.items() if policy})
+
+    for dueTime, command in args.command:
+        sim.scheduleCommand(dueTime, command)
+
+    startTime = time.perf_counter()
+    try:
+        sim.run(args.hours * 3600)
+    finally:
+        if traceFile and traceFile is not sys.stdout:
+            traceFile.close()
+
+    elapsed = time.perf_counter() - startTime
+    print(f"Simulated {args.hours} hours for {args.clusters} clusters in {elapsed:.2f} seconds", file=sys.stderr)
+    print(f"{sim.published} messages, {sim.scaleOuts} scale outs, {sim.scaleIns} scale ins", file=sys.stderr)
+    print(f"{sim.serverSeconds / 3600:.2f} server hours, {sim.secondsOverHigh / 3600:.2f} cluster hours over {sim.slaLimit}%, "
+          f"time to relief {sim.meanReliefSeconds:.0f}s mean, {sim.maxReliefSeconds:.0f}s max", file=sys.stderr)
+
+    # The response time is from a warning to the next scale event
+    print(f"{sim.warnings} warnings, {sim.responses} responded to, "
+          f"{sim.responseSeconds / sim.responses if sim.responses else 0:.1f}s mean response time", file=sys.stderr)
+    if balancer:
+        print(f"{sim.hotServerSeconds / 3600:.2f} hours of single servers over {sim.slaLimit}%", file=sys.stderr)
\ No newline at end of file
@@ -0,0 +1,192 @@
+from cluster import utilPeriod
+import argparse
+import csv
+import math
+import random
+import struct
+import sys
+
+# Request rate traces, which drive the per-server workload model (server_workload.py) with a recorded traffic shape
+# instead of the simulation mode's random walk
+#
+# A trace is a list of (time, rate) samples, the time in seconds from the start of the trace and the rate in requests
+# per second. Samples can be any distance apart, the rate is interpolated between them for each utilisation tick
+#
+#   CSV     time,rate rows, a header row is skipped. A file with one column is rates at a fixed interval
+#   Binary  any file ending in .bin, little-endian float64 (time, rate) records back to back with no header
+#
+# Every stage is a generator, so a trace is read a chunk at a time as the clusters tick rather than loaded up front,
+# and traces far larger than memory can be replayed
+
+sampleStruct = struct.Struct("<dd")
+chunkSamples = 4096     # Binary samples read from the file at a time
+
+
+def readCsvTrace(path: str, interval: float = utilPeriod):
+    """Yields the (time, rate) samples of a CSV trace, single column traces are spaced interval seconds apart"""
+    with open(path, newline="") as file:
+        sample = 0
+        firstRow = True
+        for line, row in enumerate(csv.reader(file), 1):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                values = [float(value) for value in row[:2]]
+            except ValueError:
+                if firstRow:
+                    firstRow = False
+                    continue    # Header
+                raise ValueError(f"Invalid sample on line {line} of {path}: {row}")
+            firstRow = False
+
+            if len(values) == 1:
+                yield sample * interval, values[0]
+            else:
+                yield values[0], values[1]
+            sample += 1
+
+
+def readBinaryTrace(path: str):
+    """Yields the (time, rate) samples of a binary trace"""
+    with open(path, "rb") as file:
+        while chunk := file.read(chunkSamples * sampleStruct.size):
+            if len(chunk) % sampleStruct.size:
+                raise ValueError(f"Truncated sample at the end of {path}")
+            yield from sampleStruct.iter_unpack(chunk)
+
+
+def readTrace(path: str, interval: float = utilPeriod):
+    """Yields the (time, rate) samples of a trace in either format"""
+    return readBinaryTrace(path) if path.endswith(".bin") else readCsvTrace(path, interval)
+
+
+def writeTrace(path: str, samples) -> int:
+    """Writes (time, rate) samples to a trace in the format given by the file extension, returns the samples written"""
+    count = 0
+    if path.endswith(".bin"):
+        with open(path, "wb") as file:
+            chunk = []
+            for sample in samples:
+                chunk.append(sampleStruct.pack(*sample))
+                if len(chunk) == chunkSamples:
+                    file.write(b"".join(chunk))
+                    count += len(chunk)
+                    chunk.clear()
+            file.write(b"".join(chunk))
+            count += len(chunk)
+    else:
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["time", "rate"])
+            for time, rate in samples:
+                writer.writerow([round(time, 3), round(rate, 3)])
+                count += 1
+    return count
+
+
+def resample(samples, period: float = utilPeriod):
+    """Yields the rate at every period seconds from the first sample, interpolating linearly between samples"""
+    samples = iter(samples)
+    try:
+        lastTime, lastRate = next(samples)
+    except StopIteration:
+        return
+
+    # Tick times are counted rather than summed, so rounding errors don't build up over a long trace
+    startTime = lastTime
+    tick = 0
+    for time, rate in samples:
+        if time <= lastTime:
+            raise ValueError(f"Trace times must increase, got {time} after {lastTime}")
+        while (now := startTime + tick * period) < time:
+            yield lastRate + (rate - lastRate) * (now - lastTime) / (time - lastTime)
+            tick += 1
+        lastTime, lastRate = time, rate
+    yield lastRate
+
+
+def traceRates(path: str, scale: float = 1.0, loop: bool = False, interval: float = utilPeriod):
+    """Yields the request rate of each utilisation tick from a trace, ready to pass to a WorkloadCluster
+
+    scale multiplies every rate, e.g. to fit production traffic to the simulated cluster size,
+    and loop starts the trace again from the beginning when it ends
+    """
+    while True:
+        empty = True
+        for rate in resample(readTrace(path, interval)):
+            empty = False
+            yield rate * scale
+        if empty or not loop:
+            return
+
+
+def syntheticTrace(hours: float, baseRate: float, peakRate: float, flashCrowds: int = 0, flashSize: float = 3.0,
+                   interval: float = 60, noise: float = 0.05, seed: int | str | None = None):
+    """Yields the samples of a made up trace with a daily cycle and flash crowds, for trying traces out
+
+    The rate is lowest at 04:00 and highest at 16:00, and each flash crowd multiplies the rate by up to flashSize,
+    rising over a minute and dying away over about 15 minutes
+    """
+    rng = random.Random(seed)
+    duration = hours * 3600
+    crowds = sorted(rng.uniform(0, duration) for _ in range(flashCrowds))
+
+    for sample in range(int(duration // interval) + 1):
+        time = sample * interval
+        daily = (1 - math.cos(2 * math.pi * (time - 4 * 3600) / 86400)) / 2
+        rate = baseRate + (peakRate - baseRate) * daily
+
+        surge = 1.0
+        for start in crowds:
+            if start <= time:
+                since = time - start
+                surge += (flashSize - 1) * min(since / 60, 1) * math.exp(-since / 900)
+        yield time, max(0.0, rate * surge * rng.gauss(1, noise))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates, converts and inspects request rate traces")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a synthetic trace with a daily cycle and flash crowds")
+    generate.add_argument("output", help="trace file to write, ending in .bin for the binary format")
+    generate.add_argument("--hours", type=float, default=24, help="length of the trace")
+    generate.add_argument("--base-rate", type=float, default=50, help="requests per second at the quietest time of day")
+    generate.add_argument("--peak-rate", type=float, default=500, help="requests per second at the busiest time of day")
+    generate.add_argument("--flash-crowds", type=int, default=2, help="number of flash crowds at random times")
+    generate.add_argument("--flash-size", type=float, default=3, help="most a flash crowd multiplies the rate by")
+    generate.add_argument("--interval", type=float, default=60, help="seconds between samples")
+    generate.add_argument("-s", "--seed", help="seed for the noise and flash crowd times")
+
+    convert = commands.add_parser("convert", help="convert a trace between the CSV and binary formats")
+    convert.add_argument("input", help="trace file to read")
+    convert.add_argument("output", help="trace file to write, ending in .bin for the binary format")
+    convert.add_argument("--interval", type=float, default=utilPeriod, help="seconds between samples of a single column CSV")
+
+    summary = commands.add_parser("summary", help="print the length and rates of a trace")
+    summary.add_argument("input", help="trace file to read")
+    summary.add_argument("--interval", type=float, default=utilPeriod, help="seconds between samples of a single column CSV")
+    args = parser.parse_args()
+
+    match args.command:
+        case "generate":
+            samples = syntheticTrace(args.hours, args.base_rate, args.peak_rate, args.flash_crowds, args.flash_size,
+                                     args.interval, seed=args.seed)
+            print(f"Wrote {writeTrace(args.output, samples)} samples to {args.output}", file=sys.stderr)
+        case "convert":
+            print(f"Wrote {writeTrace(args.output, readTrace(args.input, args.interval))} samples to {args.output}", file=sys.stderr)
+        case "summary":
+            # Streamed like a replay, so this works on traces of any size
+            count, total, low, high = 0, 0.0, math.inf, -math.inf
+            firstTime = lastTime = None
+            for time, rate in readTrace(args.input, args.interval):
+                firstTime = time if firstTime is None else firstTime
+                lastTime = time
+                count += 1
+                total += rate
+                low, high = min(low, rate), max(high, rate)
+            if not count:
+                print(f"{args.input} has no samples")
+            else:
+                print(f"{count} samples over {(lastTime - firstTime) / 3600:.2f} hours")
+                print(f"Rate (requests/s): min {low:.1f}, mean {total / count:.1f}, max {high:.1f}")
\ No newline at end of file
@@ -0,0 +1,359 @@
+from mqtt_packets import (CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP, SUBSCRIBE, SUBACK, UNSUBSCRIBE,
+                          UNSUBACK, PINGREQ, PINGRESP, DISCONNECT, protocolNames, makePacket, publishPacket, readPacket,
+                          PacketReader)
+from routing import TopicRouter, topicMatches
+import argparse
+import asyncio
+import itertools
+import threading
+import time
+
+# Lightweight MQTT broker for running the simulation offline, or load testing it without a shared broker
+# It supports the part of MQTT 3.1.1 (and 3.1) the project uses: QoS 0 delivery, + and # wildcards, retained messages,
+# keep alives and last will messages. QoS 1 and 2 publishes are acknowledged so clients don't resend them, but every
+# subscription is granted QoS 0, and sessions aren't kept after a client disconnects
+#
+# Subscriptions are stored in the same topic trie the components use to route messages (routing.py), so routing a
+# message costs the same however many clients are subscribed. Each message is encoded once for all of its subscribers
+#
+# Clients which can't keep up have messages dropped once their send buffer is full, rather than the broker holding
+# every message in memory, which QoS 0 allows. Broker stats are published on $SYS/broker/... every statsInterval seconds
+
+connectTimeout = 10                             # Seconds a new connection has to send CONNECT
+maxBuffered = 4 * 1024 * 1024                   # Bytes waiting to be sent to a client before its messages are dropped
+statsInterval = 10
+
+
+class Session:
+    """Connection of one client to the broker"""
+    def __init__(self, broker, writer: asyncio.StreamWriter, clientId: str, keepAlive: int, will) -> None:
+        self.broker = broker
+        self.writer = writer
+        self.clientId = clientId
+        self.keepAlive = keepAlive
+        self.will = will                # (topic, payload, retain), published if the client goes without disconnecting
+        self.subscriptions = set()
+        self.dropped = 0
+
+
+    def send(self, data: bytes) -> bool:
+        """Queues a packet to be sent, returns False if it was dropped because the client has fallen too far behind"""
+        if self.writer.is_closing():
+            return False
+        if self.writer.transport.get_write_buffer_size() > maxBuffered:
+            self.dropped += 1
+            self.broker.dropped += 1
+            return False
+        self.writer.write(data)
+        return True
+
+
+class LocalBroker:
+    """Asyncio MQTT broker, see the top of this file for what it supports"""
+    def __init__(self, host: str = "127.0.0.1", port: int = 1883, verbose: bool = False,
+                 statsInterval: float = statsInterval) -> None:
+        self.host = host
+        self.port = port                # Port 0 picks a free port, which is stored here once the broker has started
+        self.verbose = verbose
+        self.statsInterval = statsInterval
+
+        self.router = TopicRouter()     # Topic filter -> sessions subscribed to it
+        self.retained = {}              # Topic -> payload of the last retained message
+        self.sessions = {}              # Client ID -> Session
+        self.clientIds = itertools.count(1)
+
+        self.startTime = time.monotonic()
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+
+        self.server = None
+        self.statsTask = None
+        self.connections = {}           # Task handling each open connection -> its writer
+
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handleConnection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.statsInterval > 0:
+            self.statsTask = asyncio.create_task(self.publishStats())
+
+
+    async def stop(self) -> None:
+        if self.statsTask:
+            self.statsTask.cancel()
+        self.server.close()
+        for session in list(self.sessions.values()):
+            session.will = None
+        # Closing the connections ends each handler's read, so they finish on their own
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+
+    def log(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+
+    async def handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = None
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            packetType, _, body = await asyncio.wait_for(readPacket(reader), connectTimeout)
+            if packetType != CONNECT:
+                raise ValueError("The first packet must be CONNECT")
+            session = self.connect(writer, body)
+            if session is None:
+                return
+
+            # Clients which go quiet for one and a half keep alive periods are disconnected
+            timeout = session.keepAlive * 1.5 or None
+            while True:
+                packetType, flags, body = await asyncio.wait_for(readPacket(reader), timeout)
+                if packetType == DISCONNECT:
+                    session.will = None
+                    break
+                self.handlePacket(session, packetType, flags, body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except (ValueError, UnicodeDecodeError) as e:
+            self.log(f"Closing {session.clientId if session else 'new connection'}: {e}")
+        finally:
+            if session is not None:
+                self.disconnect(session)
+            writer.close()
+            self.connections.pop(task, None)
+
+
+    def connect(self, writer: asyncio.StreamWriter, body: bytes) -> Session | None:
+        """Handles a CONNECT packet, returns the new session or None if the connection was refused"""
+        packet = PacketReader(body)
+        protocolName = packet.bytes()
+        level = packet.uint8()
+        if protocolNames.get(level) != protocolName:
+            writer.write(makePacket(CONNACK, 0, bytes([0, 1])))     # Unacceptable protocol version
+            return None
+
+        flags = packet.uint8()
+        keepAlive = packet.uint16()
+        clientId = packet.string() or f"local-{next(self.clientIds)}"
+
+        will = None
+        if flags & 0x04:
+            willTopic = packet.string()
+            if not willTopic or "+" in willTopic or "#" in willTopic:
+                raise ValueError(f"Invalid will topic '{willTopic}'")
+            will = (willTopic, packet.bytes(), bool(flags & 0x20))
+
+        # Usernames and passwords are read but not checked, the broker is only for local use
+        if flags & 0x80:
+            packet.string()
+        if flags & 0x40:
+            packet.bytes()
+
+        # A second connection with the same client ID takes over from the first
+        existing = self.sessions.get(clientId)
+        if existing is not None:
+            self.disconnect(existing)
+            existing.writer.close()
+
+        session = Session(self, writer, clientId, keepAlive, will)
+        self.sessions[clientId] = session
+        writer.write(makePacket(CONNACK, 0, bytes([0, 0])))
+        self.log(f"{clientId} connected")
+        return session
+
+
+    def disconnect(self, session: Session) -> None:
+        """Removes a session's subscriptions, and publishes its will if it didn't disconnect cleanly"""
+        if self.sessions.get(session.clientId) is not session:
+            return
+        del self.sessions[session.clientId]
+
+        for topicFilter in session.subscriptions:
+            self.router.remove(topicFilter, session)
+        session.subscriptions.clear()
+
+        if session.will is not None:
+            self.publish(*session.will)
+        self.log(f"{session.clientId} disconnected" + (f", {session.dropped} messages dropped" if session.dropped else ""))
+
+
+    def handlePacket(self, session: Session, packetType: int, flags: int, body: bytes) -> None:
+        packet = PacketReader(body)
+        if packetType == PUBLISH:
+            topic = packet.string()
+            qos = (flags >> 1) & 0x03
+            if qos:
+                packetId = packet.uint16().to_bytes(2, "big")
+                session.send(makePacket(PUBACK if qos == 1 else PUBREC, 0, packetId))
+            self.received += 1
+            self.publish(topic, packet.rest(), bool(flags & 0x01))
+        elif packetType == PUBREL:
+            session.send(makePacket(PUBCOMP, 0, body[:2]))
+        elif packetType == SUBSCRIBE:
+            packetId = packet.uint16()
+            returnCodes = bytearray()
+            topicFilters = []
+            while not packet.done():
+                topicFilter = packet.string()
+                packet.uint8()          # Requested QoS, every subscription is granted QoS 0
+                returnCodes.append(self.subscribe(session, topicFilter))
+                topicFilters.append(topicFilter)
+            session.send(makePacket(SUBACK, 0, packetId.to_bytes(2, "big") + returnCodes))
+
+            # Retained messages follow the SUBACK, so clients know the subscription is in place when they arrive
+            for topicFilter, returnCode in zip(topicFilters, returnCodes):
+                if returnCode != 0x80:
+                    self.sendRetained(session, topicFilter)
+        elif packetType == UNSUBSCRIBE:
+            packetId = packet.uint16()
+            while not packet.done():
+                topicFilter = packet.string()
+                if topicFilter in session.subscriptions:
+                    session.subscriptions.discard(topicFilter)
+                    self.router.remove(topicFilter, session)
+            session.send(makePacket(UNSUBACK, 0, packetId.to_bytes(2, "big")))
+        elif packetType == PINGREQ:
+            session.send(makePacket(PINGRESP, 0))
+        elif packetType not in (PUBACK, PUBREC, PUBCOMP):
+            # Acknowledgements are ignored, every message the broker sends is QoS 0 so there shouldn't be any
+            raise ValueError(f"Unexpected packet type {packetType}")
+
+
+    def subscribe(self, session: Session, topicFilter: str) -> int:
+        """Adds a subscription, returns the SUBACK return code"""
+        if not topicFilter:
+            return 0x80
+        if topicFilter not in session.subscriptions:
+            try:
+                self.router.add(topicFilter, session)
+            except ValueError:
+                return 0x80     # Failure
+            session.subscriptions.add(topicFilter)
+        return 0x00
+
+
+    def sendRetained(self, session: Session, topicFilter: str) -> None:
+        """Sends a new subscription the retained messages it matches"""
+        for topic, payload in self.retained.items():
+            # Wildcards at the start of a filter don't match $ topics, the same as in the router
+            if topicMatches(topicFilter, topic) and not (topic.startswith("$") and topicFilter[0] in "+#"):
+                session.send(publishPacket(topic, payload, retain=True))
+
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        """Sends a message to every client subscribed to its topic"""
+        if not topic or "+" in topic or "#" in topic:
+            raise ValueError(f"Invalid topic '{topic}' to publish to")
+
+        if retain:
+            # An empty retained message clears the topic's retained message
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+        sessions = self.router.handlers(topic)
+        if not sessions:
+            return
+
+        # Clients subscribed with overlapping filters only get each message once
+        data = publishPacket(topic, payload)
+        for session in dict.fromkeys(sessions) if len(sessions) > 1 else sessions:
+            if session.send(data):
+                self.sent += 1
+
+
+    async def publishStats(self) -> None:
+        """Publishes the broker's stats as retained messages on $SYS topics"""
+        while True:
+            await asyncio.sleep(self.statsInterval)
+            stats = {
+                "clients/connected": len(self.sessions),
+                "messages/received": self.received,
+                "messages/sent": self.sent,
+                "messages/dropped": self.dropped,
+                "retained/count": len(self.retained),
+                "uptime": int(time.monotonic() - self.startTime)
+            }
+            for name, value in stats.items():
+                self.publish(f"$SYS/broker/{name}", str(value).encode(), retain=True)
+
+
+class BrokerThread(threading.Thread):
+    """Runs a local broker on a background thread, so a broker can be started in the same process as its clients"""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, verbose: bool = False) -> None:
+        super().__init__(daemon=True)
+        self.broker = LocalBroker(host, port, verbose)
+        self.ready = threading.Event()
+        self.loop = None
+        self.stopping = None
+        self.error = None
+
+
+    @property
+    def port(self) -> int:
+        return self.broker.port
+
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        try:
+            await self.broker.start()
+        except OSError as e:
+            self.error = e
+            self.ready.set()
+            return
+
+        self.ready.set()
+        await self.stopping.wait()
+        await self.broker.stop()
+
+
+    def start(self) -> None:
+        """Starts the broker and waits until it is listening"""
+        super().start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.join()
+
+
+async def main(args: argparse.Namespace) -> None:
+    broker = LocalBroker(args.host, args.port, args.verbose, args.stats_interval)
+    await broker.start()
+    print(f"Local MQTT broker listening on {args.host}:{broker.port}, set BROKER={args.host} in the .env file to use it")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await broker.stop()
+        print(f"{broker.received} messages received, {broker.sent} sent, {broker.dropped} dropped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a lightweight MQTT broker for offline runs and load tests")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, 0.0.0.0 accepts connections from other machines")
+    parser.add_argument("--port", type=int, default=1883, help="port to listen on")
+    parser.add_argument("--stats-interval", type=float, default=statsInterval,
+                        help="seconds between publishes of the broker stats on $SYS/broker/..., 0 turns them off")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print each client connecting and disconnecting")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt detected, stopping the broker...")
\ No newline at end of file
@@ -0,0 +1,247 @@
+from cluster import lowWarning, highWarning
+from datetime import datetime
+from log_store import LogSession, eventKey, sessionTopic, recordDtype
+from telemetry import decodeTelemetry
+import argparse
+import glob
+import mmap
+import os
+import re
+import numpy as np
+
+# Queries over historical logger sessions, for both the text logs and the binary sessions from log_store.py
+# Binary sessions are memory mapped, so scanning many sessions only reads the pages each query touches
+# Text logs are turned into the same records as a binary session so every query works on either format. The text is
+# memory mapped and scanned with a single regular expression, but each message still becomes a Python object, so the
+# records are saved as a binary copy of the session the first time it is read. Later queries memory map the copy, and
+# only parse the text again once the log has changed
+
+# Binary copies of text sessions are kept in this directory inside the logs directory, where findSessions doesn't look
+textCacheDir = ".cache"
+
+# Matches each logged message in the text and compact formats, as well as the start and end of a session
+textRecordPattern = re.compile(
+    rb"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}) - "
+    rb"(?:\n=+\[SUB\]=+\n([^\n]*)\n(?:[^\n]*\n){3}Message:\n([^\n]*)"     # text format block
+    rb"|(Start log:|End log\.)$"                                            # start/end of the session
+    rb"|(\S+) ([^\n]*))",                                                   # compact format line
+    re.MULTILINE
+)
+
+snapshotTextPattern = re.compile(r"(\d+)%, Active servers: (\d+)")
+
+# Warnings the monitor responds to with a scale command
+handledWarnings = {lowWarning, highWarning}
+
+
+class TextLogSession(LogSession):
+    """Text log session converted into the same records as a binary session"""
+    def __init__(self, path: str) -> None:
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.keys = []
+        self.keyIds = {}
+
+        timestamps = []
+        keyIds = []
+        values = []
+        secondsCache = {}
+
+        def add(timestamp: float, key: str, value: float) -> None:
+            keyId = self.keyIds.get(key)
+            if keyId is None:
+                keyId = self.keyIds[key] = len(self.keys)
+                self.keys.append(key)
+            timestamps.append(timestamp)
+            keyIds.append(keyId)
+            values.append(value)
+
+        with open(path, "rb") as logFile:
+            if os.path.getsize(path) == 0:
+                self.records = np.empty(0, dtype=recordDtype)
+                return
+
+            with mmap.mmap(logFile.fileno(), 0, access=mmap.ACCESS_READ) as logMap:
+                for match in textRecordPattern.finditer(logMap):
+                    seconds, millis, blockTopic, blockMessage, sessionMessage, lineTopic, lineMessage = match.groups()
+
+                    # Many messages are logged within the same second, so each second is only parsed once
+                    timestamp = secondsCache.get(seconds)
+                    if timestamp is None:
+                        timestamp = secondsCache[seconds] = datetime.strptime(seconds.decode(), "%Y-%m-%d %H:%M:%S").timestamp()
+                    timestamp += int(millis) / 1000
+
+                    if sessionMessage:
+                        add(timestamp, eventKey(sessionTopic, sessionMessage.decode()), np.nan)
+                        continue
+
+                    topic = (blockTopic if blockTopic is not None else lineTopic).decode()
+                    message = (blockMessage if blockTopic is not None else lineMessage).decode(errors="replace").strip()
+
+                    if topic.endswith("/servers/snapshot"):
+                        snapshot = snapshotTextPattern.search(message)
+                        if snapshot:
+                            prefix = topic[:-len("snapshot")]
+                            add(timestamp, prefix + "avg_cpu_util", float(snapshot.group(1)))
+                            add(timestamp, prefix + "active", float(snapshot.group(2)))
+                            continue
+
+                    telemetry = decodeTelemetry(topic, message.encode())
+                    if telemetry is not None and telemetry.avgVcpuUtil is not None:
+                        add(timestamp, topic, telemetry.avgVcpuUtil)
+                    elif telemetry is not None and telemetry.serversActive is not None:
+                        add(timestamp, topic, telemetry.serversActive)
+                    else:
+                        add(timestamp, eventKey(topic, message), np.nan)
+
+        self.records = np.empty(len(timestamps), dtype=recordDtype)
+        self.records["timestamp"] = timestamps
+        self.records["keyId"] = keyIds
+        self.records["value"] = values
+
+
+def openSession(path: str) -> LogSession:
+    """Opens a text or binary log session from its path"""
+    if path.endswith(".log"):
+        return openTextSession(path)
+    return LogSession(path, memoryMap=True)
+
+
+def openTextSession(path: str) -> LogSession:
+    """Opens a text session through its binary copy, making the copy first if it is missing or older than the log"""
+    cacheDir = os.path.join(os.path.dirname(path), textCacheDir)
+    base = os.path.join(cacheDir, os.path.splitext(os.path.basename(path))[0])
+    if os.path.exists(f"{base}.rec") and os.path.getmtime(f"{base}.rec") >= os.path.getmtime(path):
+        return LogSession(f"{base}.rec", memoryMap=True)
+
+    session = TextLogSession(path)
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+
+        # The records are moved into place last, so a copy interrupted part way is never mistaken for a whole one
+        with open(f"{base}.keys.tmp", "w", encoding="utf-8") as keysFile:
+            keysFile.writelines(key + "\n" for key in session.keys)
+        session.records.tofile(f"{base}.rec.tmp")
+        os.replace(f"{base}.keys.tmp", f"{base}.keys")
+        os.replace(f"{base}.rec.tmp", f"{base}.rec")
+    except OSError as e:
+        print(f"Failed to save a binary copy of {path}: {e}")
+    return session
+
+
+def findSessions(logsDir: str) -> list[str]:
+    """Returns the path of every text and binary session in a directory, oldest first"""
+    paths = glob.glob(os.path.join(logsDir, "server_log_*.log")) + glob.glob(os.path.join(logsDir, "server_log_*.rec"))
+    return sorted(paths, key=os.path.basename)
+
+
+def keyTopics(session: LogSession, suffix: str) -> list[str]:
+    """Returns every topic in a session ending in a suffix, e.g. every cluster's avg_cpu_util topic"""
+    topics = {key.split("|", 1)[0] for key in session.keys}
+    return sorted(topic for topic in topics if topic.endswith(suffix))
+
+
+def utilisationPercentiles(session: LogSession, percentiles: list[float]) -> dict[str, np.ndarray]:
+    """Returns the utilisation percentiles of each cluster in a session"""
+    results = {}
+    for topic in keyTopics(session, "/avg_cpu_util"):
+        _, values = session.series(topic)
+        if len(values):
+            results[topic] = np.percentile(values, percentiles)
+    return results
+
+
+def scaleEvents(session: LogSession, start: float | None = None, end: float | None = None) -> list[tuple[float, str, str]]:
+    """Returns (timestamp, topic, command) for every scale command sent within a time range"""
+    events = []
+    for topic in keyTopics(session, "/commands"):
+        for timestamp, command in session.events(topic):
+            if not command.lower().startswith("!scale"):
+                continue
+            if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                events.append((timestamp, topic, command))
+    return sorted(events)
+
+
+def warningResponseTimes(session: LogSession) -> list[tuple[float, str, str, float]]:
+    """Returns (timestamp, warning, command, seconds) for each handled warning and the scale command sent for it
+
+    Like the monitor, warnings which arrive while an earlier warning is waiting for its command are skipped
+    """
+    results = []
+    for warningTopic in keyTopics(session, "/warnings"):
+        commandTopic = warningTopic[:-len("warnings")] + "commands"
+
+        # Warnings sort before commands logged at the same time, since the command is sent in response
+        messages = [(timestamp, 0, message) for timestamp, message in session.events(warningTopic)]
+        messages += [(timestamp, 1, message) for timestamp, message in session.events(commandTopic)]
+        messages.sort()
+
+        pending = None
+        for timestamp, isCommand, message in messages:
+            if not isCommand and pending is None and message in handledWarnings:
+                pending = (timestamp, message)
+            elif isCommand and pending is not None and message.lower().startswith("!scale"):
+                results.append((pending[0], pending[1], message, timestamp - pending[0]))
+                pending = None
+    return results
+
+
+def parseTime(value: str) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected a time such as 2024-01-31 13:45, got '{value}'")
+
+
+def formatTime(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+if __name__ == "__main__":
+    scriptDir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Queries logger sessions")
+    parser.add_argument("query", choices=["percentiles", "scale-events", "response-times"])
+    parser.add_argument("sessions", nargs="*", help="session files to query, defaults to every session in the logs directory")
+    parser.add_argument("--logs", default=os.path.join(scriptDir, "logs"), help="directory to find sessions in")
+    parser.add_argument("-p", "--percentiles", type=float, nargs="+", default=[50, 90, 99], help="percentiles to calculate")
+    parser.add_argument("--start", type=parseTime, help="earliest time to include, e.g. 2024-01-31 13:45")
+    parser.add_argument("--end", type=parseTime, help="latest time to include")
+    args = parser.parse_args()
+
+    paths = args.sessions or findSessions(args.logs)
+    if not paths:
+        print(f"No sessions found in {args.logs}")
+        exit(1)
+
+    allResponseTimes = []
+    for path in paths:
+        try:
+            session = openSession(path)
+        except (OSError, ValueError) as e:
+            print(f"Failed to open {path}: {e}")
+            continue
+
+        # Only sessions which overlap the time range are of interest
+        if len(session) and (args.start and session.records["timestamp"][-1] < args.start
+                             or args.end and session.records["timestamp"][0] > args.end):
+            continue
+
+        print(f"{session.name} ({len(session)} records)")
+        match args.query:
+            case "percentiles":
+                labels = ", ".join(f"p{p:g}" for p in args.percentiles)
+                for topic, values in utilisationPercentiles(session, args.percentiles).items():
+                    print(f"  {topic} {labels}: {', '.join(f'{value:.1f}%' for value in values)}")
+            case "scale-events":
+                for timestamp, topic, command in scaleEvents(session, args.start, args.end):
+                    print(f"  {formatTime(timestamp)} {topic} {command}")
+            case "response-times":
+                for timestamp, warning, command, seconds in warningResponseTimes(session):
+                    if (args.start is None or timestamp >= args.start) and (args.end is None or timestamp <= args.end):
+                        allResponseTimes.append(seconds)
+                        print(f"  {formatTime(timestamp)} {warning} -> {command} in {seconds * 1000:.0f} ms")
+
+    if args.query == "response-times" and allResponseTimes:
+        p50, p99 = np.percentile(allResponseTimes, [50, 99])
+        print(f"{len(allResponseTimes)} responses, p50 {p50 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms")
\ No newline at end of file
@@ -0,0 +1,158 @@
+from cluster import clusterTopic
+from log_writer import BufferedFileHandler
+from telemetry import decodeTelemetry, decodeSnapshot, isBinary
+import glob
+import logging
+import os
+import numpy as np
+
+# Compact binary storage for logger sessions, used instead of the text log when LOG_FORMAT=binary
+#
+# A session is two files:
+#   server_log_<timestamp>.rec   fixed size records appended as messages arrive (see recordDtype)
+#   server_log_<timestamp>.keys  one key per line, the line number is the key ID used by the records
+#
+# Telemetry is stored as a numeric value under the topic it belongs to, so snapshots are split into the
+# avg_cpu_util and active series they replace. Any other message (commands, warnings, start/end of log) is stored
+# under the key "<topic>|<message>" with a NaN value, so each distinct message only takes up one line of the keys file
+#
+# As every record is the same size, a whole session loads into a NumPy structured array in a single read
+# Key IDs are 32 bit, since every distinct message is a key and a long session with many clusters can pass 65536 of them
+
+recordDtype = np.dtype([("timestamp", "<f8"), ("keyId", "<u4"), ("value", "<f4")])
+
+# Topic used for the start and end of log messages
+sessionTopic = "log"
+
+
+def eventKey(topic: str, message: str) -> str:
+    return f"{topic}|{message}"
+
+
+class RecordFileHandler(BufferedFileHandler):
+    """Buffered handler which writes log records in the binary session format
+
+    Records are logged with the MQTT topic as the message and the raw payload in extra={"payload": ...}
+    Records without a payload, such as "Start log:", are stored as events on the log topic
+    """
+    def __init__(self, filename: str, *args, **kwargs) -> None:
+        base = os.path.splitext(filename)[0]
+
+        # Keys are only ever assigned on the writer thread, so they need no locking
+        # A log restarted within the same second appends to the same session, so it carries on from the keys already there
+        self.keyIds = {}
+        if os.path.exists(f"{base}.keys"):
+            with open(f"{base}.keys", encoding="utf-8") as keysFile:
+                self.keyIds = {key: keyId for keyId, key in enumerate(keysFile.read().splitlines())}
+        self.keysFile = open(f"{base}.keys", "a", encoding="utf-8")
+        super().__init__(f"{base}.rec", *args, **kwargs)
+
+
+    def openFile(self, filename: str):
+        return open(filename, "ab")
+
+
+    def keyId(self, key: str) -> int:
+        """Returns the ID of a key, adding it to the keys file if it is new"""
+        keyId = self.keyIds.get(key)
+        if keyId is None:
+            keyId = len(self.keyIds)
+            self.keyIds[key] = keyId
+
+            # Written straight away, so the keys file is always ahead of the records which use it
+            self.keysFile.write(key + "\n")
+            self.keysFile.flush()
+        return keyId
+
+
+    def format(self, record: logging.LogRecord) -> bytes:
+        """Encodes a log record into one or more binary records"""
+        payload = getattr(record, "payload", None)
+        if payload is None:
+            return self.pack(record.created, [(eventKey(sessionTopic, record.getMessage()), np.nan)])
+
+        topic = record.getMessage()
+        values = []
+        if isBinary(payload) and not topic.endswith(("/avg_cpu_util", "/active")):
+            for telemetry in decodeSnapshot(payload):
+                values.append((clusterTopic(telemetry.clusterId, "servers/avg_cpu_util"), telemetry.avgVcpuUtil))
+                values.append((clusterTopic(telemetry.clusterId, "servers/active"), telemetry.serversActive))
+        else:
+            telemetry = decodeTelemetry(topic, payload)
+            if telemetry is not None and topic.endswith("/avg_cpu_util"):
+                values.append((topic, telemetry.avgVcpuUtil))
+            elif telemetry is not None and topic.endswith("/active"):
+                values.append((topic, telemetry.serversActive))
+            else:
+                # Keys are stored one per line, so the message can't contain newlines
+                message = payload.decode(errors="replace").strip().replace("\n", " ")
+                values.append((eventKey(topic, message), np.nan))
+
+        return self.pack(record.created, values)
+
+
+    def pack(self, timestamp: float, values: list[tuple[str, float]]) -> bytes:
+        records = np.empty(len(values), dtype=recordDtype)
+        records["timestamp"] = timestamp
+        records["keyId"] = [self.keyId(key) for key, _ in values]
+        records["value"] = [value for _, value in values]
+        return records.tobytes()
+
+
+    def joinBatch(self, batch: list[bytes]) -> bytes:
+        return b"".join(batch)
+
+
+    def close(self) -> None:
+        super().close()
+        self.keysFile.close()
+
+
+class LogSession:
+    """Binary log session loaded into memory with one read of the records file
+
+    With memoryMap set, the records are memory mapped instead, so only the pages which are used get read
+    """
+    def __init__(self, path: str, memoryMap: bool = False) -> None:
+        base = os.path.splitext(path)[0]
+        self.name = os.path.basename(base)
+
+        with open(f"{base}.keys", encoding="utf-8") as keysFile:
+            self.keys = keysFile.read().splitlines()
+        self.keyIds = {key: keyId for keyId, key in enumerate(self.keys)}
+
+        # A session which is still being written may end part way through a record, so only whole records are used
+        recordFile = f"{base}.rec"
+        count = os.path.getsize(recordFile) // recordDtype.itemsize
+        if count == 0:
+            self.records = np.empty(0, dtype=recordDtype)
+        elif memoryMap:
+            self.records = np.memmap(recordFile, dtype=recordDtype, mode="r", shape=(count,))
+        else:
+            self.records = np.fromfile(recordFile, dtype=recordDtype, count=count)
+
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+    def series(self, key: str) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the timestamps and values stored under a key, e.g. simulation/servers/avg_cpu_util"""
+        keyId = self.keyIds.get(key)
+        if keyId is None:
+            return np.empty(0), np.empty(0, dtype=np.float32)
+        selected = self.records[self.records["keyId"] == keyId]
+        return selected["timestamp"], selected["value"]
+
+
+    def events(self, topic: str) -> list[tuple[float, str]]:
+        """Returns the (timestamp, message) of every non-telemetry message on a topic, e.g. simulation/commands"""
+        prefix = f"{topic}|"
+        keyIds = [keyId for keyId, key in enumerate(self.keys) if key.startswith(prefix)]
+        selected = self.records[np.isin(self.records["keyId"], keyIds)]
+        return [(float(record["timestamp"]), self.keys[record["keyId"]][len(prefix):]) for record in selected]
+
+
+def listSessions(logsDir: str) -> list[str]:
+    """Returns the path of every binary session in a directory, oldest first"""
+    return sorted(glob.glob(os.path.join(logsDir, "server_log_*.rec")))
\ No newline at end of file
@@ -0,0 +1,125 @@
+import logging
+import queue
+import threading
+import time
+
+# Logging handler which hands records to a dedicated writer thread instead of writing them in the caller
+# The logger receives messages inside the MQTT client's handlers, so a slow disk would otherwise stall the MQTT loop
+# Records are written in batches, and flushed to disk when a batch fills up or the flush interval passes
+#
+# Overflow policies, for when records arrive faster than they can be written and the queue fills up:
+#   drop-new  the incoming record is dropped
+#   drop-old  the oldest queued record is dropped to make room
+#   block     the caller waits for room, this never loses records but can stall the MQTT loop
+
+overflowPolicies = ["drop-new", "drop-old", "block"]
+
+
+class BufferedFileHandler(logging.Handler):
+    """Queues log records and writes them to a file in batches from a background thread"""
+    def __init__(self, filename: str, batchSize: int = 100, flushInterval: float = 1.0,
+                 maxQueued: int = 10000, overflow: str = "drop-new") -> None:
+        if overflow not in overflowPolicies:
+            raise ValueError(f"Overflow policy must be one of {overflowPolicies}, got '{overflow}'")
+
+        super().__init__()
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.overflow = overflow
+        self.records = queue.Queue(maxsize=maxQueued)
+
+        # The file is opened here, so any error is raised to whoever creates the handler
+        self.file = self.openFile(filename)
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+        self.isRunning = True
+        self.thread = threading.Thread(target=self.writeLoop, daemon=True)
+        self.thread.start()
+
+
+    def openFile(self, filename: str):
+        return open(filename, "a", encoding="utf-8")
+
+
+    def joinBatch(self, batch: list[str]) -> str:
+        return "\n".join(batch) + "\n"
+
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Queues a record, this only blocks if the overflow policy is block"""
+        if self.overflow == "block":
+            self.records.put(record)
+            return
+
+        try:
+            self.records.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow == "drop-old":
+            # Another record may take the freed slot first, in which case the new record is dropped instead
+            try:
+                self.records.get_nowait()
+                self.records.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+
+
+    def writeLoop(self) -> None:
+        """Writes queued records in batches until the handler is closed and the queue is empty"""
+        batch = []
+        lastFlush = time.monotonic()
+
+        while self.isRunning or not self.records.empty():
+            timeout = max(0, self.flushInterval - (time.monotonic() - lastFlush))
+            try:
+                self.addToBatch(batch, self.records.get(timeout=timeout))
+                while len(batch) < self.batchSize:
+                    self.addToBatch(batch, self.records.get_nowait())
+            except queue.Empty:
+                pass
+
+            # Write once the batch is full, or when records have waited for the flush interval
+            if len(batch) >= self.batchSize or (batch and time.monotonic() - lastFlush >= self.flushInterval):
+                self.writeBatch(batch)
+                batch = []
+                lastFlush = time.monotonic()
+            elif not batch:
+                lastFlush = time.monotonic()
+
+        if batch:
+            self.writeBatch(batch)
+
+
+    def addToBatch(self, batch: list, record: logging.LogRecord) -> None:
+        """Formats a record into the batch, a record which can't be formatted is dropped instead of stopping the writer"""
+        try:
+            batch.append(self.format(record))
+        except Exception:
+            self.dropped += 1
+            self.handleError(record)
+
+
+    def writeBatch(self, batch: list) -> None:
+        try:
+            self.file.write(self.joinBatch(batch))
+            self.file.flush()
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.dropped += len(batch)
+            print(f"Failed to write to log file: {e}")
+
+
+    def close(self) -> None:
+        """Writes out all queued records, then closes the file"""
+        if self.isRunning:
+            self.isRunning = False
+            self.thread.join()
+            self.file.close()
+        super().close()
\ No newline at end of file
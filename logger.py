@@ -1,54 +1,91 @@
-from paho.mqtt import client as mqtt_client
+from async_mqtt import AsyncMqttClient, brokerSettings
 from dotenv import load_dotenv
 from datetime import datetime
 from textwrap import dedent
+from routing import Message
+from console import Console, consoleLevels
+from log_writer import BufferedFileHandler, overflowPolicies
+from log_store import RecordFileHandler
+import asyncio
 import os
 import random
 import logging
+import time
 
 
 # The broker, username and password are stored in a .env file which needs to be made if not already included
 load_dotenv()
 
-# This code uses the Paho MQTT Python Client library
-# References: https://www.emqx.com/en/blog/how-to-use-mqtt-in-python
-#             https://github.com/eclipse/paho.mqtt.python/blob/master/docs/migrations.rst
-
 # Connection info
-broker = os.getenv('BROKER')
-port = 1883
+broker, port, username, password = brokerSettings()
 baseTopic = "simulation"
 topics = [
-    (f"{baseTopic}/servers/avg_cpu_util", 0),
-    (f"{baseTopic}/servers/active", 0),
-    (f"{baseTopic}/servers/warnings", 0),
-    (f"{baseTopic}/commands", 0),
-    ("public/#", 0)
+    f"{baseTopic}/servers/avg_cpu_util",
+    f"{baseTopic}/servers/active",
+    f"{baseTopic}/servers/snapshot",
+    f"{baseTopic}/warnings",
+    f"{baseTopic}/commands",
+    "public/#"
+]
+logTopics = [  # Messages on these topics are logged
+    f"{baseTopic}/servers/avg_cpu_util",
+    f"{baseTopic}/servers/active",
+    f"{baseTopic}/servers/snapshot",
+    f"{baseTopic}/warnings",
+    f"{baseTopic}/commands"
 ]
 clientId = f'logger-{random.randint(0, 1000)}'  # Assign a random ID to the client
-username = os.getenv('MQTT_USERNAME')
-password = os.getenv('MQTT_PASSWORD')
+consoleLevel = os.getenv('CONSOLE_LEVEL', 'verbose').lower()    # Optional, how much of the message traffic is printed
+
+# Optional settings for writing the log file
+logFormat = os.getenv('LOG_FORMAT', 'text').lower()             # text, compact (one line per message) or binary (see log_store.py)
+logBatchSize = os.getenv('LOG_BATCH_SIZE', '100')               # Records written to the file at a time
+logFlushInterval = os.getenv('LOG_FLUSH_INTERVAL', '1.0')       # Longest time in seconds a record waits before being written
+logQueueSize = os.getenv('LOG_QUEUE_SIZE', '10000')             # Records which can wait to be written before the overflow policy applies
+logOverflow = os.getenv('LOG_OVERFLOW', 'drop-new').lower()     # What happens to records when the queue is full
+logsDir = os.getenv('LOGS_DIR')                                  # Optional, defaults to the logs directory next to this script
+
+logFormats = ["text", "compact", "binary"]
 
 # Environment variable checks
-if not broker:
-    print("Missing MQTT BROKER environment variable in .env file")
+if consoleLevel not in consoleLevels:
+    print(f"Invalid CONSOLE_LEVEL environment variable, expected one of {consoleLevels}")
+    exit(1)
+
+try:
+    logBatchSize = int(logBatchSize)
+    logFlushInterval = float(logFlushInterval)
+    logQueueSize = int(logQueueSize)
+except ValueError:
+    print("LOG_BATCH_SIZE and LOG_QUEUE_SIZE must be integers, and LOG_FLUSH_INTERVAL must be a number")
+    exit(1)
+
+if logFormat not in logFormats:
+    print(f"Invalid LOG_FORMAT environment variable, expected one of {logFormats}")
     exit(1)
 
-if not username or not password:
-    username = None
-    password = None
-    print("Missing MQTT_USERNAME and/or MQTT_PASSWORD environment variables in .env file")
-    print("MQTT client will attempt to connect without username and password")
+if logOverflow not in overflowPolicies:
+    print(f"Invalid LOG_OVERFLOW environment variable, expected one of {overflowPolicies}")
+    exit(1)
+
+# Messages are printed from a background thread, so printing doesn't hold up the MQTT loop
+console = Console(consoleLevel)
 
 # Define the path to the logs directory
 scriptDir = os.path.dirname(os.path.abspath(__file__))
-logsDir = os.path.join(scriptDir, "logs")
+logsDir = logsDir or os.path.join(scriptDir, "logs")
 
 # Initialise logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 loggingActive = False
 
+# The warning which makes the monitor start a log arrives just before !startlog, so while logging is off the last
+# warning on each topic is kept, and written at the start of the next log with the time it arrived if it is recent
+# enough to be the cause. Without it, a log would never hold the warning its first scale command responds to
+recentWarnings = {}         # Warning topic -> (time received, message)
+recentWarningSeconds = 5
+
 
 def startLogging() -> None:
     """Create and setup logging handler"""
@@ -69,11 +106,21 @@ def startLogging() -> None:
 
     try:
         # Setup handler to insert server metrics into log file
-        handler = logging.FileHandler(logFile)
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        # Records are written by the handler's own thread, so a slow disk doesn't hold up the MQTT loop
+        if logFormat == "binary":
+            handler = RecordFileHandler(logFile, logBatchSize, logFlushInterval, logQueueSize, logOverflow)
+        else:
+            handler = BufferedFileHandler(logFile, logBatchSize, logFlushInterval, logQueueSize, logOverflow)
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
         logger.addHandler(handler)
     
         logger.info("Start log:")
+
+        now = time.time()
+        for received, message in recentWarnings.values():
+            if now - received <= recentWarningSeconds:
+                writeMessage(message, received)
+        recentWarnings.clear()
     except Exception as e:
         loggingActive = False
         print(f"Failed to start logging: {e}")
@@ -92,114 +139,97 @@ def stopLogging() -> None:
     for handler in logger.handlers[:]:
         handler.close()
         logger.removeHandler(handler)
+        print(f"Log closed: {handler.written} records written in {handler.batches} batches, {handler.dropped} dropped")
+
+
+def handleCommand(message: Message) -> None:
+    """Execute valid commands"""
+    # Remove all whitespace from command
+    command = message.text.strip().lower()
+    if command in commands: commands[command]()
+
+
+def logMessage(message: Message) -> None:
+    """Log message while logging is active"""
+    if not loggingActive:
+        if message.topic.endswith("/warnings"):
+            recentWarnings[message.topic] = (time.time(), message)
+        return
+    writeMessage(message)
+
+
+def writeMessage(message: Message, created: float | None = None) -> None:
+    """Writes a message to the log, created is the time it arrived if that wasn't just now"""
+    # The binary format decodes the payload on the writer thread
+    if logFormat == "binary":
+        log(created, message.topic, extra={"payload": message.payload})
+        return
+
+    # Binary telemetry is logged as the text it replaces
+    if logFormat == "compact":
+        log(created, "%s %s", message.topic, message.text.replace("\n", "; "))
+    else:
+        log(created, dedent(f"""
+                           ====================[SUB]====================
+                           {message.topic}
+                           Retained?: {message.retain}
+                           QoS: {message.qos}
+
+                           Message:
+                           {message.text}
+                           =============================================
+                           """))
+
+
+def log(created: float | None, msg: str, *args, extra: dict | None = None) -> None:
+    """Logs a record at INFO level, with its time set to created if given"""
+    record = logger.makeRecord(logger.name, logging.INFO, __file__, 0, msg, args, None, extra=extra)
+    if created is not None:
+        record.created = created
+        record.msecs = int(created * 1000) % 1000
+    logger.handle(record)
+
+
+# Commands the logger responds to
+commands = {
+    "!startlog": startLogging,
+    "!stoplog": stopLogging
+}
+
+
+async def main() -> None:
+    client = AsyncMqttClient(clientId, broker, port, username, password)
+
+    # Every received message is printed, and commands are handled before they are logged,
+    # so !startlog is the first message in a log and !stoplog isn't logged
+    client.onMessage = console.sub
+    client.subscribe(f"{baseTopic}/commands", handleCommand)
+    for topic in topics:
+        client.subscribe(topic, logMessage if topic in logTopics else lambda message: None)
+    print(f"Subscribed to topics: {topics}\n")
 
-
-def connect_mqtt() -> mqtt_client:
-    """Connects to the MQTT broker and returns the client object."""
-    def on_connect(client, userdata, flags, rc, properties):
-        """Callback when connected to the broker."""
-        if rc == 0: 
-            print("Connected to MQTT Broker!")
-            subscribe(client)
-        else: 
-            print(f"Failed to connect. Reason code: {rc}")
-    
-    client = mqtt_client.Client(client_id=clientId, callback_api_version=mqtt_client.CallbackAPIVersion.VERSION2)
-    client.username_pw_set(username, password)
-    client.on_connect = on_connect
+    # This only fails if the broker refuses the connection, otherwise the client keeps retrying
+    if not await client.connect():
+        print("Failed to connect to the MQTT broker. Exiting...")
+        await client.close()
+        exit(1)
 
     try:
-        print(f"Attempting to connect to {broker} on port {port}")
-        client.connect(broker, port)
-    except Exception as e:
-        print(f"Error occurred while connecting to the MQTT broker: {e}")
-        return None
-
-    return client
-
-
-def disconnect_mqtt(client: mqtt_client) -> None:
-    """Disconnects client from the MQTT broker."""
-    def on_disconnect(client, userdata, flags, rc, properties):
-        """Callback when disconnected from the broker."""
-        if rc == 0:
-            print("Successfully disconnected from MQTT Broker")
-        else:
-            print(f"Disconnected with an error. Reason code: {rc}")
-
-    client.on_disconnect = on_disconnect
-    client.disconnect()
-
-
-def subscribe(client: mqtt_client) -> None:
-    """Subscribe client to topics."""
-    def on_message(client, userdata, msg):
-        """Print received messages to terminal and process commands"""
-        global loggingActive
-
-        print(dedent(f"""\
-                     ====================[SUB]====================
-                     {msg.topic}
-                     QoS: {msg.qos}
-                     Retained?: {msg.retain}
-                     
-                     Message:
-                     {msg.payload.decode()}
-                     =============================================
-                     """))
-
-        if msg.topic == f"{baseTopic}/commands":
-            # Remove all whitespace from command
-            command = msg.payload.decode().strip().lower()
-            
-            # Execute valid commands
-            commands = {
-                "!startlog": startLogging,
-                "!stoplog": stopLogging
-            }
-            if command in commands: commands[command]()
-        
-        # Log message if from valid topic
-        logTopics = {
-            f"{baseTopic}/servers/avg_cpu_util",
-            f"{baseTopic}/servers/active",
-            f"{baseTopic}/warnings",
-            f"{baseTopic}/commands"
-        }
-        
-        if loggingActive and msg.topic in logTopics:
-            logger.info(dedent(f"""
-                               ====================[SUB]====================
-                               {msg.topic}
-                               Retained?: {msg.retain}
-                               QoS: {msg.qos}
-
-                               Message:
-                               {msg.payload.decode()}
-                               =============================================
-                               """))
-
-    client.on_message = on_message
-    client.subscribe(topics)
-    print(f"Subscribed to topics: {topics}\n")
+        await asyncio.Event().wait()    # Runs until interrupted
+    finally:
+        await client.close()
 
 
 if __name__ == "__main__":
     print("Starting the logger...")
-    
-    client = connect_mqtt()
-    if client is None:
-        print("Failed to connect to the MQTT broker. Exiting...")
-        stopLogging()
-        exit(1)
-    
+
     try:
-        client.loop_forever()
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt detected, disconnecting from MQTT broker...")
     except Exception as e:
         print(f"Error during main operation: {e}")
     finally:
         stopLogging()
-        disconnect_mqtt(client)
+        console.close()
         print("Client disconnected, exiting program.")
\ No newline at end of file
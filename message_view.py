@@ -0,0 +1,198 @@
+from collections import deque
+from routing import topicMatches
+import queue
+import time
+import tkinter as tk
+from tkinter import ttk
+
+# Received message box shared by the monitor app and the GUI client
+# Only the newest messages are kept, in a ring buffer, and only the messages which fit on screen are put into the
+# Text widget. Inserting into a Text widget which holds the whole history gets slower as it grows, so this keeps
+# every update the same cost no matter how long the app has been running
+#
+# Messages arrive on the MQTT client's thread, which can't touch Tk widgets. Instead of scheduling a Tk callback for
+# every message, they are pushed onto a queue which a timer on the Tk thread drains a few times a second, so a burst
+# of thousands of messages is drawn as one update rather than flooding the Tk event queue
+
+separator = "=====================================\n"
+
+
+class MessageView(ttk.Frame):
+    """Scrollable view of the most recent messages, which can be filtered by topic"""
+    def __init__(self, parent, maxMessages: int = 1000, height: int = 17, width: int = 42,
+                 refreshInterval: int = 100, maxQueued: int = 10000) -> None:
+        super().__init__(parent)
+        self.height = height
+        self.width = width
+        self.refreshInterval = refreshInterval      # Milliseconds between each time the queue is drained
+
+        # Messages waiting to be drawn, pushed from the MQTT thread
+        self.incoming = queue.Queue(maxsize=maxQueued)
+        self.received = 0       # Messages drained since the rate was last updated
+        self.dropped = 0        # Messages which arrived while the queue was full
+        self.rateStart = time.monotonic()
+
+        # Each message is stored as (topic, text, number of lines)
+        self.messages = deque(maxlen=maxMessages)
+        self.filtered = deque()     # Messages which match the filter, in the same order
+        self.topicFilter = ""
+
+        # Index into the filtered messages of the message at the top of the view
+        self.top = 0
+        self.followLatest = True    # Keep showing the newest messages while the user hasn't scrolled up
+
+        # Topic filter
+        filterLabel = ttk.Label(self, text="Filter:")
+        filterLabel.grid(row=0, column=0, padx=(10, 0), pady=(0, 5), sticky=tk.W)
+
+        self.filterEntry = ttk.Entry(self, width=35)
+        self.filterEntry.grid(row=0, column=0, columnspan=2, padx=(55, 0), pady=(0, 5), sticky=tk.W)
+        self.filterEntry.bind("<KeyRelease>", lambda event: self.setFilter(self.filterEntry.get().strip()))
+
+        # Message box
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=1, column=1, sticky=tk.NSEW)
+
+        self.display = tk.Text(
+            self,
+            height=height,
+            width=width,
+            font="Consolas, 9",
+            background="black",
+            foreground="white",
+            insertbackground="white"
+        )
+        self.display.grid(row=1, column=0, padx=(10, 0))
+        self.display.config(state=tk.DISABLED)      # Disable any input into the messages box
+
+        # The Text widget only ever holds what is on screen, so scrolling is handled here instead
+        self.display.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        self.display.bind("<Button-4>", lambda event: self.scroll(-1))
+        self.display.bind("<Button-5>", lambda event: self.scroll(1))
+
+        # Message rate and dropped messages
+        self.statsLabel = ttk.Label(self, text="0 msg/s, 0 dropped")
+        self.statsLabel.grid(row=2, column=0, padx=(10, 0), pady=(5, 0), sticky=tk.W)
+
+        self.render()
+        self.after(self.refreshInterval, self.drain)
+
+
+    def push(self, topic: str, text: str) -> None:
+        """Queues a message to be shown, this is safe to call from any thread"""
+        try:
+            self.incoming.put_nowait((topic, text))
+        except queue.Full:
+            self.dropped += 1
+
+
+    def drain(self) -> None:
+        """Adds every queued message to the view and draws them in one update, then schedules the next drain"""
+        count = 0
+        try:
+            while True:
+                self.add(*self.incoming.get_nowait())
+                count += 1
+        except queue.Empty:
+            pass
+
+        if count:
+            self.received += count
+            self.render()
+
+        # The rate is updated about once a second
+        now = time.monotonic()
+        if now - self.rateStart >= 1:
+            self.statsLabel.config(text=f"{self.received / (now - self.rateStart):.0f} msg/s, {self.dropped} dropped")
+            self.received = 0
+            self.rateStart = now
+
+        self.after(self.refreshInterval, self.drain)
+
+
+    def add(self, topic: str, text: str) -> None:
+        """Stores a message on the Tk thread, render() needs to be called afterwards to show it"""
+        # The oldest message is about to be pushed out, so remove it from the filtered messages too
+        if len(self.messages) == self.messages.maxlen:
+            oldest = self.messages[0]
+            if self.filtered and self.filtered[0] is oldest:
+                self.filtered.popleft()
+                self.top = max(0, self.top - 1)
+
+        message = (topic, text, self.countLines(text))
+        self.messages.append(message)
+        if self.matches(topic):
+            self.filtered.append(message)
+
+
+    def countLines(self, text: str) -> int:
+        """Returns the number of rows a message takes up, including long lines which wrap"""
+        return sum(max(1, -(-len(line) // self.width)) for line in text.splitlines())
+
+
+    def matches(self, topic: str) -> bool:
+        return not self.topicFilter or topicMatches(self.topicFilter, topic)
+
+
+    def setFilter(self, topicFilter: str) -> None:
+        """Only shows messages on topics matching the filter, an empty filter shows every message"""
+        if topicFilter == self.topicFilter:
+            return
+        self.topicFilter = topicFilter
+        self.filtered = deque(message for message in self.messages if self.matches(message[0]))
+        self.followLatest = True
+        self.render()
+
+
+    def lastTop(self) -> int:
+        """Returns the index of the top message when scrolled to the bottom"""
+        lines = 1   # The separator at the top of the view
+        index = len(self.filtered)
+        while index > 0 and lines + self.filtered[index - 1][2] <= self.height:
+            index -= 1
+            lines += self.filtered[index][2]
+        return min(index, max(0, len(self.filtered) - 1))
+
+
+    def scroll(self, count: int) -> str:
+        self.top = max(0, min(self.top + count, self.lastTop()))
+        self.followLatest = self.top >= self.lastTop()
+        self.render()
+        return "break"      # Stop the Text widget scrolling its own contents
+
+
+    def yview(self, *args) -> None:
+        """Handles the scrollbar being dragged or clicked"""
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.filtered))
+            self.scroll(0)
+        elif args[0] == "scroll":
+            # A page is roughly the number of messages which fit on screen
+            count = int(args[1])
+            if args[2] == "pages":
+                count *= max(1, self.height // 7)
+            self.scroll(count)
+
+
+    def render(self) -> None:
+        """Puts the messages which fit on screen into the Text widget"""
+        if self.followLatest:
+            self.top = self.lastTop()
+
+        parts = [separator]
+        lines = 1
+        index = self.top
+        while index < len(self.filtered) and lines < self.height:
+            parts.append(self.filtered[index][1])
+            lines += self.filtered[index][2]
+            index += 1
+
+        self.display.config(state=tk.NORMAL)
+        self.display.delete("1.0", tk.END)
+        self.display.insert(tk.END, "".join(parts))
+        self.display.config(state=tk.DISABLED)
+
+        if self.filtered:
+            self.scrollbar.set(self.top / len(self.filtered), index / len(self.filtered))
+        else:
+            self.scrollbar.set(0, 1)
\ No newline at end of file
@@ -1,13 +1,14 @@
-from paho.mqtt import client as mqtt_client
+from async_mqtt import AsyncMqttClient, ClientThread, connectRefusals
 from dotenv import load_dotenv, find_dotenv
 import tkinter as tk
 from tkinter import ttk, messagebox
-from socket import gaierror
 from textwrap import dedent
+from message_view import MessageView, separator
+from chart_view import ChartView
+from warning_handler import WarningWorker
+from routing import TopicRouter, Message, checkTopicFilter
 import os
 import random
-import time
-import threading
 
 # References: https://www.geeksforgeeks.org/python-gui-tkinter/
 #             https://www.w3schools.com/python/python_classes.asp
@@ -15,6 +16,10 @@ import threading
 
 # You will need to press the subscribe button to be subscribed to the sub topics
 
+# The MQTT client runs on a thread of its own (async_mqtt.ClientThread), as the main thread belongs to Tk
+# Its callbacks only touch Tk through after(), and are removed before the thread is stopped, as Tk can't be called
+# from the client's thread while the main thread is waiting for it to finish
+
 baseTopic = "simulation"
 
 # Check if a .env file is present
@@ -23,6 +28,13 @@ if find_dotenv():
     useEnvVariables = True
     load_dotenv()
 
+# Optional, the number of received messages kept for the message box
+try:
+    maxMessages = int(os.getenv('GUI_MAX_MESSAGES', '1000'))
+except ValueError:
+    print("GUI_MAX_MESSAGES must be an integer, using 1000")
+    maxMessages = 1000
+
 
 class MqttClientGui(tk.Tk):
     def __init__(self) -> None:
@@ -36,12 +48,19 @@ class MqttClientGui(tk.Tk):
         # State variables for connections and warnings
         self.subscribeTopics = []
         self.isConnected = False
-        self.handlingWarning = False
         self.client = None
-        self.warningLock = threading.Lock()
 
         self.setupUi()
 
+        # Warnings are handled on one background thread, each cluster has its own cooldown
+        # Handled warnings are noted in the messages box rather than a popup, as a fleet can send many at once
+        self.warningWorker = WarningWorker(self.publishCommand, notify=self.noteWarning)
+
+        # Warnings from the server cluster, or from any cluster in a fleet
+        self.router = TopicRouter()
+        for topic in [f"{baseTopic}/warnings", f"{baseTopic}/+/warnings"]:
+            self.router.add(topic, self.queueWarning)
+
         self.protocol("WM_DELETE_WINDOW", self.onClose)
 
 
@@ -53,14 +72,17 @@ class MqttClientGui(tk.Tk):
         # Create tabs
         connectionTab = ttk.Frame(tabBar)
         messageTab = ttk.Frame(tabBar)
+        chartTab = ttk.Frame(tabBar)
 
         # Add tabs to the notebook container
         tabBar.add(connectionTab, text="Connection")
         tabBar.add(messageTab, text="Messages")
+        tabBar.add(chartTab, text="Charts")
 
         # Initialise the UI in each of the tabs
         self.initConnectionTab(connectionTab)
         self.initMessageTab(messageTab)
+        self.initChartTab(chartTab)
 
 
     def initConnectionTab(self, connectionTab: ttk.Frame) -> None:
@@ -85,7 +107,7 @@ class MqttClientGui(tk.Tk):
         
         self.portEntry = ttk.Entry(portFrame, width=30)
         self.portEntry.grid(row=0, column=0, pady=(0, 7), sticky=tk.W)
-        self.portEntry.insert(0, 1883)                                      # Default MQTT port will be automatically input into the field
+        self.portEntry.insert(0, os.getenv('BROKER_PORT', 1883))                  # Default MQTT port will be automatically input into the field
 
 
         # Username field
@@ -132,6 +154,17 @@ class MqttClientGui(tk.Tk):
         tabTitle = ttk.Label(messageTab, text="Messages", font="Calibri, 18 bold")
         tabTitle.grid(row=0, column=0, padx=10, pady=10, sticky=tk.W)
 
+        # Untick to only view messages, e.g. while autoscaler.py handles the warnings
+        self.handleWarnings = True
+        self.handleWarningsVar = tk.BooleanVar(value=True)
+        handleWarningsBox = ttk.Checkbutton(
+            messageTab,
+            text="Handle warnings",
+            variable=self.handleWarningsVar,
+            command=lambda: setattr(self, "handleWarnings", self.handleWarningsVar.get())   # Read from the MQTT thread, so kept outside Tk
+        )
+        handleWarningsBox.grid(row=0, column=1, padx=(0, 10), sticky=tk.E)
+
 
         # Subscribe section
         subFrame = ttk.LabelFrame(messageTab, text="Subscribe", padding=(10, 10))
@@ -145,7 +178,7 @@ class MqttClientGui(tk.Tk):
         self.subTopicsEntry.grid(row=0, column=1, padx=(22, 0), pady=10, sticky=tk.W)
 
         # You will still need to press the subscribe button to subscribe to these topics
-        self.subTopicsEntry.insert(0, f"public/#,{baseTopic}/servers/avg_cpu_util,{baseTopic}/servers/active,{baseTopic}/warnings,{baseTopic}/commands")
+        self.subTopicsEntry.insert(0, f"public/#,{baseTopic}/servers/avg_cpu_util,{baseTopic}/servers/active,{baseTopic}/servers/snapshot,{baseTopic}/warnings,{baseTopic}/+/warnings,{baseTopic}/commands")
 
         # Sub button
         subButton = ttk.Button(subFrame, text="Subscribe", command=self.subscribe)
@@ -178,26 +211,22 @@ class MqttClientGui(tk.Tk):
 
 
         # Message box
+        # Only the newest messages are kept, and only the ones on screen are drawn, so it doesn't slow down over time
         messagesFrame = ttk.LabelFrame(messageTab, text="Received Messages", padding=(0, 10))
         messagesFrame.grid(row=1, column=1, rowspan=2, padx=(10, 0), pady=10, sticky=tk.W)
-        scrollbar = tk.Scrollbar(messagesFrame)
-        scrollbar.grid(row=0, column=1, sticky=tk.NSEW)
-
-        self.messagesDisplay = tk.Text(
-            messagesFrame,
-            height=20,
-            width=42,
-            font="Consolas, 9",
-            background="black", 
-            foreground="white",
-            insertbackground="white",
-            yscrollcommand=scrollbar.set
-        )
 
-        self.messagesDisplay.grid(row=0, column=0, padx=(10, 0))
-        self.messagesDisplay.insert(tk.END, "=====================================\n")  # This is to create the top of the first message
-        scrollbar.config(command=self.messagesDisplay.yview)                            # Sets the scrollbar to control the y-position in the messages box
-        self.messagesDisplay.config(state=tk.DISABLED)                                  # Disable any input into the messages box
+        self.messagesView = MessageView(messagesFrame, maxMessages)
+        self.messagesView.grid(row=0, column=0)
+
+
+    def initChartTab(self, chartTab: ttk.Frame) -> None:
+        # Title
+        tabTitle = ttk.Label(chartTab, text="Charts", font="Calibri, 18 bold")
+        tabTitle.grid(row=0, column=0, padx=10, pady=10, sticky=tk.W)
+
+        # Utilisation and active servers of the chosen cluster, from the telemetry topics subscribed to
+        self.chartView = ChartView(chartTab)
+        self.chartView.grid(row=1, column=0, sticky=tk.W)
 
 
     def getConnData(self) -> dict[str, str]:
@@ -211,21 +240,28 @@ class MqttClientGui(tk.Tk):
 
 
     def connect_mqtt(self) -> None:
-        """Connects client to the MQTT broker."""
-        def on_connect(client, userdata, flags, rc, properties) -> None:
-            """Callback when connected to the broker."""
+        """Connects client to the MQTT broker, it keeps reconnecting in the background until disconnected"""
+        def on_connect(rc: int) -> None:
+            """Callback when the broker answers a connection attempt, called on the client's thread"""
             if rc == 0:
                 self.isConnected = True
-                self.connStatLabel.config(text="Connected", foreground="green")
+                self.after(0, lambda: self.connStatLabel.config(text="Connected", foreground="green"))
                 self.after(0, lambda: messagebox.showinfo("Connection successful", "Connected to MQTT Broker!"))
             else:
                 self.isConnected = False  # Ensure connected is False in case the first connection was successful
-                self.connStatLabel.config(text="Not Connected", foreground="red")
-                self.client.loop_stop() # If this is not here, with the wrong authentication details it will keep retrying the connection
+                self.after(0, lambda: self.connStatLabel.config(text="Not Connected", foreground="red"))
                 self.after(0, lambda: messagebox.showerror("Connection unsuccessful", f"Failed to connect. Reason code: {rc}\n"))
+                if rc in connectRefusals:
+                    self.after(0, self.stopClient)  # The client gives up on these, e.g. wrong authentication details
 
-        # Exit if already connected
-        if self.isConnected:
+        def on_disconnect(error: Exception | None) -> None:
+            """Callback when the connection is lost, the client reconnects by itself"""
+            self.isConnected = False
+            self.after(0, lambda: self.connStatLabel.config(text="Reconnecting...", foreground="red"))
+            self.after(0, lambda: messagebox.showerror("Disconnection with error", f"Disconnected with an error: {error}\n"))
+
+        # Exit if already connected, or still trying to connect
+        if self.client:
             messagebox.showwarning("Connection active", "Please close the current connection before connecting again")
             return
         
@@ -254,69 +290,59 @@ class MqttClientGui(tk.Tk):
             messagebox.showerror("Input Error", "Port must be between 1 and 65535")
             return
 
-        # Connect client object to MQTT broker
-        self.client = mqtt_client.Client(
-            client_id=f'gui-mqtt-{random.randint(0, 1000)}',
-            callback_api_version=mqtt_client.CallbackAPIVersion.VERSION2
-        )
-        self.client.username_pw_set(username, password)
-        self.client.on_connect = on_connect
-        
-        try:
-            self.client.connect(broker, port)
-            self.client.loop_start()
-        except (TimeoutError, ConnectionRefusedError, gaierror) as e:
-            messagebox.showerror("Connection Error", f"Connection error: {e}")
-        except Exception as e:
-            messagebox.showerror("Unexpected Error", f"An unexpected error occurred: {e}")
+        # Start the client, connection errors are printed while it keeps retrying
+        client = AsyncMqttClient(f'gui-mqtt-{random.randint(0, 1000)}', broker, port, username or None, password or None)
+        client.onConnect = on_connect
+        client.onDisconnect = on_disconnect
+        client.onMessage = self.showMessage
+
+        self.client = ClientThread(client)
+        self.client.start()
+        self.connStatLabel.config(text="Connecting...", foreground="red")
 
 
     def disconnect_mqtt(self) -> None:
         """Disconnects client from the MQTT broker."""
-        def on_disconnect(client, userdata, flags, rc, properties):
-            """Callback when disconnected from the broker."""
-            self.isConnected = False
+        # Only attempt disconnecting if a client has been started, or errors happen
+        if not self.client:
+            return
+
+        wasConnected = self.isConnected
+        self.stopClient()
+        if wasConnected:
+            messagebox.showinfo("Disconnection successful", "Successfully disconnected from MQTT Broker")
 
-            if rc == 0:
-                self.after(0, lambda: messagebox.showinfo("Disconnection successful", "Successfully disconnected from MQTT Broker"))
-            else:
-                self.after(0, lambda: messagebox.showerror("Disconnection with error", f"Disconnected with an error. Reason code: {rc}\n"))
-            
-            self.connStatLabel.config(text="Not Connected", foreground="red")
-
-        self.client.on_disconnect = on_disconnect
-
-        # Only attempt disconnecting if client is already connected, or errors happen
-        if self.isConnected:
-            self.client.disconnect()
-
-
-    def processWarning(self, msg) -> None:
-        """Processes the input message as a warning"""
-        with self.warningLock:
-            if self.handlingWarning: return
-            self.handlingWarning = True        
-
-        topic = f"{baseTopic}/commands"
-        warning = msg.payload.decode()
-        command = ""
-        match warning:
-            case "Warning: CPU utilisation low":
-                command = "!scalein"
-            case "Warning: CPU utilisation high":
-                command = "!scaleout"
-            case _:
-                with self.warningLock:
-                    self.handlingWarning = False
-                return
-
-        self.after(0, lambda: messagebox.showinfo("Handling warning", f"Sending `{command}` in response to `{warning}`"))
-        self.client.publish(topic, "!startlog") # Start logging server cluster metrics to keep a history of the alert
-        self.client.publish(topic, command)     # Resolve the problem the server cluster is experiencing
-        time.sleep(10)                          # Keep logging information for 10 seconds
-        self.client.publish(topic, "!stoplog")
-        with self.warningLock:
-            self.handlingWarning = False
+
+    def stopClient(self) -> None:
+        """Disconnects and stops the client's thread"""
+        if not self.client:
+            return
+
+        self.client.client.onConnect = None
+        self.client.client.onDisconnect = None
+        self.client.stop()
+        self.client = None
+        self.isConnected = False
+        self.subscribeTopics = []
+        self.connStatLabel.config(text="Not Connected", foreground="red")
+
+
+    def publishCommand(self, topic: str, command: str) -> None:
+        """Publishes a command for the warning worker, if still connected"""
+        client = self.client    # Read once, as the client can be stopped on the Tk thread at any time
+        if client and self.isConnected:
+            client.publish(topic, command)
+
+
+    def queueWarning(self, message: Message) -> None:
+        """Hands a warning to the warning worker, unless the monitor is only being used as a viewer"""
+        if self.handleWarnings:
+            self.warningWorker.submit(message.topic, message.text)
+
+
+    def noteWarning(self, note: str) -> None:
+        """Shows a handled warning in the messages box"""
+        self.messagesView.push("monitor", f"{note}\n{separator}")
 
 
     def publish(self) -> None:
@@ -335,41 +361,38 @@ class MqttClientGui(tk.Tk):
             return
         
         for topic in topics:
-            result = self.client.publish(topic, msg)
-            status = result[0]
+            status = self.client.publish(topic, msg)
             if status == 0:
                 self.after(0, lambda: messagebox.showinfo("Message Published", f"Sent `{msg}` to topic `{topic}`"))
             else:
                 self.after(0, lambda: messagebox.showinfo("Error", f"Failed to send message to topic `{topic}`"))
 
 
-    def subscribe(self) -> None:
-        def on_message(client, userdata, msg) -> None:
-            def updateMsgBox() -> None:
-                # Enable text input and display message
-                self.messagesDisplay.config(state=tk.NORMAL)
-                self.messagesDisplay.insert(tk.END, dedent(f"""\
-                    {msg.topic}
-                    QoS: {msg.qos}
-                    Retained?: {msg.retain}
-                    
-                    Message:
-                    {msg.payload.decode()}
-                    =====================================
-                    """))
-                # This is for auto-scrolling of the message box if the user is at the bottom
-                # Range is because the values for yview are inconsistent
-                # Not a perfect solution, it just snaps back if you don't scroll up enough
-                if self.messagesDisplay.yview()[1] < 1.0 and self.messagesDisplay.yview()[1] >= 0.8:
-                    self.messagesDisplay.yview(tk.END)
-                self.messagesDisplay.config(state=tk.DISABLED)    # Disable text input
-
-            self.after(0, updateMsgBox)
-
-            # Automatically process warnings
-            if msg.topic == f"{baseTopic}/warnings" and not self.handlingWarning:
-                threading.Thread(target=self.processWarning, args=(msg,)).start()
+    def showMessage(self, msg) -> None:
+        """Shows every received message once, however many of the subscribed topics it matches"""
+        message = Message(msg)  # The payload is only decoded once, however many places it is shown
 
+        # Messages are drawn in batches by the message view's timer, instead of one Tk callback per message
+        self.messagesView.push(message.topic, dedent(f"""\
+            {message.topic}
+            QoS: {message.qos}
+            Retained?: {message.retain}
+            
+            Message:
+            {message.text}
+            =====================================
+            """))
+        self.chartView.push(message.topic, message.payload)
+
+        # Automatically process warnings
+        self.router.dispatch(message)
+
+
+    def ignore(self, message: Message) -> None:
+        """Handler for the subscribed topics, as their messages are already shown by showMessage"""
+
+
+    def subscribe(self) -> None:
         # Make sure connection is established before subscribing
         if not self.isConnected:
             messagebox.showerror("Error", "Please connect to an MQTT broker first")
@@ -380,26 +403,33 @@ class MqttClientGui(tk.Tk):
         if not topics or (len(topics) == 1 and topics[0] == ''):
             messagebox.showerror("Error", "Please input a topic to subscribe to")
             return
+
+        # Make sure every topic is valid before changing any subscriptions
+        try:
+            for topic in topics:
+                checkTopicFilter(topic)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
         # Unsubscribe from previously subscribed topics if any
-        if self.subscribeTopics:
-            self.client.unsubscribe([topic[0] for topic in self.subscribeTopics])
+        for topic in self.subscribeTopics:
+            self.client.unsubscribe(topic, self.ignore)
 
-        # Clear old subscriptions array and add in new subscriptions
-        self.subscribeTopics = [(topic, 0) for topic in topics]     # If adding in multiple topics, the QoS must also be specified
-        self.client.subscribe(self.subscribeTopics)
-        self.client.on_message = on_message
-        messagebox.showinfo("Subscribed to topic", f"Subscribed to {[topic[0] for topic in self.subscribeTopics]}")
+        # Clear old subscriptions array and add in new subscriptions, the client subscribes again after any reconnect
+        self.subscribeTopics = topics
+        for topic in self.subscribeTopics:
+            self.client.subscribe(topic, self.ignore)
+        messagebox.showinfo("Subscribed to topic", f"Subscribed to {self.subscribeTopics}")
 
     
     def onClose(self):
-        if self.isConnected and self.client:
+        self.warningWorker.stop()   # Sends !stoplog if a warning is still being handled
+        if self.client:
             try:
-                self.client.disconnect()
+                self.stopClient()
             except Exception as e:
                 print(f"Error during disconnect: {e}")
-        if self.client:
-            self.client.loop_stop()
         self.destroy()
 
 
@@ -0,0 +1,134 @@
+import asyncio
+
+# Encoding and decoding of MQTT 3.1.1 packets, shared by the local broker (local_broker.py) and the asyncio client
+# (async_mqtt.py). Only the packets and fields the project uses are covered, see the top of each of those files
+#
+# A packet is a fixed header (type and flags in one byte, then the remaining length as a variable length integer)
+# followed by a body, which each packet type lays out differently. Strings are UTF-8 with a uint16 length in front
+
+# MQTT control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+protocolNames = {3: b"MQIsdp", 4: b"MQTT"}     # Protocol level -> name, for MQTT 3.1 and 3.1.1
+maxPacketSize = 16 * 1024 * 1024                # Larger packets close the connection, so a bad client can't use up memory
+
+
+def encodeLength(length: int) -> bytes:
+    """Encodes the remaining length of a packet as a variable length integer"""
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | 0x80 if length else digit)
+        if not length:
+            return bytes(encoded)
+
+
+def encodeString(value: bytes) -> bytes:
+    return len(value).to_bytes(2, "big") + value
+
+
+def makePacket(packetType: int, flags: int, body: bytes = b"") -> bytes:
+    return bytes([packetType << 4 | flags]) + encodeLength(len(body)) + body
+
+
+def publishPacket(topic: str, payload: bytes, retain: bool = False) -> bytes:
+    """Encodes a QoS 0 PUBLISH packet"""
+    return makePacket(PUBLISH, int(retain), encodeString(topic.encode()) + payload)
+
+
+def connectPacket(clientId: str, keepAlive: int, username: str | None = None, password: str | None = None,
+                  will: tuple[str, bytes, bool] | None = None) -> bytes:
+    """Encodes an MQTT 3.1.1 CONNECT packet with a clean session"""
+    flags = 0x02
+    payload = encodeString(clientId.encode())
+    if will is not None:
+        willTopic, willPayload, willRetain = will
+        flags |= 0x04 | (0x20 if willRetain else 0)
+        payload += encodeString(willTopic.encode()) + encodeString(willPayload)
+    if username is not None:
+        flags |= 0x80
+        payload += encodeString(username.encode())
+        if password is not None:
+            flags |= 0x40
+            payload += encodeString(password.encode())
+    return makePacket(CONNECT, 0, encodeString(protocolNames[4]) + bytes([4, flags]) + keepAlive.to_bytes(2, "big") + payload)
+
+
+def subscribePacket(packetId: int, topicFilters: list[str]) -> bytes:
+    """Encodes a SUBSCRIBE packet asking for QoS 0 on each filter"""
+    body = packetId.to_bytes(2, "big") + b"".join(encodeString(topicFilter.encode()) + b"\x00" for topicFilter in topicFilters)
+    return makePacket(SUBSCRIBE, 0x02, body)
+
+
+def unsubscribePacket(packetId: int, topicFilters: list[str]) -> bytes:
+    body = packetId.to_bytes(2, "big") + b"".join(encodeString(topicFilter.encode()) for topicFilter in topicFilters)
+    return makePacket(UNSUBSCRIBE, 0x02, body)
+
+
+async def readPacket(reader: asyncio.StreamReader) -> tuple[int, int, bytes]:
+    """Reads one packet, returns its type, flags and body"""
+    header = (await reader.readexactly(1))[0]
+
+    length = 0
+    for shift in range(0, 28, 7):
+        digit = (await reader.readexactly(1))[0]
+        length |= (digit & 0x7F) << shift
+        if not digit & 0x80:
+            break
+    else:
+        raise ValueError("Malformed remaining length")
+
+    if length > maxPacketSize:
+        raise ValueError(f"Packet of {length} bytes is larger than the {maxPacketSize} byte limit")
+    return header >> 4, header & 0x0F, await reader.readexactly(length)
+
+
+class PacketReader:
+    """Reads the fields of a packet body in order"""
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+        self.offset = 0
+
+
+    def uint8(self) -> int:
+        if self.offset >= len(self.body):
+            raise ValueError("Packet is too short")
+        self.offset += 1
+        return self.body[self.offset - 1]
+
+
+    def uint16(self) -> int:
+        return self.uint8() << 8 | self.uint8()
+
+
+    def bytes(self) -> bytes:
+        length = self.uint16()
+        if self.offset + length > len(self.body):
+            raise ValueError("Packet is too short")
+        self.offset += length
+        return self.body[self.offset - length:self.offset]
+
+
+    def string(self) -> str:
+        return self.bytes().decode()
+
+
+    def rest(self) -> bytes:
+        return self.body[self.offset:]
+
+
+    def done(self) -> bool:
+        return self.offset >= len(self.body)
\ No newline at end of file
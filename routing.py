@@ -0,0 +1,138 @@
+from functools import cached_property
+from telemetry import payloadText
+
+# Routes received MQTT messages to handlers by topic filter, shared by every component
+# Topic filters, including + and # wildcards, are stored in a trie with one level of the topic per node, so matching
+# a topic only walks its own levels however many filters there are. The handlers matched by each topic are cached,
+# making repeat messages on a topic a single dictionary lookup
+#
+# Each message is wrapped once, and its payload is only decoded the first time a handler asks for the text
+
+maxCachedTopics = 65536     # The cache is cleared when it grows past this, e.g. when clusters come and go
+
+
+def topicMatches(topicFilter: str, topic: str) -> bool:
+    """Checks if a topic matches an MQTT topic filter, which may contain + and # wildcards"""
+    filterLevels = topicFilter.split("/")
+    topicLevels = topic.split("/")
+
+    for i, level in enumerate(filterLevels):
+        if level == "#":
+            return True
+        if i >= len(topicLevels) or (level != "+" and level != topicLevels[i]):
+            return False
+    return len(filterLevels) == len(topicLevels)
+
+
+def checkTopicFilter(topicFilter: str) -> None:
+    """Raises ValueError if a topic filter is empty, has wildcards anywhere but a whole level, or # anywhere but the last level"""
+    if not topicFilter:
+        raise ValueError("Topic filters can't be empty")
+    levels = topicFilter.split("/")
+    for i, level in enumerate(levels):
+        if ("#" in level and (level != "#" or i != len(levels) - 1)) or ("+" in level and level != "+"):
+            raise ValueError(f"Invalid topic filter '{topicFilter}'")
+
+
+class Message:
+    """Received MQTT message, with the payload decoded at most once however many handlers use it"""
+    def __init__(self, msg) -> None:
+        self.topic = msg.topic
+        self.payload = msg.payload
+        self.qos = msg.qos
+        self.retain = msg.retain
+
+
+    @cached_property
+    def text(self) -> str:
+        """The payload as text, binary telemetry is shown the same way as the text it replaces"""
+        return payloadText(self.topic, self.payload)
+
+
+class TopicNode:
+    __slots__ = ("children", "handlers", "wildcardHandlers")
+
+    def __init__(self) -> None:
+        self.children = {}              # Topic level (or +) -> TopicNode
+        self.handlers = []              # Handlers of filters which end at this node
+        self.wildcardHandlers = []      # Handlers of filters which end with # after this node
+
+
+class TopicRouter:
+    """Calls the handlers of every topic filter a message matches, handlers of the same filter run in the order added"""
+    def __init__(self) -> None:
+        self.root = TopicNode()
+        self.cache = {}
+
+
+    def add(self, topicFilter: str, handler) -> None:
+        """Calls handler(message) for every message on a topic matching the filter"""
+        checkTopicFilter(topicFilter)
+
+        node = self.root
+        for level in topicFilter.split("/"):
+            if level == "#":
+                node.wildcardHandlers.append(handler)
+                break
+            node = node.children.setdefault(level, TopicNode())
+        else:
+            node.handlers.append(handler)
+        self.cache.clear()
+
+
+    def remove(self, topicFilter: str, handler) -> None:
+        """Stops calling a handler for a topic filter it was added with, e.g. when a broker client unsubscribes"""
+        node = self.root
+        for level in topicFilter.split("/"):
+            if level == "#":
+                handlers = node.wildcardHandlers
+                break
+            node = node.children.get(level)
+            if node is None:
+                return
+        else:
+            handlers = node.handlers
+
+        if handler in handlers:
+            handlers.remove(handler)
+            self.cache.clear()
+
+
+    def handlers(self, topic: str) -> tuple:
+        """Returns the handlers of every filter matching a topic"""
+        handlers = self.cache.get(topic)
+        if handlers is not None:
+            return handlers
+
+        levels = topic.split("/")
+        matched = []
+
+        # Topics starting with $ are for the broker, and wildcards at the first level don't match them
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth > 0 or not topic.startswith("$"):
+                matched.extend(node.wildcardHandlers)   # a/# also matches a itself
+            if depth == len(levels):
+                matched.extend(node.handlers)
+                continue
+
+            plus = node.children.get("+")
+            if plus is not None and (depth > 0 or not topic.startswith("$")):
+                stack.append((plus, depth + 1))
+            child = node.children.get(levels[depth])
+            if child is not None:
+                stack.append((child, depth + 1))
+
+        if len(self.cache) >= maxCachedTopics:
+            self.cache.clear()
+        handlers = self.cache[topic] = tuple(matched)
+        return handlers
+
+
+    def dispatch(self, msg) -> Message:
+        """Passes a received message to its handlers, and returns it wrapped as a Message"""
+        message = msg if isinstance(msg, Message) else Message(msg)
+        for handler in self.handlers(message.topic):
+            handler(message)
+        return message
\ No newline at end of file
@@ -0,0 +1,157 @@
+from cluster import ScalingConfig, defaultConfig
+from warning_handler import monitorCooldown
+import argparse
+import math
+
+# Autoscaling policies which decide a cluster's server count from its utilisation, instead of waiting for warnings
+#
+#   warnings    the original behaviour, the cluster warns after a streak of ticks over/under its limits and the
+#               monitor responds with !scaleout or !scalein (see warning_handler.py), so it has no policy object
+#   target      target tracking, sizes the cluster so the utilisation comes back to a target straight away
+#   step        step scaling, adds or removes more servers the further the utilisation is past the limits
+#   predictive  target tracking on a Holt (double exponential smoothing) forecast of the utilisation a few ticks
+#               ahead, so the cluster scales out while the load is still rising rather than once it is too high
+#   ewma        the predictive policy without the trend, which smooths out noise but doesn't look ahead
+#
+# A policy is given every utilisation tick of its cluster, so it keeps its own state, one policy object per cluster
+
+policyNames = ["warnings", "target", "step", "predictive", "ewma"]
+
+
+class ScalingPolicy:
+    """Decides how many servers a cluster needs, called on every utilisation tick of the cluster"""
+    def __init__(self, config: ScalingConfig = defaultConfig, cooldown: float = monitorCooldown) -> None:
+        self.config = config
+        self.cooldown = cooldown            # Seconds after scaling before the policy can scale again
+        self.lastScaled = -math.inf
+
+
+    def decide(self, now: float, avgVcpuUtil: float, serversActive: int, serversRequested: int | None = None) -> int | None:
+        """Returns the number of servers to scale to, or None if the cluster should be left as it is
+
+        serversRequested includes servers which are still starting, when the policy can see them
+        """
+        # Every tick is passed on, even during the cooldown, so policies which keep history stay up to date
+        desired = max(1, min(self.desiredServers(avgVcpuUtil, serversActive), self.config.maxServers))
+        if serversRequested is None:
+            serversRequested = serversActive
+        if desired == serversRequested or now - self.lastScaled < self.cooldown:
+            return None
+        self.lastScaled = now
+        return desired
+
+
+    def desiredServers(self, avgVcpuUtil: float, serversActive: int) -> int:
+        raise NotImplementedError
+
+
+class TargetTrackingPolicy(ScalingPolicy):
+    """Scales to the number of servers which would bring the utilisation to the target
+
+    Scaling in only happens once the utilisation would stay a margin below the target afterwards,
+    otherwise the cluster would scale back out on the next rise
+    """
+    def __init__(self, config: ScalingConfig = defaultConfig, cooldown: float = monitorCooldown,
+                 targetUtil: float = 60, scaleInMargin: float = 15) -> None:
+        super().__init__(config, cooldown)
+        self.targetUtil = targetUtil
+        self.scaleInMargin = scaleInMargin
+
+
+    def desiredServers(self, avgVcpuUtil: float, serversActive: int) -> int:
+        # The workload is spread evenly, so the utilisation scales with servers active / desired servers
+        load = avgVcpuUtil * serversActive
+        desired = math.ceil(load / self.targetUtil)
+        if desired < serversActive:
+            desired = max(desired, math.ceil(load / (self.targetUtil - self.scaleInMargin)))
+        return desired
+
+
+class StepScalingPolicy(ScalingPolicy):
+    """Adds or removes a number of servers depending on how far the utilisation is past the limits"""
+    def __init__(self, config: ScalingConfig = defaultConfig, cooldown: float = monitorCooldown,
+                 scaleOutSteps: list[tuple[float, int]] | None = None,
+                 scaleInSteps: list[tuple[float, int]] | None = None) -> None:
+        super().__init__(config, cooldown)
+
+        # (utilisation, servers), the first step the utilisation is above/below is used
+        self.scaleOutSteps = scaleOutSteps or [
+            (config.highLimit + 10, config.scaleOutStep + 1),
+            (config.highLimit, config.scaleOutStep)
+        ]
+        self.scaleInSteps = scaleInSteps or [
+            (config.lowLimit / 2, 2),
+            (config.lowLimit, 1)
+        ]
+
+
+    def desiredServers(self, avgVcpuUtil: float, serversActive: int) -> int:
+        for limit, servers in self.scaleOutSteps:
+            if avgVcpuUtil > limit:
+                return serversActive + servers
+        for limit, servers in self.scaleInSteps:
+            if avgVcpuUtil < limit:
+                return serversActive - servers
+        return serversActive
+
+
+class PredictivePolicy(TargetTrackingPolicy):
+    """Target tracking on a forecast of the utilisation, using Holt's linear trend method
+
+    alpha smooths the level and beta the trend, horizon is how many ticks ahead to forecast
+    With beta set to 0 there is no trend, which leaves an exponentially weighted moving average
+    """
+    def __init__(self, config: ScalingConfig = defaultConfig, cooldown: float = monitorCooldown,
+                 targetUtil: float = 60, scaleInMargin: float = 15,
+                 alpha: float = 0.5, beta: float = 0.3, horizon: int = 3) -> None:
+        super().__init__(config, cooldown, targetUtil, scaleInMargin)
+        self.alpha = alpha
+        self.beta = beta
+        self.horizon = horizon
+
+        self.level = None
+        self.trend = 0.0
+        self.lastServers = None
+
+
+    def desiredServers(self, avgVcpuUtil: float, serversActive: int) -> int:
+        if self.level is None:
+            self.level = avgVcpuUtil
+        else:
+            # Scaling spreads the load over a different number of servers, so the history is rescaled to match
+            if serversActive != self.lastServers:
+                ratio = self.lastServers / serversActive
+                self.level *= ratio
+                self.trend *= ratio
+
+            lastLevel = self.level
+            self.level = self.alpha * avgVcpuUtil + (1 - self.alpha) * (self.level + self.trend)
+            self.trend = self.beta * (self.level - lastLevel) + (1 - self.beta) * self.trend
+        self.lastServers = serversActive
+
+        forecast = max(0.0, min(self.level + self.horizon * self.trend, 100.0))
+        return super().desiredServers(forecast, serversActive)
+
+
+def makePolicy(name: str, config: ScalingConfig = defaultConfig, cooldown: float = monitorCooldown) -> ScalingPolicy | None:
+    """Creates a policy for one cluster, the warnings policy has no policy object so this returns None"""
+    match name:
+        case "warnings":
+            return None
+        case "target":
+            return TargetTrackingPolicy(config, cooldown)
+        case "step":
+            return StepScalingPolicy(config, cooldown)
+        case "predictive":
+            return PredictivePolicy(config, cooldown)
+        case "ewma":
+            return PredictivePolicy(config, cooldown, beta=0.0, horizon=0)
+    raise ValueError(f"Policy must be one of {policyNames}, got '{name}'")
+
+
+def parseClusterPolicy(value: str) -> tuple[str, str]:
+    """Parses a per-cluster policy in the form <cluster_id>=<policy>"""
+    clusterId, _, name = value.partition("=")
+    if name not in policyNames:
+        raise argparse.ArgumentTypeError(f"Expected <cluster_id>=<policy> with a policy from {policyNames}, got '{value}'")
+    return clusterId, name
\ No newline at end of file
@@ -1,295 +1,196 @@
-from paho.mqtt import client as mqtt_client
+from async_mqtt import AsyncMqttClient, brokerSettings
 from dotenv import load_dotenv
-from enum import Enum
-from textwrap import dedent
+from cluster import Cluster, ScalingConfig, baseTopic, utilPeriod, activePeriod, statsPeriod, publishModes
+from telemetry import encodeTelemetry, encodeSnapshot, encodeServerUtil, encodeServerStates
+from server_workload import WorkloadCluster, loadBalancers
+from load_trace import traceRates
+from console import Console, consoleLevels
+import asyncio
 import os
 import random
-import time
-import threading
 
 
 # The broker, username and password are stored in a .env file which needs to be made if not already included
 load_dotenv()
 
-# This code uses the Paho MQTT Python Client library
-# References: https://www.emqx.com/en/blog/how-to-use-mqtt-in-python
-#             https://github.com/eclipse/paho.mqtt.python/blob/master/docs/migrations.rst
+# The MQTT client (async_mqtt.py) and each publishing loop run as tasks on one asyncio event loop, so the cluster
+# is only ever touched by one thread and commands need no locking
 
 # Connection info
-broker = os.getenv('BROKER')
-port = 1883
-baseTopic = "simulation"
-subscribeTopics = [(f"{baseTopic}/commands", 0), ("public/#", 0)]    # Pub and sub topics need to be separate, or public will be spammed as well
+broker, port, username, password = brokerSettings()
+subscribeTopics = [f"{baseTopic}/commands", "public/#"]              # Pub and sub topics need to be separate, or public will be spammed as well
 client_id = f'server-{random.randint(0, 1000)}'                     # Assign a random ID to the client device
-username = os.getenv('MQTT_USERNAME')
-password = os.getenv('MQTT_PASSWORD')
+seed = os.getenv('SEED')                                            # Optional, setting this makes the simulation repeatable
+binaryTelemetry = os.getenv('TELEMETRY_FORMAT', '').lower() == "binary"    # Optional, publishes compact binary payloads instead of text
+publishMode = os.getenv('PUBLISH_MODE', 'topics').lower()          # Optional, publishes one combined snapshot per tick instead of/as well as each metric
+consoleLevel = os.getenv('CONSOLE_LEVEL', 'verbose').lower()        # Optional, how much of the message traffic is printed
+loadBalancer = os.getenv('LOAD_BALANCER', '').lower()              # Optional, simulates each server behind this load balancer
+loadTrace = os.getenv('LOAD_TRACE')                                 # Optional, request rate trace to replay in a loop instead of the simulation modes
+traceScale = os.getenv('LOAD_TRACE_SCALE', '1')                     # Optional, multiplier for every rate in the load trace
+statsPeriod = os.getenv('STATS_PERIOD', str(statsPeriod))          # Optional, seconds between stats messages, 0 turns them off
+serverDelays = {name: os.getenv(name, '0') for name in ('PENDING_DELAY', 'BOOT_DELAY', 'DRAIN_DELAY')}  # Optional, seconds servers spend in each state
 
 # Environment variable checks
-if not broker:
-    print("Missing MQTT BROKER environment variable in .env file")
+if publishMode not in publishModes:
+    print(f"Invalid PUBLISH_MODE environment variable, expected one of {publishModes}")
     exit(1)
 
-if not username or not password:
-    username = None
-    password = None
-    print("Missing MQTT_USERNAME and/or MQTT_PASSWORD environment variables in .env file")
-    print("MQTT client will attempt to connect without username and password")
+if consoleLevel not in consoleLevels:
+    print(f"Invalid CONSOLE_LEVEL environment variable, expected one of {consoleLevels}")
+    exit(1)
 
-# Global variables, so multiple functions can access this
-avgVcpuUtil = 10
-serversActive = 1
+if loadBalancer and loadBalancer not in loadBalancers:
+    print(f"Invalid LOAD_BALANCER environment variable, expected one of {loadBalancers}")
+    exit(1)
 
-# Without this flag, publishing will occur before the connection is fully established
-isConn = threading.Event()
+if loadTrace and not os.path.isfile(loadTrace):
+    print(f"LOAD_TRACE file {loadTrace} not found")
+    exit(1)
 
-# This is to kill the threads when a keyboard interrupt is used
-isRunning = True
+try:
+    traceScale = float(traceScale)
+except ValueError:
+    print("Invalid LOAD_TRACE_SCALE environment variable, expected a number")
+    exit(1)
 
-class SimMode(Enum):
-    NORMAL = 1
-    INCREASING = 2
-    DECREASING = 3
+try:
+    statsPeriod = float(statsPeriod)
+except ValueError:
+    print("Invalid STATS_PERIOD environment variable, expected a number of seconds")
+    exit(1)
 
-# Start in normal simulation mode
-simMode = SimMode.NORMAL.value
+try:
+    config = ScalingConfig(pendingDelay=int(serverDelays['PENDING_DELAY']), bootDelay=int(serverDelays['BOOT_DELAY']),
+                           drainDelay=int(serverDelays['DRAIN_DELAY']))
+except ValueError:
+    print("Invalid PENDING_DELAY, BOOT_DELAY or DRAIN_DELAY environment variable, expected a whole number of seconds")
+    exit(1)
 
+# A load trace needs the per-server model, which is balanced round robin unless another load balancer is chosen
+if loadTrace and not loadBalancer:
+    loadBalancer = "round-robin"
 
-def connect_mqtt() -> mqtt_client:
-    """Connects to the MQTT broker and returns the client object."""
-    def on_connect(client, userdata, flags, rc, properties):
-        """Callback when connected to the broker."""
-        if rc == 0: 
-            print("Connected to MQTT Broker!")
-            isConn.set()
-            subscribe(client)
-        else:
-            print(f"Failed to connect. Reason code: {rc}")            
-    
-    client = mqtt_client.Client(client_id = client_id, callback_api_version = mqtt_client.CallbackAPIVersion.VERSION2)
-    client.username_pw_set(username, password)
-    client.on_connect = on_connect
+# Messages are printed from a background thread, so printing doesn't slow down publishing
+console = Console(consoleLevel)
 
-    try:
-        print(f"Attempting to connect to {broker} on port {port}")
-        client.connect(broker, port)
-    except Exception as e:
-        print(f"Error occurred while connecting to the MQTT broker: {e}")
-        return None
+# The cluster holds the simulation state, so multiple functions can access this
+if loadBalancer:
+    cluster = WorkloadCluster(config=config, seed=seed, balancer=loadBalancer,
+                              rates=traceRates(loadTrace, traceScale, loop=True) if loadTrace else None)
+else:
+    cluster = Cluster(config=config, seed=seed)
 
-    return client
+def pubMsg(client: AsyncMqttClient, topic: str, msg: str | bytes) -> None:
+    """Publishes a message to a specified topic"""
+    console.pub(topic, msg, client.publishNowait(topic, msg))
 
 
-def disconnect_mqtt(client: mqtt_client) -> None:
-    """Disconnects client from the MQTT broker."""
-    def on_disconnect(client, userdata, flags, rc, properties):
-        """Callback when disconnected from the broker."""
-        if rc == 0:
-            print("Successfully disconnected from MQTT Broker")
+async def pubAvgVcpuUse(client: AsyncMqttClient) -> None:
+    """Publishes the average CPU utilisation"""
+    while True:
+        if binaryTelemetry:
+            msg = encodeTelemetry(cluster.clusterId, cluster.avgVcpuUtil, cluster.serversActive)
         else:
-            print(f"Disconnected with an error. Reason code: {rc}")
-            
-    client.on_disconnect = on_disconnect
-    client.disconnect()
-
-
-def pubMsg(client: mqtt_client, topic: str, msg: str) -> None:
-    """Publishes a message to a specified topic"""
-    result = client.publish(topic, msg)
-    status = result[0]
-
-    # Without the whitespace, dedent will not work properly due to the \n
-    if status == 0:
-        sendMsg = f"Sent:\n{" " * 17}{msg}"
-    else:
-        sendMsg = f'Error code: {status}\n{" " * 17}Failed to publish: "{msg}"'
-    
-    print(dedent(f"""\
-                 --------------------[PUB]--------------------
-                 {topic}
+            msg = f"Avg CPU utilisation: {cluster.avgVcpuUtil}%"
+        pubMsg(client, cluster.avgTopic, msg)
+        if loadBalancer:
+            pubMsg(client, cluster.perServerTopic, encodeServerUtil(cluster.serverUtil, binaryTelemetry))
 
-                 {sendMsg}
-                 ---------------------------------------------
-                 """))
+        # Step the simulation and publish any scale in/out recommendation
+        warning = cluster.stepUtil()
+        if warning:
+            pubMsg(client, cluster.warningTopic, warning)
 
+        await asyncio.sleep(utilPeriod)
 
-def pubAvgVcpuUse(client) -> None:
-    """Publishes the average CPU utilisation"""
 
-    global isRunning, avgVcpuUtil, serversActive, simMode
-
-    isConn.wait()
-
-    avgTopic = f"{baseTopic}/servers/avg_cpu_util"
-    warningTopic = f"{baseTopic}/warnings"
-    lowCount = 0
-    highCount = 0
-
-    while isRunning:
-        msg = f"Avg CPU utilisation: {avgVcpuUtil}%"
-        pubMsg(client, avgTopic, msg)
-        
-        # Create variation in data based on simulation mode
-        match simMode:
-            case SimMode.NORMAL.value:
-                avgVcpuUtil += random.randint(-5, 5)
-            case SimMode.INCREASING.value:
-                avgVcpuUtil += random.randint(-5, 15)
-            case SimMode.DECREASING.value:
-                avgVcpuUtil += random.randint(-15, 5)
-            
-        # Make sure utilisation stays within bounds of 0-100%
-        avgVcpuUtil = max(0, min(avgVcpuUtil, 100))
-
-        # Check if vCPU usage is too low/high and add to count
-        if avgVcpuUtil < 20 and serversActive > 1:
-            lowCount += 1
+async def pubServersActive(client: AsyncMqttClient) -> None:
+    """Publishes the active servers"""
+    while True:
+        if binaryTelemetry:
+            msg = encodeTelemetry(cluster.clusterId, cluster.avgVcpuUtil, cluster.serversActive)
         else:
-            lowCount = 0
+            msg = f"Active servers: {cluster.serversActive}"
+        pubMsg(client, cluster.activeTopic, msg)
+        if cluster.hasServerStates:
+            pubMsg(client, cluster.statesTopic, encodeServerStates(cluster.serverStates, binaryTelemetry))
 
-        if avgVcpuUtil > 80:
-            highCount += 1
-        else:
-            highCount = 0
+        # Active servers should stay relatively consistent, so don't need to create variation here
 
-        # Provide a recommendation to scale in/out
-        # Scaling in too early can cause resources to become overloaded fast, hence it needs to trigger low more times
-        # Scaling out too early can cause too many resources to be created too fast, wasting computational power
-        if lowCount > 10 and serversActive > 1:
-            pubMsg(client, warningTopic, "Warning: CPU utilisation low")
-            lowCount = 0
+        await asyncio.sleep(activePeriod)
 
-        if highCount > 5:
-            # Beyond 8 servers, we start getting diminishing returns
-            if serversActive < 8:
-                pubMsg(client, warningTopic, "Warning: CPU utilisation high")
-            else:
-                pubMsg(client, warningTopic, "Warning: Servers are at capacity")      # There is no need to handle this warning in the monitor
-            highCount = 0
 
-        time.sleep(2)
+async def pubSnapshot(client: AsyncMqttClient) -> None:
+    """Publishes the utilisation and active servers together in one message"""
+    while True:
+        pubMsg(client, cluster.snapshotTopic, encodeSnapshot([cluster]))
+        if loadBalancer and publishMode == "snapshot":
+            pubMsg(client, cluster.perServerTopic, encodeServerUtil(cluster.serverUtil, binaryTelemetry))
+        if cluster.hasServerStates and publishMode == "snapshot":
+            pubMsg(client, cluster.statesTopic, encodeServerStates(cluster.serverStates, binaryTelemetry))
 
+        # When the per-topic messages are also being published, their task steps the simulation instead
+        if publishMode == "snapshot":
+            warning = cluster.stepUtil()
+            if warning:
+                pubMsg(client, cluster.warningTopic, warning)
 
-def pubServersActive(client) -> None:
-    """Publishes the active servers"""
-    
-    global isRunning, serversActive
+        await asyncio.sleep(utilPeriod)
 
-    isConn.wait()
 
-    topic = f"{baseTopic}/servers/active"
+async def pubStats(client: AsyncMqttClient) -> None:
+    """Publishes the cluster's running totals of server-seconds, time past the limits and scale events"""
+    while True:
+        pubMsg(client, cluster.statsTopic, cluster.stats.toJson())
+        await asyncio.sleep(statsPeriod)
 
-    while isRunning:
-        msg = f"Active servers: {serversActive}"
-        pubMsg(client, topic, msg)
 
-        # Active servers should stay relatively consistent, so don't need to create variation here
+async def main() -> None:
+    client = AsyncMqttClient(client_id, broker, port, username, password)
 
-        time.sleep(5)
-
-
-def handleScaleIn() -> None:
-    """Handles scaling in by decreasing the number of active servers."""
-    global avgVcpuUtil, serversActive
-
-    # Ensure at least 1 server is running
-    if serversActive > 1:
-        oldServersActive = serversActive
-        serversActive -= 1
-
-        # Increase the average utilisation proportionally
-        # This assumes that the workload stays constant
-        avgVcpuUtil = int(avgVcpuUtil * (oldServersActive / serversActive))
-        
-        # Make sure utilisation stays within bounds of 0-100%
-        avgVcpuUtil = max(0, min(avgVcpuUtil, 100))
-
-
-def handleScaleOut() -> None:
-    """Handles scaling out by increasing the number of active servers."""
-    global avgVcpuUtil, serversActive
-    
-    oldServersActive = serversActive
-    serversActive += 2                          # Add on two servers, since 1 isn't enough for a big difference
-
-    if serversActive > 8: serversActive = 8     # Cap number of servers at 8
-
-    # Decrease the average utilisation proportionally
-    # This assumes that the workload stays constant
-    avgVcpuUtil = int(avgVcpuUtil * (oldServersActive / serversActive))
-    
-    # Make sure utilisation stays within bounds of 0-100%
-    avgVcpuUtil = max(0, min(avgVcpuUtil, 100))
-
-
-def subscribe(client: mqtt_client) -> None:
-    """Subscribe client to topics."""
-    def on_message(client, userdata, msg):
-        """Print received messages to terminal and process commands"""
-        global simMode
-
-        print(dedent(f"""\
-                     ====================[SUB]====================
-                     {msg.topic}
-                     QoS: {msg.qos}
-                     Retained?: {msg.retain}
-                     
-                     Message:
-                     {msg.payload.decode()}
-                     =============================================
-                     """))
-
-        if msg.topic == f"{baseTopic}/commands":
-            cmdActions = {
-                "!scalein": handleScaleIn,
-                "!scaleout": handleScaleOut,
-                "!simnormal": SimMode.NORMAL.value,
-                "!simincrease": SimMode.INCREASING.value,
-                "!simdecrease": SimMode.DECREASING.value
-            }
-
-            # Remove all whitespace from command and make everything lowercase
-            command = msg.payload.decode().strip().lower()
-            
-            # Execute valid commands
-            if command in cmdActions:
-                action = cmdActions[command]
-                result = action() if callable(action) else action   # Call function if function
-
-                if not callable(action): simMode = result           # Update simMode if value
-
-    client.on_message = on_message
-    client.subscribe(subscribeTopics)
+    # Every received message is printed, and commands are executed
+    client.onMessage = console.sub
+    client.subscribe(cluster.commandTopic, lambda message: cluster.handleCommand(message.text))
+    client.subscribe("public/#", lambda message: None)
     print(f"Subscribed to topics: {subscribeTopics}\n")
 
-
-if __name__ == "__main__":
-    print("Starting the server cluster simulation...")
-    
-    client = connect_mqtt()
-    if client is None:
+    # Without this, publishing would start before the connection is fully established
+    # It only fails if the broker refuses the connection, otherwise the client keeps retrying
+    if not await client.connect():
         print("Failed to connect to the MQTT broker. Exiting...")
+        await client.close()
         exit(1)
 
-    # Create threads for each publish function
-    avgVcpuUtilThread = threading.Thread(target=pubAvgVcpuUse, args=(client,))
-    serversActiveThread = threading.Thread(target=pubServersActive, args=(client,))
+    # Create a task for each publish loop needed by the publish mode
+    publishers = []
+    if publishMode != "snapshot":
+        publishers += [pubAvgVcpuUse(client), pubServersActive(client)]
+    if publishMode != "topics":
+        publishers.append(pubSnapshot(client))
+    if statsPeriod > 0:
+        publishers.append(pubStats(client))
+
+    print("Starting publishing tasks")
+    tasks = [asyncio.create_task(publisher) for publisher in publishers]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print("Successfully stopped publishing tasks")
+        await client.close()
 
-    print("Starting publishing threads")
-    avgVcpuUtilThread.start()
-    serversActiveThread.start()
+
+if __name__ == "__main__":
+    print("Starting the server cluster simulation...")
 
     try:
-        client.loop_forever()
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt detected, disconnecting from MQTT broker...")
     except Exception as e:
         print(f"Error during main operation: {e}")
     finally:
-        # Signal the threads to stop and wait for them to finish operations
-        isRunning = False
-        avgVcpuUtilThread.join()
-        serversActiveThread.join()
-        print("Successfully stopped publishing threads")
-
-        disconnect_mqtt(client)
+        console.close()
         print("Client disconnected, exiting program.")
\ No newline at end of file
@@ -0,0 +1,121 @@
+from cluster import Cluster, ScalingConfig, defaultConfig, simModeSteps, utilPeriod
+import numpy as np
+
+# Optional workload model which tracks the utilisation of each server in a cluster, instead of one averaged value
+#
+# Requests arrive at a rate given by a rate generator, which by default is a random walk biased by the simulation
+# mode just like the averaged model. Each tick, the requests are split into batches of random size and cost, and a
+# load balancer picks a server for each batch. Work a server can't finish within the tick is carried over as a
+# backlog, so a poorly balanced cluster ends up with hot servers even when its average utilisation looks fine
+#
+# The averaged utilisation, warnings and scaling commands all work the same as a normal cluster, so this can be
+# used anywhere a Cluster is
+
+loadBalancers = ["round-robin", "least-loaded", "power-of-two"]
+
+serverCapacity = 100    # Requests per second one server handles at 100% utilisation, each request costs 1 on average
+requestBatches = 64     # Most batches the requests of one tick are dispatched in, this bounds the cost of balancing
+
+
+def randomWalkRates(cluster: Cluster, rate: float):
+    """Yields the request rate for each tick, moving it by the same steps as the averaged model's utilisation"""
+    # Like the averaged utilisation the walk is bounded, here by what the largest cluster could handle
+    maxRate = cluster.config.maxServers * serverCapacity
+    while True:
+        low, high = simModeSteps[cluster.simMode]
+        rate = max(0.0, min(rate + cluster.rng.randint(low, high) * serverCapacity / 100, maxRate))
+        yield rate
+
+
+class WorkloadCluster(Cluster):
+    """Cluster with a utilisation for each server, fed by a request rate and spread by a load balancer
+
+    rates is an iterator yielding the request rate (requests per second) for each tick, defaulting to a random walk
+    """
+    def __init__(self, clusterId: str | None = None, avgVcpuUtil: int = 10, serversActive: int = 1,
+                 config: ScalingConfig = defaultConfig, seed: int | str | None = None,
+                 balancer: str = "round-robin", rates=None) -> None:
+        if balancer not in loadBalancers:
+            raise ValueError(f"Load balancer must be one of {loadBalancers}, got '{balancer}'")
+
+        super().__init__(clusterId, avgVcpuUtil, serversActive, config, seed)
+        self.balancer = balancer
+
+        # NumPy draws are seeded from the cluster's own random stream, so a seeded run is still repeatable
+        self.npRng = np.random.default_rng(self.rng.getrandbits(64))
+
+        self.serverUtil = np.full(serversActive, avgVcpuUtil, dtype=np.float64)
+        self.backlog = np.zeros(serversActive)      # Requests waiting on each server from earlier ticks
+        self.nextServer = 0                         # Where round robin carries on from
+
+        # Start at the request rate which gives the initial utilisation
+        self.rates = rates if rates is not None else randomWalkRates(self, avgVcpuUtil * serversActive * serverCapacity / 100)
+        self.requestRate = 0.0
+
+
+    def stepLoad(self) -> None:
+        """Dispatches one tick of requests to the servers and works out the utilisation of each"""
+        self.requestRate = next(self.rates, self.requestRate)   # A finished trace holds its last rate
+        count = self.npRng.poisson(self.requestRate * utilPeriod)
+
+        load = 0.0
+        batches = min(count, requestBatches)
+        if batches:
+            # Split the requests as evenly as possible, each batch costs the sum of its requests' random costs
+            sizes = np.full(batches, count // batches)
+            sizes[:count % batches] += 1
+            costs = self.npRng.gamma(sizes, 1.0)
+            load = np.bincount(self.balance(costs), weights=costs, minlength=self.serversActive)
+
+        capacity = serverCapacity * utilPeriod
+        demand = self.backlog + load
+        self.backlog = np.maximum(demand - capacity, 0)
+        self.serverUtil = np.minimum(demand / capacity * 100, 100)
+        self.avgVcpuUtil = int(round(self.serverUtil.mean()))
+
+
+    def balance(self, costs: np.ndarray) -> np.ndarray:
+        """Returns the server each batch of requests is sent to"""
+        servers = self.serversActive
+        if self.balancer == "round-robin":
+            assigned = (self.nextServer + np.arange(len(costs))) % servers
+            self.nextServer = (self.nextServer + len(costs)) % servers
+            return assigned
+
+        # The other balancers look at how much work each server has waiting, including batches sent this tick
+        # Each choice depends on the ones before it so this can't be vectorised, plain lists are faster than arrays here
+        pending = self.backlog.tolist()
+        assigned = []
+        if self.balancer == "least-loaded":
+            for cost in costs.tolist():
+                server = pending.index(min(pending))
+                pending[server] += cost
+                assigned.append(server)
+        else:
+            # Power of two choices, the less loaded of two random servers
+            choices = self.npRng.integers(servers, size=(len(costs), 2)).tolist()
+            for cost, (first, second) in zip(costs.tolist(), choices):
+                server = first if pending[first] <= pending[second] else second
+                pending[server] += cost
+                assigned.append(server)
+        return np.array(assigned, dtype=np.intp)
+
+
+    def rebalance(self, serversActive: int) -> None:
+        """Sets the number of active servers, moving the work of any removed servers onto the rest"""
+        oldServersActive = self.serversActive
+        self.serversActive = serversActive
+
+        if serversActive > oldServersActive:
+            # New servers start idle
+            added = serversActive - oldServersActive
+            self.serverUtil = np.concatenate((self.serverUtil, np.zeros(added)))
+            self.backlog = np.concatenate((self.backlog, np.zeros(added)))
+        else:
+            removedUtil = self.serverUtil[serversActive:].sum()
+            removedBacklog = self.backlog[serversActive:].sum()
+            self.serverUtil = np.minimum(self.serverUtil[:serversActive] + removedUtil / serversActive, 100)
+            self.backlog = self.backlog[:serversActive] + removedBacklog / serversActive
+
+        self.nextServer %= serversActive
+        self.avgVcpuUtil = int(round(self.serverUtil.mean()))
\ No newline at end of file
@@ -0,0 +1,129 @@
+from cluster import Cluster, ScalingConfig, clusterSeed, defaultConfig
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, fields
+from headless_sim import HeadlessSim, parseCommand
+from load_trace import traceRates
+from server_workload import WorkloadCluster, loadBalancers
+from scaling_policy import makePolicy, policyNames
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+
+# Runs the headless simulation across a grid of scaling thresholds and policies to compare how each performs
+# Every combination is run with the same set of seeds, so differences come from the thresholds and not the randomness
+# Runs are spread across all cores with a process pool
+
+# The load each run goes through when no commands are given, this cycles through each simulation mode
+defaultPhases = ["!simincrease", "!simnormal", "!simdecrease", "!simnormal"]
+
+
+def loadCycle(hours: float, phaseMinutes: float) -> list[tuple[float, str]]:
+    """Returns commands which cycle through the simulation modes for the length of a run"""
+    phaseSeconds = phaseMinutes * 60
+    count = int(hours * 3600 // phaseSeconds) + 1
+    return [(i * phaseSeconds, defaultPhases[i % len(defaultPhases)]) for i in range(count)]
+
+
+def runOnce(config: ScalingConfig, policy: str, seed: str, hours: float, commands: list[tuple[float, str]], slaLimit: int,
+            balancer: str | None = None, loadTrace: str | None = None, traceScale: float = 1.0) -> dict:
+    """Runs a single seeded simulation and returns its results"""
+    if balancer:
+        # Each run streams the trace from the file itself, so nothing large is sent to the worker processes
+        # Runs longer than the trace replay it from the start
+        rates = traceRates(loadTrace, traceScale, loop=True) if loadTrace else None
+        cluster = WorkloadCluster(config=config, seed=seed, balancer=balancer, rates=rates)
+    else:
+        cluster = Cluster(config=config, seed=seed)
+    scalingPolicy = makePolicy(policy, config)
+    sim = HeadlessSim([cluster], slaLimit=slaLimit, policies={cluster.clusterId: scalingPolicy} if scalingPolicy else None)
+    for dueTime, command in commands:
+        sim.scheduleCommand(dueTime, command)
+    sim.run(hours * 3600)
+
+    return {
+        "serverHours": sim.serverSeconds / 3600,
+        "hoursOverLimit": sim.secondsOverHigh / 3600,
+        "scaleOuts": sim.scaleOuts,
+        "scaleIns": sim.scaleIns,
+        "warnings": cluster.stats.warnings,
+        "meanResponseSeconds": cluster.stats.snapshot()["mean_response_seconds"] or 0.0,
+        "meanReliefSeconds": sim.meanReliefSeconds,
+        "maxReliefSeconds": sim.maxReliefSeconds
+    }
+
+
+def runConfig(task: tuple) -> dict:
+    """Runs every seed for one combination of thresholds and policy, and averages the results"""
+    config, policy, seeds, hours, commands, slaLimit, workload = task
+    results = [runOnce(config, policy, seed, hours, commands, slaLimit, *workload) for seed in seeds]
+
+    row = {"policy": policy, **asdict(config)}
+    for key in results[0]:
+        row[key] = sum(result[key] for result in results) / len(results)
+    row["pctOverLimit"] = 100 * row["hoursOverLimit"] / hours
+    return row
+
+
+def configGrid(args: argparse.Namespace) -> list[ScalingConfig]:
+    """Returns a config for every combination of the values given for each threshold"""
+    names = [field.name for field in fields(ScalingConfig)]
+    values = [getattr(args, name) for name in names]
+    return [ScalingConfig(**dict(zip(names, combination))) for combination in itertools.product(*values)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the headless simulation over a grid of scaling thresholds and policies")
+
+    # Each threshold takes a list of values to try, defaulting to the value the simulation normally uses
+    for field in fields(ScalingConfig):
+        flag = "--" + "".join(f"-{c.lower()}" if c.isupper() else c for c in field.name)
+        parser.add_argument(flag, dest=field.name, type=int, nargs="+", default=[getattr(defaultConfig, field.name)],
+                            help=f"values of {field.name} to try (default: {getattr(defaultConfig, field.name)})")
+
+    parser.add_argument("-p", "--policy", choices=policyNames, nargs="+", default=["warnings"], help="scaling policies to try")
+    parser.add_argument("--hours", type=float, default=24, help="hours of simulated time for each run")
+    parser.add_argument("--runs", type=int, default=5, help="number of seeded runs to average for each combination")
+    parser.add_argument("-s", "--seed", default=0, help="base seed, the same seed repeats the same sweep")
+    parser.add_argument("--sla-limit", type=int, default=defaultConfig.highLimit,
+                        help="utilisation (%%) that counts as over the limit for every combination")
+    parser.add_argument("--phase-minutes", type=float, default=60, help="minutes spent in each mode of the default load cycle")
+    parser.add_argument("-c", "--command", type=parseCommand, action="append",
+                        help="command to send at a time, e.g. 600:!simincrease, replaces the default load cycle")
+    parser.add_argument("--balancer", choices=loadBalancers,
+                        help="simulate each server behind this load balancer instead of one averaged utilisation")
+    parser.add_argument("--load-trace", help="request rate trace (CSV or .bin) to replay instead of the load cycle, uses the per-server model")
+    parser.add_argument("--trace-scale", type=float, default=1.0, help="multiplier for every rate in the load trace")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-o", "--output", help="CSV file to write the results to, defaults to stdout")
+    args = parser.parse_args()
+
+    # A load trace sets the load itself, so the load cycle's mode changes would have no effect
+    commands = args.command or ([] if args.load_trace else loadCycle(args.hours, args.phase_minutes))
+    workload = (args.balancer or ("round-robin" if args.load_trace else None), args.load_trace, args.trace_scale)
+    seeds = [clusterSeed(args.seed, i) for i in range(args.runs)]
+    configs = configGrid(args)
+    tasks = [(config, policy, seeds, args.hours, commands, args.sla_limit, workload) for config in configs for policy in args.policy]
+
+    print(f"Running {len(tasks)} combinations x {args.runs} runs on {args.workers} workers...", file=sys.stderr)
+    startTime = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        rows = list(executor.map(runConfig, tasks, chunksize=max(1, len(tasks) // (args.workers * 4))))
+
+    print(f"Finished in {time.perf_counter() - startTime:.2f} seconds", file=sys.stderr)
+
+    # Cheapest combinations first, then the least time spent over the limit
+    rows.sort(key=lambda row: (row["serverHours"], row["hoursOverLimit"]))
+
+    outputFile = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(outputFile, fieldnames=list(rows[0]))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: round(value, 3) if isinstance(value, float) else value for key, value in row.items()})
+    finally:
+        if outputFile is not sys.stdout:
+            outputFile.close()
\ No newline at end of file
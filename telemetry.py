@@ -0,0 +1,180 @@
+from collections import namedtuple
+import struct
+import time
+
+# Compact binary payload for the simulation/servers/* topics, used instead of the text messages when enabled
+# A binary payload holds a full snapshot of a cluster, so consumers don't need to parse strings to get the values
+#
+# Layout (little endian):
+#   marker         uint8    always 0xA5
+#   timestamp      float64  seconds since the epoch when the snapshot was taken
+#   avgVcpuUtil    uint8    average CPU utilisation (%)
+#   serversActive  uint16   number of active servers
+#   idLength       uint8    length of the cluster ID, 0 for the single cluster in server_cluster.py
+#   clusterId      bytes    UTF-8 cluster ID
+#
+# 0xA5 can never start a UTF-8 string, so the marker tells binary and text payloads apart on the same topic
+#
+# Snapshot payloads are one or more of these records back to back, so many clusters can share a message
+#
+# Clusters using the per-server workload model also publish the utilisation of every server in one message per tick
+# on simulation/servers/per_server. As text this is "Server utilisation: 12%, 40%, ...", and in binary it is the
+# marker 0xA6 followed by one uint8 utilisation (%) per server
+#
+# Clusters with boot or drain delays publish how many servers are in each state on simulation/servers/states.
+# As text this is "Server states: 2 active, 0 pending, 1 booting, 0 draining", and in binary it is the marker 0xA7
+# followed by a uint16 for each of those states in the same order
+
+binaryMarker = 0xA5
+serverUtilMarker = 0xA6
+serverStatesMarker = 0xA7
+headerStruct = struct.Struct("<BdBHB")
+statesStruct = struct.Struct("<BHHHH")
+
+Telemetry = namedtuple("Telemetry", ["clusterId", "timestamp", "avgVcpuUtil", "serversActive"])
+ServerStates = namedtuple("ServerStates", ["active", "pending", "booting", "draining"])
+
+# Prefixes of the text payloads published by the clusters
+avgPrefix = "Avg CPU utilisation: "
+activePrefix = "Active servers: "
+serverUtilPrefix = "Server utilisation: "
+serverStatesPrefix = "Server states: "
+
+
+def encodeTelemetry(clusterId: str | None, avgVcpuUtil: int, serversActive: int, timestamp: float | None = None) -> bytes:
+    """Packs a cluster snapshot into a binary payload"""
+    idBytes = clusterId.encode() if clusterId else b""
+    if timestamp is None:
+        timestamp = time.time()
+    return headerStruct.pack(binaryMarker, timestamp, avgVcpuUtil, serversActive, len(idBytes)) + idBytes
+
+
+def encodeSnapshot(clusters: list, timestamp: float | None = None) -> bytes:
+    """Packs the current state of each cluster into a single snapshot payload"""
+    if timestamp is None:
+        timestamp = time.time()
+    return b"".join(encodeTelemetry(cluster.clusterId, cluster.avgVcpuUtil, cluster.serversActive, timestamp) for cluster in clusters)
+
+
+def decodeSnapshot(payload: bytes) -> list[Telemetry]:
+    """Unpacks every record in a binary payload, stopping at the first invalid record"""
+    records = []
+    offset = 0
+    while len(payload) - offset >= headerStruct.size and payload[offset] == binaryMarker:
+        _, timestamp, avgVcpuUtil, serversActive, idLength = headerStruct.unpack_from(payload, offset)
+        offset += headerStruct.size
+        if len(payload) - offset < idLength:
+            break                               # The cluster ID was cut short
+        idBytes = payload[offset:offset + idLength]
+        offset += idLength
+        records.append(Telemetry(idBytes.decode(errors="replace") or None, timestamp, avgVcpuUtil, serversActive))
+    return records
+
+
+def encodeServerUtil(serverUtil, binary: bool = False) -> bytes | str:
+    """Packs the utilisation of each server in a cluster into one payload"""
+    if binary:
+        return bytes([serverUtilMarker]) + bytes(int(util) for util in serverUtil)
+    return serverUtilPrefix + ", ".join(f"{int(util)}%" for util in serverUtil)
+
+
+def decodeServerUtil(payload: bytes) -> list[int] | None:
+    """Unpacks a binary or text per-server payload, returns None if the payload isn't one"""
+    if payload[:1] == bytes([serverUtilMarker]):
+        return list(payload[1:])
+
+    text = payload.decode(errors="replace")
+    if not text.startswith(serverUtilPrefix):
+        return None
+    try:
+        return [int(util.strip().rstrip("%")) for util in text[len(serverUtilPrefix):].split(",") if util.strip()]
+    except ValueError:
+        return None
+
+
+def encodeServerStates(states: ServerStates, binary: bool = False) -> bytes | str:
+    """Packs the number of servers in each state into one payload"""
+    if binary:
+        return statesStruct.pack(serverStatesMarker, *states)
+    return serverStatesPrefix + ", ".join(f"{count} {state}" for state, count in zip(ServerStates._fields, states))
+
+
+def decodeServerStates(payload: bytes) -> ServerStates | None:
+    """Unpacks a binary or text server states payload, returns None if the payload isn't one"""
+    if payload[:1] == bytes([serverStatesMarker]):
+        if len(payload) != statesStruct.size:
+            return None
+        return ServerStates(*statesStruct.unpack(payload)[1:])
+
+    text = payload.decode(errors="replace")
+    if not text.startswith(serverStatesPrefix):
+        return None
+    counts = {}
+    for part in text[len(serverStatesPrefix):].split(","):
+        count, _, state = part.strip().partition(" ")
+        if state in ServerStates._fields and count.isdigit():
+            counts[state] = int(count)
+    if len(counts) != len(ServerStates._fields):
+        return None
+    return ServerStates(**counts)
+
+
+def isBinary(payload: bytes) -> bool:
+    return payload[:1] == bytes([binaryMarker])
+
+
+def topicClusterId(topic: str) -> str | None:
+    """Returns the cluster ID from a topic such as simulation/<cluster_id>/servers/active"""
+    levels = topic.split("/")
+    return levels[1] if len(levels) == 4 else None
+
+
+def decodeTelemetry(topic: str, payload: bytes) -> Telemetry | None:
+    """Decodes a binary or text telemetry payload, returns None if the payload isn't telemetry
+
+    Text payloads only hold one value, so the other value and the timestamp are None
+    """
+    if isBinary(payload):
+        if len(payload) < headerStruct.size:
+            return None
+        _, timestamp, avgVcpuUtil, serversActive, idLength = headerStruct.unpack_from(payload)
+        idBytes = payload[headerStruct.size:headerStruct.size + idLength]
+        if len(idBytes) < idLength:
+            return None
+        return Telemetry(idBytes.decode(errors="replace") or None, timestamp, avgVcpuUtil, serversActive)
+
+    text = payload.decode(errors="replace")
+    try:
+        if text.startswith(avgPrefix):
+            return Telemetry(topicClusterId(topic), None, int(text[len(avgPrefix):].rstrip("%")), None)
+        if text.startswith(activePrefix):
+            return Telemetry(topicClusterId(topic), None, None, int(text[len(activePrefix):]))
+    except ValueError:
+        pass
+    return None
+
+
+def payloadText(topic: str, payload: bytes) -> str:
+    """Returns a payload as readable text, binary telemetry is shown the same way as the text it replaces"""
+    if payload[:1] == bytes([serverUtilMarker]):
+        return encodeServerUtil(payload[1:])
+    if payload[:1] == bytes([serverStatesMarker]):
+        states = decodeServerStates(payload)
+        return encodeServerStates(states) if states else "Invalid binary server states"
+    if not isBinary(payload):
+        return payload.decode(errors="replace")
+
+    records = decodeSnapshot(payload)
+    if not records:
+        return "Invalid binary telemetry"
+
+    # Only show the value the topic is for, matching the text payloads
+    if topic.endswith("/avg_cpu_util"):
+        return f"{avgPrefix}{records[0].avgVcpuUtil}%"
+    if topic.endswith("/active"):
+        return f"{activePrefix}{records[0].serversActive}"
+
+    # Snapshots show every value, with a line for each cluster if there are several
+    if len(records) == 1:
+        return f"{avgPrefix}{records[0].avgVcpuUtil}%, {activePrefix}{records[0].serversActive}"
+    return "\n".join(f"{record.clusterId}: {avgPrefix}{record.avgVcpuUtil}%, {activePrefix}{record.serversActive}" for record in records)
\ No newline at end of file
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import random
+import socket
+import sys
+import pytest
+
+# Shared helpers for the tests, run with python -m pytest from the top of the repository
+# Every MQTT test uses its own local broker on a free port, so the tests don't need a broker or a .env file
+
+# The modules are scripts at the top of the repository rather than a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_broker import BrokerThread
+
+
+@pytest.fixture
+def broker():
+    broker = BrokerThread()
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+def freePort() -> int:
+    """Returns a port nothing is listening on, for brokers which need to be restarted on the same port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def waitFor(condition, timeout: float = 5) -> None:
+    """Waits until condition() is true, failing the test if it isn't within the timeout"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "Timed out waiting for the condition"
+        await asyncio.sleep(0.01)
+
+
+class ReplayRandom(random.Random):
+    """Stands in for a Cluster's random stream, handing out steps drawn by a ClusterArray instead"""
+    def __init__(self, steps: list[int]) -> None:
+        super().__init__()
+        self.steps = iter(steps)
+
+
+    def randint(self, low: int, high: int) -> int:
+        step = next(self.steps)
+        assert low <= step <= high
+        return step
\ No newline at end of file
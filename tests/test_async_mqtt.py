@@ -0,0 +1,245 @@
+from async_mqtt import AsyncMqttClient, ClientThread, brokerSettings, publishQueued, publishQueueFull
+from local_broker import BrokerThread
+from conftest import freePort, waitFor
+import async_mqtt
+import asyncio
+import threading
+import pytest
+
+
+def test_publish_and_subscribe(broker):
+    async def run():
+        received = []
+        everything = []
+        subscriber = AsyncMqttClient("sub", "127.0.0.1", broker.port, log=None)
+        subscriber.onMessage = everything.append
+        subscriber.subscribe("a/+", lambda message: received.append(("a/+", message.topic, message.text)))
+        subscriber.subscribe("a/#", lambda message: received.append(("a/#", message.topic, message.text)))
+        publisher = AsyncMqttClient("pub", "127.0.0.1", broker.port, log=None)
+        assert await subscriber.connect(5) and await publisher.connect(5)
+        await asyncio.sleep(0.1)    # Until the broker has the subscriptions
+
+        assert publisher.publishNowait("a/b", "1") == publishQueued
+        await publisher.publish("a/b/c", b"2")
+        await publisher.publish("b", "3")
+        await waitFor(lambda: len(received) == 3)
+        await asyncio.sleep(0.1)
+
+        # Each handler whose filter matches, but onMessage once per message
+        assert sorted(received) == [("a/#", "a/b", "1"), ("a/#", "a/b/c", "2"), ("a/+", "a/b", "1")]
+        assert [message.topic for message in everything] == ["a/b", "a/b/c"]
+        await subscriber.close()
+        await publisher.close()
+    asyncio.run(run())
+
+
+def test_unsubscribe(broker):
+    async def run():
+        received = []
+        handler = received.append
+        client = AsyncMqttClient("client", "127.0.0.1", broker.port, log=None)
+        client.subscribe("t", handler)
+        await client.connect(5)
+        await asyncio.sleep(0.1)
+        client.publishNowait("t", "1")
+        await waitFor(lambda: len(received) == 1)
+
+        client.unsubscribe("t", handler)
+        assert "t" not in client.subscriptions
+        await asyncio.sleep(0.1)
+        client.publishNowait("t", "2")
+        await asyncio.sleep(0.2)
+        assert len(received) == 1
+        await client.close()
+    asyncio.run(run())
+
+
+def test_retained_message(broker):
+    async def run():
+        publisher = AsyncMqttClient("pub", "127.0.0.1", broker.port, log=None)
+        await publisher.connect(5)
+        publisher.publishNowait("kept", "value", retain=True)
+        await publisher.close()
+
+        received = []
+        subscriber = AsyncMqttClient("sub", "127.0.0.1", broker.port, log=None)
+        subscriber.subscribe("kept", received.append)
+        await subscriber.connect(5)
+        await waitFor(lambda: received)
+        assert (received[0].text, received[0].retain) == ("value", True)
+        await subscriber.close()
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("returnCode", [1, 2, 4, 5])
+def test_refused_connection(returnCode):
+    async def run():
+        async def refuse(reader, writer):
+            await reader.read(2)
+            writer.write(bytes([0x20, 2, 0, returnCode]))
+            await writer.drain()
+            writer.close()
+        server = await asyncio.start_server(refuse, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        answers = []
+        client = AsyncMqttClient("client", "127.0.0.1", port, log=None)
+        client.onConnect = answers.append
+        assert await asyncio.wait_for(client.connect(), 5) is False     # Returns rather than waiting forever
+        assert answers == [returnCode]
+        assert client.task.done()
+        await client.close()
+        server.close()
+    asyncio.run(run())
+
+
+def test_connect_timeout():
+    async def run():
+        client = AsyncMqttClient("client", "127.0.0.1", freePort(), log=None)
+        assert await client.connect(0.2) is False
+        assert not client.task.done()   # Still retrying in the background
+        await client.close()
+    asyncio.run(run())
+
+
+def test_reconnect_resubscribes_and_sends_queued(monkeypatch):
+    monkeypatch.setattr(async_mqtt, "minBackoff", 0.05)
+    port = freePort()
+
+    async def run():
+        broker = BrokerThread(port=port)
+        broker.start()
+        received = []
+        disconnects = []
+        client = AsyncMqttClient("client", "127.0.0.1", port, log=None)
+        client.onDisconnect = disconnects.append
+        client.subscribe("t", lambda message: received.append(message.text))
+        await client.connect(5)
+
+        await asyncio.to_thread(broker.stop)
+        await waitFor(lambda: not client.isConnected)
+        assert len(disconnects) == 1 and disconnects[0] is not None
+
+        # Queued while the broker is down, and sent once the client is back and subscribed again
+        assert client.publishNowait("t", "while down") == publishQueued
+        broker = BrokerThread(port=port)
+        broker.start()
+        await waitFor(lambda: received)
+        assert received == ["while down"]
+        assert client.connections == 2
+
+        await client.close()
+        await asyncio.to_thread(broker.stop)
+    asyncio.run(run())
+
+
+def test_publish_nowait_overflow():
+    client = AsyncMqttClient("client", "127.0.0.1", maxQueued=2, log=None)
+    assert client.publishNowait("t", "1") == publishQueued
+    assert client.publishNowait("t", "2") == publishQueued
+    assert client.queueFull
+    assert client.publishNowait("t", "3") == publishQueueFull
+    assert (len(client.pending), client.dropped) == (2, 1)
+
+
+@pytest.mark.parametrize("topic", ["", "a/+", "a/#"])
+def test_publish_invalid_topic(topic):
+    client = AsyncMqttClient("client", "127.0.0.1", log=None)
+    with pytest.raises(ValueError):
+        client.publishNowait(topic, "1")
+
+
+def test_publish_waits_for_space(broker):
+    async def run():
+        received = []
+        client = AsyncMqttClient("client", "127.0.0.1", broker.port, maxQueued=1, log=None)
+        client.subscribe("t", lambda message: received.append(message.text))
+        await client.connect(5)
+        await asyncio.sleep(0.1)
+
+        for i in range(50):
+            await client.publish("t", str(i))
+        await waitFor(lambda: len(received) == 50)
+        assert received == [str(i) for i in range(50)]
+        assert client.dropped == 0
+        await client.close()
+    asyncio.run(run())
+
+
+def test_callback_errors_keep_client_running(broker, capsys):
+    async def run():
+        def fail(*args):
+            raise RuntimeError("callback failed")
+
+        received = []
+        client = AsyncMqttClient("client", "127.0.0.1", broker.port, log=None)
+        client.onConnect = fail
+        client.onMessage = fail
+        client.subscribe("bad", fail)
+        client.subscribe("t", lambda message: received.append(message.text))
+        assert await client.connect(5)
+        await asyncio.sleep(0.1)
+
+        client.publishNowait("bad", "1")
+        client.publishNowait("t", "2")
+        await waitFor(lambda: received)
+        assert received == ["2"]
+        assert client.isConnected and not client.task.done()
+        await client.close()
+    asyncio.run(run())
+    assert "callback failed" in capsys.readouterr().err
+
+
+def test_client_thread(broker):
+    received = threading.Event()
+    client = ClientThread(AsyncMqttClient("client", "127.0.0.1", broker.port, log=None))
+    client.start()
+    client.subscribe("t", lambda message: received.set())
+    with pytest.raises(ValueError):
+        client.subscribe("t/#/x", lambda message: None)
+
+    for _ in range(50):
+        if client.isConnected:
+            break
+        received.wait(0.1)
+    assert client.isConnected
+
+    # The subscription is sent on the client's thread, so publish until it is in place
+    for _ in range(50):
+        client.publish("t", "1")
+        if received.wait(0.1):
+            break
+    assert received.is_set()
+    client.stop()
+    assert not client.is_alive()
+
+
+@pytest.fixture
+def brokerEnv(monkeypatch):
+    for name in ["BROKER_PORT", "MQTT_USERNAME", "MQTT_PASSWORD", *async_mqtt.tlsVariables]:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("BROKER", "broker.example")
+    return monkeypatch
+
+
+def test_broker_settings(brokerEnv):
+    assert brokerSettings() == ("broker.example", 1883, None, None)
+    brokerEnv.setenv("BROKER_PORT", "1884")
+    brokerEnv.setenv("MQTT_USERNAME", "user")
+    brokerEnv.setenv("MQTT_PASSWORD", "secret")
+    assert brokerSettings() == ("broker.example", 1884, "user", "secret")
+
+
+@pytest.mark.parametrize("name, value", [
+    ("BROKER_PORT", "8883"),
+    ("BROKER", "mqtts://broker.example"),
+    ("BROKER", "SSL://broker.example"),
+    ("MQTT_TLS", "1"),
+    ("MQTT_CA_CERTS", "/etc/ssl/certs/ca.pem")
+])
+def test_broker_settings_refuse_tls(brokerEnv, capsys, name, value):
+    # The client has no TLS, so it exits instead of sending credentials in plain text
+    brokerEnv.setenv(name, value)
+    with pytest.raises(SystemExit):
+        brokerSettings()
+    assert f"TLS was asked for by {name}" in capsys.readouterr().out
\ No newline at end of file
@@ -0,0 +1,66 @@
+from telemetry import encodeSnapshot, encodeTelemetry
+from types import SimpleNamespace
+import asyncio
+import importlib
+import pytest
+
+
+class RecordingPolicy:
+    """Stands in for a scaling policy, recording the utilisation passed to it each time it decides"""
+    def __init__(self) -> None:
+        self.decisions = []
+
+
+    def decide(self, now: float, avgVcpuUtil: float, serversActive: int, serversRequested: int | None = None) -> int | None:
+        self.decisions.append((avgVcpuUtil, serversActive))
+        return None
+
+
+@pytest.fixture
+def autoscalerModule(monkeypatch):
+    # autoscaler.py reads the broker settings when it is imported
+    monkeypatch.setenv("BROKER", "127.0.0.1")
+    return importlib.import_module("autoscaler")
+
+
+def runAutoscaler(autoscalerModule, messages: list[tuple[str, bytes]]) -> dict[str, RecordingPolicy]:
+    """Passes telemetry messages to an autoscaler whose clusters all use a recording policy"""
+    policies = {}
+
+    async def run() -> None:
+        client = autoscalerModule.AsyncMqttClient("test-autoscaler", "127.0.0.1", log=None)
+        autoscaler = autoscalerModule.Autoscaler(client, policy="target")
+        autoscaler.policyFor = lambda clusterId: policies.setdefault(clusterId, RecordingPolicy())
+        for topic, payload in messages:
+            autoscaler.handleTelemetry(topic, payload)
+
+    asyncio.run(run())
+    return policies
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_publish_mode_both_decides_once_per_tick(autoscalerModule, binary):
+    messages = []
+    for tick, util in enumerate([50, 60, 70]):
+        cluster = SimpleNamespace(clusterId="cluster-1", avgVcpuUtil=util, serversActive=2)
+        if binary:
+            payload = encodeTelemetry(cluster.clusterId, util, 2, tick)
+            messages += [("simulation/cluster-1/servers/avg_cpu_util", payload),
+                         ("simulation/cluster-1/servers/active", payload)]
+        else:
+            messages += [("simulation/cluster-1/servers/avg_cpu_util", f"Avg CPU utilisation: {util}%".encode()),
+                         ("simulation/cluster-1/servers/active", b"Active servers: 2")]
+        messages.append(("simulation/cluster-1/servers/snapshot", encodeSnapshot([cluster], tick)))
+
+    policies = runAutoscaler(autoscalerModule, messages)
+    assert policies["cluster-1"].decisions == [(50, 2), (60, 2), (70, 2)]
+
+
+def test_metric_topics_without_snapshots_are_used(autoscalerModule):
+    messages = []
+    for util in [50, 60]:
+        messages += [("simulation/cluster-1/servers/active", b"Active servers: 3"),
+                     ("simulation/cluster-1/servers/avg_cpu_util", f"Avg CPU utilisation: {util}%".encode())]
+
+    policies = runAutoscaler(autoscalerModule, messages)
+    assert policies["cluster-1"].decisions == [(50, 3), (60, 3)]
\ No newline at end of file
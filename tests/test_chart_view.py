@@ -0,0 +1,134 @@
+from chart_view import Chart, ChartView, RingSeries, columnRanges
+from types import SimpleNamespace
+import chart_view
+import numpy as np
+import pytest
+import queue
+
+
+class FakeCanvas:
+    """Keeps the coordinates of each item the way a Tk canvas does, so charts can be tested without a display"""
+    def __init__(self, parent, **options) -> None:
+        self.items = {}
+        self.rebuilds = 0       # Times the line's coordinates were replaced rather than added to
+
+
+    def create(self, *coords, **options) -> int:
+        item = len(self.items) + 1
+        self.items[item] = [float(coord) for coord in coords]
+        return item
+
+    create_text = create_rectangle = create_line = create
+
+
+    def coords(self, item: int, *coords):
+        if not coords:
+            return self.items[item]
+        self.items[item] = [float(coord) for coord in coords]
+        self.rebuilds += 1
+
+
+    def insert(self, item: int, index: str, coords: list[float]) -> None:
+        assert index == "end"
+        self.items[item].extend(coords)
+
+
+    def dchars(self, item: int, first: int, last: int) -> None:
+        # Line coordinates are deleted a point at a time, from the point holding first to the one holding last
+        first &= -2
+        last &= -2
+        del self.items[item][first:last + 2]
+
+
+    def move(self, item: int, dx: float, dy: float) -> None:
+        coords = self.items[item]
+        coords[0::2] = [x + dx for x in coords[0::2]]
+        coords[1::2] = [y + dy for y in coords[1::2]]
+
+
+    def itemconfig(self, item: int, **options) -> None:
+        pass
+
+
+    def bind(self, sequence: str, callback) -> None:
+        pass
+
+
+@pytest.fixture
+def fakeCanvas(monkeypatch):
+    monkeypatch.setattr(chart_view.tk, "Canvas", FakeCanvas)
+
+
+def rebuilt(series: RingSeries, yMax: float = 100, width: int = 520, height: int = 130) -> list[float]:
+    """Line coordinates of a new chart which draws the whole series in one go"""
+    chart = Chart(None, "rebuilt", yMax, width, height)
+    chart.draw(series, "")
+    return chart.canvas.coords(chart.line)
+
+
+def test_ring_series_newest_points():
+    series = RingSeries(5)
+    for i in range(7):
+        series.append(i, i * 10)
+    assert (series.total, series.count, series.first, series.latest) == (7, 5, 2, 60)
+    assert series.ordered()[1].tolist() == [20, 30, 40, 50, 60]
+    assert series.newest(3)[1].tolist() == [40, 50, 60]
+
+
+def test_column_ranges():
+    values = np.array([5, 1, 9, 2, 2, 7, 3], dtype=np.float32)
+    columns, lows, highs = columnRanges(4, values, 3)
+    assert columns.tolist() == [1, 2, 3]
+    assert lows.tolist() == [1, 2, 3]
+    assert highs.tolist() == [5, 9, 7]
+
+
+@pytest.mark.parametrize("capacity", [300, 1000, 3600])
+def test_incremental_line_matches_rebuild(fakeCanvas, capacity):
+    rng = np.random.default_rng(capacity)
+    series = RingSeries(capacity)
+    chart = Chart(None, "incremental", 100)
+    for refresh in range(400):
+        added = capacity + 5 if refresh == 250 else int(rng.integers(0, 25))
+        for _ in range(added):
+            series.append(series.total * 2.0, float(rng.integers(0, 101)))
+        if refresh == 300:
+            series.append(series.total * 2.0, 150)      # Grows the y range
+
+        chart.draw(series, "")
+        assert np.allclose(chart.canvas.coords(chart.line), rebuilt(series, chart.yMax))
+
+    # Once drawn, the line is added to rather than replaced, apart from the overwritten points and the y range growing
+    assert chart.canvas.rebuilds <= 5
+
+
+def test_resize_rebuilds_line(fakeCanvas):
+    series = RingSeries(1000)
+    chart = Chart(None, "resized", 100)
+    for i in range(1500):
+        series.append(i * 2.0, i % 100)
+    chart.draw(series, "")
+
+    chart.resize(SimpleNamespace(width=300, height=90))
+    assert chart.canvas.coords(chart.line) == pytest.approx(rebuilt(series, 100, 300, 90))
+    assert chart.canvas.coords(chart.frame) == [chart.left, chart.top, 299, 89]
+
+
+def test_refresh_survives_bad_payload(capsys):
+    # Only the parts of the view refresh uses, since a real ChartView needs a display
+    def decode(topic: str, payload: bytes, received: float) -> None:
+        if payload == b"bad":
+            raise UnicodeDecodeError("utf-8", payload, 0, 1, "invalid start byte")
+        decoded.append(payload)
+
+    decoded = []
+    scheduled = []
+    view = SimpleNamespace(incoming=queue.Queue(), decode=decode, changed=False, selected=None, series={},
+                           refreshInterval=500, refresh=None, after=lambda delay, callback: scheduled.append(delay))
+    for payload in [b"1", b"bad", b"2"]:
+        view.incoming.put(("simulation/servers/active", payload, 0.0))
+
+    ChartView.refresh(view)
+    assert decoded == [b"1", b"2"]
+    assert scheduled == [500]       # The next refresh is still scheduled
+    assert "invalid start byte" in capsys.readouterr().err
\ No newline at end of file
@@ -0,0 +1,130 @@
+from cluster import Cluster, ScalingConfig, utilPeriod
+import pytest
+
+
+@pytest.mark.parametrize("command", ["!scaleto abc", "!scaleto 2.5", "!scaleto", "!scale", "!scale two", "!scaleto 3 4"])
+def test_scale_commands_reject_non_integers(command):
+    cluster = Cluster(serversActive=2)
+    assert not cluster.handleCommand(command)
+    assert cluster.serverStates == (2, 0, 0, 0)
+    assert cluster.stats.scaleOuts == cluster.stats.scaleIns == 0
+
+
+@pytest.mark.parametrize("command, servers", [
+    ("!scaleto 5", 5),
+    ("  !SCALETO 4 ", 4),
+    ("!scaleto 0", 1),
+    ("!scaleto -3", 1),
+    ("!scaleto 50", 8),
+    ("!scale +3", 5),
+    ("!scale -1", 1),
+    ("!scale -10", 1),
+    ("!scale 20", 8)
+])
+def test_scale_commands_stay_between_one_and_the_cap(command, servers):
+    cluster = Cluster(avgVcpuUtil=40, serversActive=2)
+    assert cluster.handleCommand(command)
+    assert cluster.serversActive == servers
+    assert cluster.serversRequested == servers
+
+
+def test_scale_commands_at_the_current_size_change_nothing():
+    cluster = Cluster(avgVcpuUtil=40, serversActive=8)
+    assert cluster.handleCommand("!scaleto 100")
+    assert cluster.handleCommand("!scale 0")
+    assert cluster.avgVcpuUtil == 40
+    assert cluster.stats.scaleOuts == cluster.stats.scaleIns == 0
+
+
+def test_scale_commands_count_servers_still_starting():
+    cluster = Cluster(config=ScalingConfig(pendingDelay=10, bootDelay=20))
+    assert cluster.handleCommand("!scaleto 5")
+    assert cluster.serverStates == (1, 4, 0, 0)
+
+    # Relative changes start from the servers requested, not only those in service
+    assert cluster.handleCommand("!scale +2")
+    assert cluster.serverStates == (1, 6, 0, 0)
+    assert cluster.handleCommand("!scale +5")
+    assert cluster.serverStates == (1, 7, 0, 0)
+
+    # Scaling in cancels the newest servers which haven't started before draining any in service
+    cluster.clock = 10
+    cluster.advanceServers()
+    assert cluster.serverStates == (1, 0, 7, 0)
+    assert cluster.handleCommand("!scale -3")
+    assert cluster.serverStates == (1, 0, 4, 0)
+    assert cluster.handleCommand("!scaleto 1")
+    assert cluster.serverStates == (1, 0, 0, 0)
+    assert cluster.serversRunning == 1
+
+
+def test_scale_commands_bring_back_draining_servers():
+    cluster = Cluster(serversActive=4, config=ScalingConfig(drainDelay=30, bootDelay=20))
+    assert cluster.handleCommand("!scaleto 2")
+    assert cluster.serverStates == (2, 0, 0, 2)
+
+    # Draining servers are still running, so they go back into service before new ones boot
+    assert cluster.handleCommand("!scale +3")
+    assert cluster.serverStates == (4, 0, 1, 0)
+    assert cluster.serversRequested == 5
+
+
+def test_servers_move_through_each_state_with_delays():
+    cluster = Cluster(avgVcpuUtil=50, serversActive=2, config=ScalingConfig(pendingDelay=4, bootDelay=6, drainDelay=10))
+    assert cluster.hasServerStates
+
+    cluster.setServers(5)
+    assert cluster.serverStates == (2, 3, 0, 0)
+    assert (cluster.serversRequested, cluster.serversRunning) == (5, 2)     # Pending servers have no instance yet
+
+    cluster.clock = 3
+    cluster.advanceServers()
+    assert cluster.serverStates == (2, 3, 0, 0)
+    cluster.clock = 4
+    cluster.advanceServers()
+    assert cluster.serverStates == (2, 0, 3, 0)
+    assert (cluster.serversRequested, cluster.serversRunning) == (5, 5)
+
+    # The workload is only spread across the new servers once they have booted
+    cluster.clock = 9
+    cluster.advanceServers()
+    assert cluster.avgVcpuUtil == 50
+    cluster.clock = 10
+    cluster.advanceServers()
+    assert cluster.serverStates == (5, 0, 0, 0)
+    assert cluster.avgVcpuUtil == 20
+
+    # Removed servers leave service straight away, but keep running until they have drained
+    cluster.setServers(3)
+    assert cluster.serverStates == (3, 0, 0, 2)
+    assert (cluster.serversRequested, cluster.serversRunning) == (3, 5)
+    assert cluster.avgVcpuUtil == 33
+    cluster.clock = 20
+    cluster.advanceServers()
+    assert cluster.serverStates == (3, 0, 0, 0)
+
+
+def test_batches_started_at_different_times_finish_in_order():
+    cluster = Cluster(config=ScalingConfig(bootDelay=3 * utilPeriod))
+    cluster.setServers(3)
+    for _ in range(2):
+        cluster.stepUtil()
+    cluster.setServers(4)
+    assert cluster.serverStates == (1, 0, 3, 0)
+
+    # Each tick of the utilisation moves the clock on, the first batch boots a tick before the second
+    states = []
+    for _ in range(3):
+        cluster.stepUtil()
+        states.append(cluster.serverStates)
+    assert states == [(3, 0, 1, 0), (3, 0, 1, 0), (4, 0, 0, 0)]
+
+
+def test_servers_change_state_straight_away_without_delays():
+    cluster = Cluster(serversActive=3)
+    assert not cluster.hasServerStates
+    cluster.setServers(6)
+    assert cluster.serverStates == (6, 0, 0, 0)
+    cluster.setServers(2)
+    assert cluster.serverStates == (2, 0, 0, 0)
+    assert cluster.serversRunning == 2
\ No newline at end of file
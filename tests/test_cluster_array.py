@@ -0,0 +1,70 @@
+from cluster import Cluster, ScalingConfig, SimMode, simModeSteps, warningCommands
+from cluster_array import ClusterArray, warningMessages
+from conftest import ReplayRandom
+import numpy as np
+import pytest
+
+
+def test_matches_cluster_step_util():
+    count = 20
+    array = ClusterArray(count, seed=7)
+    clusters = [Cluster(f"cluster-{i}") for i in range(count)]
+    steps = [[] for _ in range(count)]
+    for cluster, clusterSteps in zip(clusters, steps):
+        cluster.rng = ReplayRandom(clusterSteps)
+
+    seen = set()
+    modes = [SimMode.INCREASING.value, SimMode.NORMAL.value, SimMode.DECREASING.value]
+    for tick in range(3000):
+        # Every cluster gets the same commands on both sides, including the monitor's response to each warning
+        if tick % 200 == 0:
+            mode = modes[tick // 200 % len(modes)]
+            array.setSimMode(np.arange(count) % 2 == 0, mode)
+            for cluster in clusters[::2]:
+                cluster.simMode = mode
+        if tick % 700 == 350:
+            array.scaleTo(np.ones(count, dtype=bool), 4)
+            for cluster in clusters:
+                cluster.handleCommand("!scaleto 4")
+
+        for clusterSteps, step in zip(steps, array.randomSteps()):
+            clusterSteps.append(int(step))
+        codes = array.applySteps(array.steps)
+        warnings = [cluster.stepUtil() for cluster in clusters]
+
+        assert [warningMessages[code] for code in codes] == warnings
+        assert array.avgVcpuUtil.tolist() == [cluster.avgVcpuUtil for cluster in clusters]
+        assert array.serversActive.tolist() == [cluster.serversActive for cluster in clusters]
+
+        seen.update(warnings)
+        commands = [warningCommands.get(warning) for warning in warnings]
+        array.scaleOut(np.array([command == "!scaleout" for command in commands]))
+        array.scaleIn(np.array([command == "!scalein" for command in commands]))
+        for cluster, command in zip(clusters, commands):
+            if command:
+                cluster.handleCommand(command)
+
+    # The run went through every kind of warning and scaled in both directions
+    assert seen == set(warningMessages)
+    assert all(cluster.stats.scaleOuts and cluster.stats.scaleIns for cluster in clusters)
+
+
+@pytest.mark.parametrize("mode", [mode.value for mode in SimMode])
+def test_random_steps_cover_range(mode):
+    array = ClusterArray(10000, seed=1)
+    array.setSimMode(np.ones(len(array), dtype=bool), mode)
+    steps = array.randomSteps()
+    low, high = simModeSteps[mode]
+    assert (steps.min(), steps.max()) == (low, high)
+
+
+def test_same_seed_repeats():
+    first, second = ClusterArray(100, seed="3"), ClusterArray(100, seed="3")
+    for _ in range(100):
+        assert np.array_equal(first.step(), second.step())
+    assert np.array_equal(first.avgVcpuUtil, second.avgVcpuUtil)
+
+
+def test_server_delays_refused():
+    with pytest.raises(ValueError):
+        ClusterArray(1, config=ScalingConfig(bootDelay=30))
\ No newline at end of file
@@ -0,0 +1,60 @@
+from cluster import Cluster
+from console import Console
+from telemetry import Telemetry, decodeSnapshot
+import importlib
+import os
+import subprocess
+import sys
+import pytest
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClient:
+    """Records every message published instead of sending it"""
+    def __init__(self) -> None:
+        self.published = []
+
+
+    def publishNowait(self, topic: str, payload: str | bytes) -> int:
+        self.published.append((topic, payload))
+        return 0
+
+
+@pytest.fixture
+def fleetModule(monkeypatch):
+    # cluster_fleet.py reads the broker settings when it is imported
+    monkeypatch.setenv("BROKER", "127.0.0.1")
+    return importlib.import_module("cluster_fleet")
+
+
+@pytest.mark.parametrize("batchSize, topics", [
+    (1, [f"simulation/cluster-{i}/servers/snapshot" for i in range(5)]),
+    (2, [f"simulation/snapshots/batch-{i}" for i in range(3)]),
+    (10, ["simulation/snapshots/batch-0"])
+])
+def test_snapshots_hold_every_cluster_of_their_batch(fleetModule, batchSize, topics):
+    clusters = [Cluster(f"cluster-{i}", avgVcpuUtil=10 + i, serversActive=i + 1, seed=i) for i in range(5)]
+    client = FakeClient()
+    scheduler = fleetModule.ClusterScheduler(client, clusters, Console("off"), publishMode="snapshot", batchSize=batchSize,
+                                             statsPeriod=0)
+
+    # Run the first snapshot of each batch, in the order the batches were made
+    events = sorted(scheduler.events, key=lambda event: event[1])
+    assert [event[2] for event in events] == [scheduler.tickSnapshot] * len(topics)
+    for dueTime, _, event, snapshot in events:
+        event(dueTime, snapshot)
+
+    snapshots = [(topic, payload) for topic, payload in client.published if "snapshot" in topic]
+    assert [topic for topic, _ in snapshots] == topics
+    records = [record for _, payload in snapshots for record in decodeSnapshot(payload)]
+    assert [record._replace(timestamp=None) for record in records] == \
+           [Telemetry(f"cluster-{i}", None, 10 + i, i + 1) for i in range(5)]
+
+
+@pytest.mark.parametrize("option", [["--batch-size", "0"], ["--batch-size", "-2"], ["-n", "0"]])
+def test_sizes_below_one_rejected(option):
+    result = subprocess.run([sys.executable, "cluster_fleet.py", *option], cwd=repoDir, capture_output=True, text=True,
+                            env={**os.environ, "BROKER": "127.0.0.1"}, timeout=30)
+    assert result.returncode == 2
+    assert "must be at least 1" in result.stderr
\ No newline at end of file
@@ -0,0 +1,68 @@
+from cluster import Cluster, highWarning
+from cluster_stats import ClusterStats
+import json
+
+
+def test_empty_snapshot():
+    stats = ClusterStats(20, 80)
+    assert stats.snapshot() == {
+        "seconds": 0, "server_seconds": 0, "mean_util": 0.0, "seconds_above_high": 0, "seconds_below_low": 0,
+        "warnings": 0, "scale_outs": 0, "scale_ins": 0, "responses": 0, "mean_response_seconds": None,
+        "max_response_seconds": 0
+    }
+    assert json.loads(stats.toJson()) == stats.snapshot()
+
+
+def test_ticks_add_up_time_servers_and_utilisation():
+    stats = ClusterStats(20, 80)
+    for util, servers in [(10, 1), (50, 2), (90, 3), (80, 3), (20, 2)]:
+        stats.recordTick(2, util, servers)
+
+    snapshot = json.loads(stats.toJson())
+    assert snapshot["seconds"] == 10
+    assert snapshot["server_seconds"] == 22
+    assert snapshot["mean_util"] == 50.0
+    # Utilisation at a limit doesn't count as past it
+    assert (snapshot["seconds_above_high"], snapshot["seconds_below_low"]) == (2, 2)
+
+
+def test_response_time_runs_from_the_first_warning_to_its_scale():
+    stats = ClusterStats(20, 80)
+
+    # Repeat warnings before the response don't move its start, and warnings with no command aren't waited on
+    stats.recordWarning(10, True)
+    stats.recordWarning(12, True)
+    stats.recordWarning(13, None)
+    stats.recordScale(16, True)
+
+    # A scale the other way ends a waiting warning without counting as its response
+    stats.recordWarning(20, False)
+    stats.recordScale(22, True)
+    stats.recordScale(30, False)
+
+    stats.recordWarning(40, False)
+    stats.recordScale(50, False)
+
+    # Scales nobody asked for, e.g. from a policy, aren't responses
+    stats.recordScale(60, True)
+
+    snapshot = stats.snapshot()
+    assert (snapshot["warnings"], snapshot["scale_outs"], snapshot["scale_ins"]) == (5, 3, 2)
+    assert snapshot["responses"] == 2
+    assert snapshot["mean_response_seconds"] == 8.0
+    assert snapshot["max_response_seconds"] == 10
+    assert stats.responseSeconds == 16
+
+
+def test_cluster_records_its_own_stats():
+    cluster = Cluster(avgVcpuUtil=100, seed=5)
+    while cluster.stepUtil() != highWarning:
+        pass
+    cluster.handleCommand("!scaleout")      # Responds in the tick the warning was sent
+    cluster.handleCommand("!scalein")
+
+    snapshot = cluster.stats.snapshot()
+    assert snapshot["seconds"] == cluster.clock
+    assert snapshot["warnings"] == 1
+    assert (snapshot["scale_outs"], snapshot["scale_ins"], snapshot["responses"]) == (1, 1, 1)
+    assert snapshot["mean_response_seconds"] == 0
\ No newline at end of file
@@ -0,0 +1,50 @@
+from console import Console
+from telemetry import encodeTelemetry
+from types import SimpleNamespace
+import console
+import pytest
+
+
+def test_prints_messages(capsys):
+    output = Console("verbose", summaryPeriod=60)
+    output.pub("simulation/commands", "!scaleout", 0)
+    output.sub(SimpleNamespace(topic="simulation/servers/active", payload=encodeTelemetry(None, 42, 3), qos=0, retain=False))
+    output.close()
+
+    printed = capsys.readouterr().out
+    assert "Sent:\n!scaleout" in printed
+    assert "Active servers: 3" in printed
+    assert (output.published, output.received, output.dropped) == (1, 1, 0)
+
+
+def test_invalid_cluster_id_printed(capsys):
+    # 0xFF is never valid UTF-8
+    payload = encodeTelemetry(None, 42, 3)[:-1] + bytes([2, 0xFF, 0x41])
+    output = Console("verbose", summaryPeriod=60)
+    output.sub(SimpleNamespace(topic="simulation/servers/snapshot", payload=payload, qos=0, retain=False))
+    output.close()
+    assert "Avg CPU utilisation: 42%, Active servers: 3" in capsys.readouterr().out
+
+
+def test_format_error_skips_only_that_message(capsys, monkeypatch):
+    def payloadText(topic: str, payload: bytes) -> str:
+        if payload == b"bad":
+            raise ValueError("can't print")
+        return payload.decode()
+    monkeypatch.setattr(console, "payloadText", payloadText)
+
+    output = Console("verbose", summaryPeriod=60)
+    for payload in [b"1", b"bad", b"2"]:
+        output.sub(SimpleNamespace(topic="t", payload=payload, qos=0, retain=False))
+    output.close()
+
+    captured = capsys.readouterr()
+    assert "Message:\n1\n" in captured.out and "Message:\n2\n" in captured.out
+    assert "can't print" in captured.err
+    assert output.dropped == 1
+    assert not output.thread.is_alive()
+
+
+def test_unknown_level():
+    with pytest.raises(ValueError):
+        Console("loud")
@@ -0,0 +1,90 @@
+from cluster import Cluster, ScalingConfig, utilPeriod
+from cluster_array import ClusterArray
+from headless_sim import HeadlessSim, ArraySim
+from conftest import ReplayRandom
+import pytest
+
+
+class RecordedArray(ClusterArray):
+    """ClusterArray which keeps every step it draws, so Cluster objects can replay them"""
+    def __init__(self, count: int, seed: int) -> None:
+        super().__init__(count, seed=seed)
+        self.history = [[] for _ in range(count)]
+
+
+    def randomSteps(self):
+        steps = super().randomSteps()
+        for clusterSteps, step in zip(self.history, steps):
+            clusterSteps.append(int(step))
+        return steps
+
+
+@pytest.mark.parametrize("commands", [
+    [],
+    [(0, "!simincrease"), (3601, "!simdecrease"), (7200, "!scaleto 5"), (9000, "!simnormal"), (10000, "!scale -2")]
+])
+def test_array_sim_matches_headless_sim(commands):
+    count = 12
+    duration = 4 * 3600
+    array = RecordedArray(count, seed=11)
+    arraySim = ArraySim(array)
+    for dueTime, command in commands:
+        arraySim.scheduleCommand(dueTime, command)
+    arraySim.run(duration)
+
+    # The same steps through the event-driven simulation, one Cluster at a time
+    clusters = [Cluster(f"cluster-{i}") for i in range(count)]
+    for cluster, steps in zip(clusters, array.history):
+        cluster.rng = ReplayRandom(steps)
+    sim = HeadlessSim(clusters)
+    for dueTime, command in commands:
+        sim.scheduleCommand(dueTime, command)
+    sim.run(duration)
+
+    assert array.avgVcpuUtil.tolist() == [cluster.avgVcpuUtil for cluster in clusters]
+    assert array.serversActive.tolist() == [cluster.serversActive for cluster in clusters]
+    for name in ["published", "scaleOuts", "scaleIns", "serverSeconds", "secondsOverHigh",
+                 "reliefCount", "reliefSeconds", "maxReliefSeconds"]:
+        assert getattr(arraySim, name) == getattr(sim, name), name
+    assert arraySim.warnings == sum(cluster.stats.warnings for cluster in clusters)
+    assert arraySim.responses == sum(cluster.stats.responses for cluster in clusters)
+    assert arraySim.responseSeconds == sum(cluster.stats.responseSeconds for cluster in clusters)
+    assert arraySim.maxResponseSeconds == max(cluster.stats.maxResponseSeconds for cluster in clusters)
+    assert sim.scaleOuts and sim.scaleIns
+
+
+def test_log_commands_sent_once_for_every_cluster():
+    # Warnings from several clusters in the same tick start the logger once, and it stops after the last cooldown
+    clusters = [Cluster(f"cluster-{i}", avgVcpuUtil=100, seed=i) for i in range(3)]
+    trace = []
+    sim = HeadlessSim(clusters, trace=lambda now, topic, msg: trace.append((now, topic, msg)))
+    sim.scheduleCommand(0, "!simincrease")
+    sim.run(30)
+
+    logCommands = [(now, msg) for now, topic, msg in trace if topic == "simulation/commands"]
+    assert [msg for _, msg in logCommands] == ["!startlog", "!stoplog"]
+    assert logCommands[1][0] - logCommands[0][0] == sim.warningHandler.cooldown
+    assert sim.scaleOuts == 3
+
+
+class RecordingPolicy:
+    """Scaling policy which never scales, recording what it was passed each time it decides"""
+    def __init__(self) -> None:
+        self.decisions = []
+
+
+    def decide(self, now: float, avgVcpuUtil: float, serversActive: int, serversRequested: int | None = None) -> int | None:
+        self.decisions.append((avgVcpuUtil, serversActive, serversRequested))
+        return None
+
+
+def test_policy_sees_values_from_before_the_step():
+    # Servers booting when the tick starts finish during its step, the policy should still see them as booting
+    cluster = Cluster("cluster-0", avgVcpuUtil=50, seed=1, config=ScalingConfig(bootDelay=utilPeriod))
+    cluster.setServers(3)
+    policy = RecordingPolicy()
+    sim = HeadlessSim([cluster], policies={"cluster-0": policy})
+    sim.tickUtil(cluster)
+
+    assert policy.decisions == [(50, 1, 3)]
+    assert cluster.serversActive == 3
\ No newline at end of file
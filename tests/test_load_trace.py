@@ -0,0 +1,69 @@
+from load_trace import readTrace, resample, syntheticTrace, traceRates, writeTrace
+import itertools
+import pytest
+
+
+@pytest.fixture(params=["trace.csv", "trace.bin"])
+def tracePath(request, tmp_path):
+    """A small trace in each format, with samples further apart than a tick"""
+    path = str(tmp_path / request.param)
+    writeTrace(path, [(0, 10), (4, 30), (6, 30), (10, 10)])
+    return path
+
+
+def test_trace_formats_read_back(tracePath):
+    assert list(readTrace(tracePath)) == [(0, 10), (4, 30), (6, 30), (10, 10)]
+
+
+def test_rates_interpolated_for_each_tick(tracePath):
+    assert list(traceRates(tracePath)) == [10, 20, 30, 30, 20, 10]
+    assert list(traceRates(tracePath, scale=0.5)) == [5, 10, 15, 15, 10, 5]
+
+
+def test_looping_starts_the_trace_again(tracePath):
+    rates = list(itertools.islice(traceRates(tracePath, scale=2, loop=True), 14))
+    assert rates == [20, 40, 60, 60, 40, 20] * 2 + [20, 40]
+
+
+def test_resampling_samples_closer_than_a_tick():
+    samples = [(time / 2, time) for time in range(9)]
+    assert list(resample(samples, period=2)) == [0, 4, 8]
+    assert list(resample(iter([]))) == []
+    assert list(resample([(5, 7)])) == [7]
+    with pytest.raises(ValueError):
+        list(resample([(0, 1), (2, 1), (2, 3)]))
+
+
+def test_csv_headers_comments_and_single_columns(tmp_path):
+    path = tmp_path / "rates.csv"
+    path.write_text("rate\n# quiet start\n10\n\n20\n40\n")
+    assert list(readTrace(str(path), interval=5)) == [(0, 10), (5, 20), (10, 40)]
+    assert list(traceRates(str(path), interval=5)) == [10, 14, 18, 24, 32, 40]
+
+    path.write_text("time,rate\n0,10\n2,oops\n")
+    with pytest.raises(ValueError, match="line 3"):
+        list(readTrace(str(path)))
+
+
+def test_empty_and_truncated_binary_traces(tmp_path):
+    path = tmp_path / "trace.bin"
+    path.write_bytes(b"")
+    assert list(traceRates(str(path), loop=True)) == []
+
+    writeTrace(str(path), [(0, 10), (2, 20)])
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="Truncated"):
+        list(readTrace(str(path)))
+
+
+def test_synthetic_traces_repeat_with_a_seed(tmp_path):
+    samples = list(syntheticTrace(2, 50, 500, flashCrowds=1, seed=4))
+    assert samples == list(syntheticTrace(2, 50, 500, flashCrowds=1, seed=4))
+    assert len(samples) == 121
+    assert all(rate >= 0 for _, rate in samples)
+
+    # Samples longer than a chunk are written and read back the same in binary
+    path = str(tmp_path / "long.bin")
+    longSamples = list(syntheticTrace(100, 50, 500, interval=60, seed=4))
+    assert writeTrace(path, longSamples) == len(longSamples) > 4096
+    assert list(readTrace(path)) == longSamples
\ No newline at end of file
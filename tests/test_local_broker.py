@@ -0,0 +1,128 @@
+from mqtt_packets import (CONNACK, PUBLISH, SUBACK, PINGREQ, PINGRESP, DISCONNECT, makePacket, publishPacket,
+                          connectPacket, subscribePacket, encodeString, readPacket, PacketReader)
+import asyncio
+
+
+class RawClient:
+    """Talks to the broker packet by packet, so the tests check exactly what goes over the wire"""
+    async def open(self, port: int, clientId: str = "raw", will=None) -> int:
+        """Connects and returns the CONNACK return code"""
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self.writer.write(connectPacket(clientId, 60, will=will))
+        packetType, _, body = await self.read()
+        assert packetType == CONNACK
+        return body[1]
+
+
+    async def read(self) -> tuple[int, int, bytes]:
+        return await asyncio.wait_for(readPacket(self.reader), 5)
+
+
+    async def subscribe(self, *topicFilters: str) -> bytes:
+        """Subscribes and returns the return code of each filter"""
+        self.writer.write(subscribePacket(1, list(topicFilters)))
+        packetType, _, body = await self.read()
+        assert packetType == SUBACK
+        return body[2:]
+
+
+    async def receive(self) -> tuple[str, bytes, bool]:
+        packetType, flags, body = await self.read()
+        assert packetType == PUBLISH
+        packet = PacketReader(body)
+        return packet.string(), packet.rest(), bool(flags & 0x01)
+
+
+    async def nothingReceived(self) -> bool:
+        try:
+            await asyncio.wait_for(readPacket(self.reader), 0.2)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+
+def test_wildcards_and_single_delivery(broker):
+    async def run():
+        subscriber, publisher = RawClient(), RawClient()
+        assert await subscriber.open(broker.port, "sub") == 0
+        assert await publisher.open(broker.port, "pub") == 0
+        assert await subscriber.subscribe("a/+/c", "a/#") == b"\x00\x00"
+
+        publisher.writer.write(publishPacket("a/b/c", b"1"))
+        publisher.writer.write(publishPacket("x/y", b"2"))
+        publisher.writer.write(publishPacket("a", b"3"))
+        assert await subscriber.receive() == ("a/b/c", b"1", False)     # Once, though both filters match
+        assert await subscriber.receive() == ("a", b"3", False)
+        assert await subscriber.nothingReceived()
+    asyncio.run(run())
+
+
+def test_invalid_subscription_refused(broker):
+    async def run():
+        client = RawClient()
+        await client.open(broker.port)
+        assert await client.subscribe("a/#/b", "a/b+", "ok") == b"\x80\x80\x00"
+    asyncio.run(run())
+
+
+def test_retained_messages(broker):
+    async def run():
+        publisher = RawClient()
+        await publisher.open(broker.port, "pub")
+        publisher.writer.write(publishPacket("kept", b"value", retain=True))
+        publisher.writer.write(publishPacket("cleared", b"value", retain=True))
+        publisher.writer.write(publishPacket("cleared", b"", retain=True))
+        publisher.writer.write(makePacket(PINGREQ, 0))
+        assert (await publisher.read())[0] == PINGRESP      # Every publish before it has been handled
+
+        subscriber = RawClient()
+        await subscriber.open(broker.port, "sub")
+        await subscriber.subscribe("#")
+        assert await subscriber.receive() == ("kept", b"value", True)
+        assert await subscriber.nothingReceived()
+    asyncio.run(run())
+
+
+def test_sys_topics_not_matched_by_leading_wildcards(broker):
+    async def run():
+        subscriber = RawClient()
+        await subscriber.open(broker.port)
+        await subscriber.subscribe("#", "+/broker/test")
+        broker.loop.call_soon_threadsafe(broker.broker.publish, "$SYS/broker/test", b"1")
+        assert await subscriber.nothingReceived()
+
+        await subscriber.subscribe("$SYS/#")
+        broker.loop.call_soon_threadsafe(broker.broker.publish, "$SYS/broker/test", b"2")
+        assert await subscriber.receive() == ("$SYS/broker/test", b"2", False)
+    asyncio.run(run())
+
+
+def test_will_only_sent_without_disconnect(broker):
+    async def run():
+        subscriber = RawClient()
+        await subscriber.open(broker.port, "sub")
+        await subscriber.subscribe("wills/#")
+
+        clean = RawClient()
+        await clean.open(broker.port, "clean", will=("wills/clean", b"gone", False))
+        clean.writer.write(makePacket(DISCONNECT, 0))
+        await clean.writer.drain()
+        clean.writer.close()
+
+        dropped = RawClient()
+        await dropped.open(broker.port, "dropped", will=("wills/dropped", b"gone", False))
+        dropped.writer.close()
+
+        assert await subscriber.receive() == ("wills/dropped", b"gone", False)
+        assert await subscriber.nothingReceived()
+    asyncio.run(run())
+
+
+def test_unsupported_protocol_refused(broker):
+    async def run():
+        reader, writer = await asyncio.open_connection("127.0.0.1", broker.port)
+        writer.write(makePacket(1, 0, encodeString(b"MQTT") + bytes([5, 0x02, 0, 60]) + encodeString(b"v5")))
+        packetType, _, body = await asyncio.wait_for(readPacket(reader), 5)
+        assert (packetType, body[1]) == (CONNACK, 1)
+        writer.close()
+    asyncio.run(run())
\ No newline at end of file
@@ -0,0 +1,60 @@
+from log_query import openSession, findSessions, textCacheDir, utilisationPercentiles, scaleEvents
+import os
+import numpy as np
+
+textLog = """\
+2024-01-31 13:45:00,000 - Start log:
+2024-01-31 13:45:00,250 - 
+====================[SUB]====================
+simulation/servers/avg_cpu_util
+Retained?: False
+QoS: 0
+
+Message:
+Avg CPU utilisation: 40%
+=============================================
+
+2024-01-31 13:45:02,250 - simulation/servers/avg_cpu_util Avg CPU utilisation: 60%
+2024-01-31 13:45:02,500 - simulation/commands !scaleout
+2024-01-31 13:45:03,000 - End log.
+"""
+
+
+def writeLog(path, text: str) -> None:
+    with open(path, "w", newline="") as logFile:
+        logFile.write(text)
+
+
+def test_text_session_saved_as_binary_copy(tmp_path):
+    path = tmp_path / "server_log_20240131_134500.log"
+    writeLog(path, textLog)
+
+    first = openSession(str(path))
+    assert not isinstance(first.records, np.memmap)
+    assert sorted(os.listdir(tmp_path / textCacheDir)) == ["server_log_20240131_134500.keys", "server_log_20240131_134500.rec"]
+    assert findSessions(str(tmp_path)) == [str(path)]     # The copy isn't found as another session
+
+    # Later queries read the copy, which holds the same records
+    second = openSession(str(path))
+    assert isinstance(second.records, np.memmap)
+    assert second.name == first.name
+    assert second.keys == first.keys
+    assert second.records.tobytes() == first.records.tobytes()
+    assert second.series("simulation/servers/avg_cpu_util")[1].tolist() == [40, 60]
+    assert [command for _, _, command in scaleEvents(second)] == ["!scaleout"]
+    assert list(utilisationPercentiles(second, [50]).values())[0].tolist() == [50]
+
+
+def test_changed_text_session_read_again(tmp_path):
+    path = tmp_path / "server_log_20240131_134500.log"
+    writeLog(path, textLog)
+    openSession(str(path))
+
+    writeLog(path, textLog + "2024-01-31 13:45:04,250 - simulation/servers/avg_cpu_util Avg CPU utilisation: 80%\n")
+    cached = tmp_path / textCacheDir / "server_log_20240131_134500.rec"
+    os.utime(cached, (0, 0))    # Older than the log, as if the log was written to after the copy was made
+
+    session = openSession(str(path))
+    assert not isinstance(session.records, np.memmap)
+    assert session.series("simulation/servers/avg_cpu_util")[1].tolist() == [40, 60, 80]
+    assert len(openSession(str(path))) == len(session)
\ No newline at end of file
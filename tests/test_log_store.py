@@ -0,0 +1,40 @@
+from log_store import RecordFileHandler, LogSession, eventKey, sessionTopic
+import logging
+import numpy as np
+
+
+def test_round_trip(tmp_path):
+    handler = RecordFileHandler(str(tmp_path / "server_log_1.log"), flushInterval=0.05)
+    records = [
+        logging.makeLogRecord({"msg": "Start log:", "created": 1.0}),
+        logging.makeLogRecord({"msg": "simulation/servers/avg_cpu_util", "payload": b"Avg CPU utilisation: 42%", "created": 2.0}),
+        logging.makeLogRecord({"msg": "simulation/servers/active", "payload": b"Active servers: 3", "created": 3.0}),
+        logging.makeLogRecord({"msg": "simulation/commands", "payload": b"!scaleout", "created": 4.0})
+    ]
+    for record in records:
+        handler.handle(record)
+    handler.close()
+
+    session = LogSession(str(tmp_path / "server_log_1.rec"))
+    assert len(session) == 4
+    assert session.series("simulation/servers/avg_cpu_util")[1].tolist() == [42]
+    assert session.series("simulation/servers/active")[1].tolist() == [3]
+    assert session.events("simulation/commands") == [(4.0, "!scaleout")]
+    assert session.events(sessionTopic) == [(1.0, "Start log:")]
+
+
+def test_more_keys_than_16_bits(tmp_path):
+    # Every distinct message is a key, so a long session can go well past 65536 of them
+    count = 70000
+    handler = RecordFileHandler(str(tmp_path / "server_log_1.log"), flushInterval=0.05, maxQueued=count)
+    for i in range(count):
+        handler.handle(logging.makeLogRecord({"msg": "simulation/warnings", "payload": f"Warning {i}".encode(), "created": i}))
+    handler.close()
+    assert (handler.written, handler.dropped) == (count, 0)
+
+    session = LogSession(str(tmp_path / "server_log_1.rec"))
+    assert len(session.keys) == count
+    assert int(session.records["keyId"].max()) == count - 1
+    last = session.records[-1]
+    assert session.keys[last["keyId"]] == eventKey("simulation/warnings", f"Warning {count - 1}")
+    assert np.isnan(last["value"])
\ No newline at end of file
@@ -0,0 +1,60 @@
+from log_writer import BufferedFileHandler
+import logging
+import pytest
+
+
+class FailingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        if record.getMessage() == "bad":
+            raise ValueError("can't format")
+        return super().format(record)
+
+
+def makeLogger(handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"test_log_writer.{id(handler)}")
+    logger.propagate = False
+    logger.addHandler(handler)
+    return logger
+
+
+def test_writes_every_record(tmp_path):
+    path = tmp_path / "log.txt"
+    handler = BufferedFileHandler(str(path), batchSize=10, flushInterval=0.05)
+    logger = makeLogger(handler)
+    for i in range(95):
+        logger.warning(str(i))
+    handler.close()
+
+    assert path.read_text().splitlines() == [str(i) for i in range(95)]
+    assert (handler.written, handler.dropped) == (95, 0)
+
+
+def test_format_error_drops_only_that_record(tmp_path, capsys):
+    path = tmp_path / "log.txt"
+    handler = BufferedFileHandler(str(path), batchSize=10, flushInterval=0.05)
+    handler.setFormatter(FailingFormatter())
+    logger = makeLogger(handler)
+    for message in ["1", "bad", "2", "bad", "3"]:
+        logger.warning(message)
+    handler.close()
+
+    assert path.read_text().splitlines() == ["1", "2", "3"]
+    assert (handler.written, handler.dropped) == (3, 2)
+    assert "can't format" in capsys.readouterr().err
+
+
+def test_overflow_drop_new(tmp_path):
+    handler = BufferedFileHandler(str(tmp_path / "log.txt"), flushInterval=0.05, maxQueued=1, overflow="drop-new")
+    handler.isRunning = False
+    handler.thread.join()       # Nothing takes records off the queue, so it stays full
+
+    record = logging.makeLogRecord({"msg": "1"})
+    handler.emit(record)
+    handler.emit(record)
+    assert (handler.records.qsize(), handler.dropped) == (1, 1)
+    handler.file.close()
+
+
+def test_unknown_overflow_policy(tmp_path):
+    with pytest.raises(ValueError):
+        BufferedFileHandler(str(tmp_path / "log.txt"), overflow="spill")
\ No newline at end of file
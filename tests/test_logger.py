@@ -0,0 +1,62 @@
+from log_query import openSession, findSessions, warningResponseTimes
+from routing import Message
+from types import SimpleNamespace
+import importlib
+import sys
+import time
+import pytest
+
+
+@pytest.fixture
+def loggerModule(monkeypatch, tmp_path, request):
+    # logger.py reads its settings when it is imported, so it is imported again for each test
+    monkeypatch.setenv("BROKER", "127.0.0.1")
+    monkeypatch.setenv("CONSOLE_LEVEL", "off")
+    monkeypatch.setenv("LOGS_DIR", str(tmp_path))
+    monkeypatch.setenv("LOG_FORMAT", request.param)
+    monkeypatch.setenv("LOG_FLUSH_INTERVAL", "0.05")
+    if "logger" in sys.modules:
+        module = importlib.reload(sys.modules["logger"])
+    else:
+        module = importlib.import_module("logger")
+    yield module
+    module.stopLogging()
+
+
+def receive(loggerModule, topic: str, payload: str) -> None:
+    """Passes a message to the logger the way its MQTT client does, commands are handled before they are logged"""
+    message = Message(SimpleNamespace(topic=topic, payload=payload.encode(), qos=0, retain=False))
+    if topic == "simulation/commands":
+        loggerModule.handleCommand(message)
+    loggerModule.logMessage(message)
+
+
+@pytest.mark.parametrize("loggerModule", ["text", "compact", "binary"], indirect=True)
+def test_warning_before_startlog_is_logged(loggerModule, tmp_path):
+    receive(loggerModule, "simulation/servers/avg_cpu_util", "Avg CPU utilisation: 90%")     # Not logged
+    receive(loggerModule, "simulation/warnings", "Warning: CPU utilisation high")
+    time.sleep(0.02)
+    receive(loggerModule, "simulation/commands", "!startlog")
+    receive(loggerModule, "simulation/commands", "!scaleout")
+    receive(loggerModule, "simulation/commands", "!stoplog")
+
+    paths = findSessions(str(tmp_path))
+    assert len(paths) == 1
+    session = openSession(paths[0])
+    assert session.series("simulation/servers/avg_cpu_util")[1].tolist() == []
+
+    responses = warningResponseTimes(session)
+    assert [(warning, command) for _, warning, command, _ in responses] == [("Warning: CPU utilisation high", "!scaleout")]
+    assert 0.01 <= responses[0][3] < 1
+
+
+@pytest.mark.parametrize("loggerModule", ["text"], indirect=True)
+def test_old_warning_not_logged(loggerModule, tmp_path, monkeypatch):
+    monkeypatch.setattr(loggerModule, "recentWarningSeconds", 0)
+    receive(loggerModule, "simulation/warnings", "Warning: CPU utilisation high")
+    time.sleep(0.01)
+    receive(loggerModule, "simulation/commands", "!startlog")
+    receive(loggerModule, "simulation/commands", "!stoplog")
+
+    session = openSession(findSessions(str(tmp_path))[0])
+    assert session.events("simulation/warnings") == []
@@ -0,0 +1,104 @@
+from mqtt_packets import (CONNECT, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, maxPacketSize, encodeLength, makePacket,
+                          publishPacket, connectPacket, subscribePacket, unsubscribePacket, readPacket, PacketReader)
+import asyncio
+import pytest
+
+
+def decode(data: bytes) -> tuple[int, int, bytes]:
+    """Reads one packet from bytes with readPacket"""
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await readPacket(reader)
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize("length, encoded", [
+    (0, b"\x00"),
+    (127, b"\x7f"),
+    (128, b"\x80\x01"),
+    (16383, b"\xff\x7f"),
+    (16384, b"\x80\x80\x01"),
+    (2097151, b"\xff\xff\x7f"),
+    (2097152, b"\x80\x80\x80\x01"),
+    (268435455, b"\xff\xff\xff\x7f")
+])
+def test_encode_length(length, encoded):
+    assert encodeLength(length) == encoded
+
+
+@pytest.mark.parametrize("length", [0, 1, 127, 128, 16383, 16384, 2097152])
+def test_packet_round_trip(length):
+    body = bytes(range(256)) * (length // 256) + bytes(length % 256)
+    assert decode(makePacket(PUBLISH, 0x0B, body)) == (PUBLISH, 0x0B, body)
+
+
+def test_malformed_length():
+    with pytest.raises(ValueError):
+        decode(b"\x30\xff\xff\xff\xff\x01")
+
+
+def test_packet_too_large():
+    # Rejected from the header alone, before the body is read
+    with pytest.raises(ValueError):
+        decode(b"\x30" + encodeLength(maxPacketSize + 1))
+
+
+def test_truncated_packet():
+    with pytest.raises(asyncio.IncompleteReadError):
+        decode(makePacket(PUBLISH, 0, b"body")[:-1])
+
+
+def test_publish_packet():
+    packetType, flags, body = decode(publishPacket("simulation/servers/active", b"\x00payload", retain=True))
+    packet = PacketReader(body)
+    assert (packetType, flags) == (PUBLISH, 0x01)
+    assert packet.string() == "simulation/servers/active"
+    assert packet.rest() == b"\x00payload"
+
+
+def test_connect_packet():
+    packetType, flags, body = decode(connectPacket("client-1", 60, "user", "pass", ("will/topic", b"gone", True)))
+    packet = PacketReader(body)
+    assert (packetType, flags) == (CONNECT, 0)
+    assert packet.bytes() == b"MQTT"
+    assert packet.uint8() == 4
+    assert packet.uint8() == 0x80 | 0x40 | 0x20 | 0x04 | 0x02     # Username, password, will retain, will, clean session
+    assert packet.uint16() == 60
+    assert [packet.string(), packet.string(), packet.bytes(), packet.string(), packet.bytes()] == \
+        ["client-1", "will/topic", b"gone", "user", b"pass"]
+    assert packet.done()
+
+
+def test_connect_packet_without_login():
+    _, _, body = decode(connectPacket("client-1", 0))
+    packet = PacketReader(body)
+    packet.bytes()
+    packet.uint8()
+    assert packet.uint8() == 0x02
+    assert packet.uint16() == 0
+    assert packet.string() == "client-1"
+    assert packet.done()
+
+
+def test_subscribe_packets():
+    packetType, flags, body = decode(subscribePacket(513, ["a/+", "b/#"]))
+    packet = PacketReader(body)
+    assert (packetType, flags) == (SUBSCRIBE, 0x02)
+    assert packet.uint16() == 513
+    assert [(packet.string(), packet.uint8()) for _ in range(2)] == [("a/+", 0), ("b/#", 0)]
+    assert packet.done()
+
+    packetType, flags, body = decode(unsubscribePacket(7, ["a/+"]))
+    packet = PacketReader(body)
+    assert (packetType, flags) == (UNSUBSCRIBE, 0x02)
+    assert (packet.uint16(), packet.string()) == (7, "a/+")
+    assert packet.done()
+
+
+def test_packet_reader_too_short():
+    with pytest.raises(ValueError):
+        PacketReader(b"\x00").uint16()
+    with pytest.raises(ValueError):
+        PacketReader(b"\x00\x05abc").bytes()
\ No newline at end of file
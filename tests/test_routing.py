@@ -0,0 +1,126 @@
+from routing import Message, TopicRouter, checkTopicFilter, topicMatches
+from types import SimpleNamespace
+import random
+import pytest
+
+
+def named(name: str):
+    """Returns a handler which appends its name to the calls made to it"""
+    def handler(message: Message) -> None:
+        handler.calls.append(message.topic)
+    handler.__name__ = name
+    handler.calls = []
+    return handler
+
+
+def matchedNames(router: TopicRouter, topic: str) -> list[str]:
+    return sorted(handler.__name__ for handler in router.handlers(topic))
+
+
+@pytest.fixture
+def router():
+    router = TopicRouter()
+    for topicFilter in ["simulation/servers/active", "simulation/+/active", "simulation/+/servers/+",
+                        "simulation/#", "#", "+", "+/+", "simulation/servers/#"]:
+        router.add(topicFilter, named(topicFilter))
+    return router
+
+
+@pytest.mark.parametrize("topic, filters", [
+    ("simulation/servers/active", ["#", "simulation/#", "simulation/+/active", "simulation/servers/#",
+                                   "simulation/servers/active"]),
+    ("simulation/cluster-1/servers/avg_cpu_util", ["#", "simulation/#", "simulation/+/servers/+"]),
+    ("simulation/servers", ["#", "+/+", "simulation/#", "simulation/servers/#"]),
+    ("simulation", ["#", "+", "simulation/#"]),
+    ("other/topic", ["#", "+/+"]),
+    ("simulation//active", ["#", "simulation/#", "simulation/+/active"])
+])
+def test_wildcards_match_whole_levels(router, topic, filters):
+    assert matchedNames(router, topic) == sorted(filters)
+
+
+def test_dollar_topics_only_match_filters_naming_them(router):
+    assert matchedNames(router, "$SYS/broker/clients") == []
+    assert matchedNames(router, "$SYS") == []
+
+    router.add("$SYS/#", named("$SYS/#"))
+    router.add("$SYS/+/clients", named("$SYS/+/clients"))
+    assert matchedNames(router, "$SYS/broker/clients") == ["$SYS/#", "$SYS/+/clients"]
+
+
+def test_trie_matches_the_same_as_topic_matches():
+    rng = random.Random(3)
+    levels = ["a", "b", "c", ""]
+    filters = set()
+    while len(filters) < 60:
+        filterLevels = [rng.choice(levels + ["+"]) for _ in range(rng.randint(1, 4))]
+        if rng.random() < 0.3:
+            filterLevels.append("#")
+        filters.add("/".join(filterLevels))
+
+    router = TopicRouter()
+    for topicFilter in filters:
+        router.add(topicFilter, named(topicFilter))
+    for _ in range(300):
+        topic = "/".join(rng.choice(levels) for _ in range(rng.randint(1, 5)))
+        assert matchedNames(router, topic) == sorted(f for f in filters if topicMatches(f, topic)), topic
+
+
+def test_cache_cleared_when_handlers_change(router):
+    topic = "simulation/servers/active"
+    before = router.handlers(topic)
+    assert router.handlers(topic) is before      # Repeat lookups come from the cache
+
+    extra = named("extra")
+    router.add("simulation/+/+", extra)
+    assert extra in router.handlers(topic)
+
+    router.remove("simulation/+/+", extra)
+    assert extra not in router.handlers(topic)
+    assert router.handlers(topic) == before
+
+    wildcard = named("wildcard")
+    router.add("simulation/servers/#", wildcard)
+    assert wildcard in router.handlers(topic)
+    router.remove("simulation/servers/#", wildcard)
+    assert wildcard not in router.handlers(topic)
+
+
+def test_removing_unknown_handlers_does_nothing(router):
+    before = router.handlers("simulation/servers/active")
+    router.remove("simulation/servers/active", named("unknown"))
+    router.remove("not/added/#", named("unknown"))
+    router.remove("not/added", named("unknown"))
+    assert router.handlers("simulation/servers/active") is before
+
+
+def test_handlers_of_one_filter_run_in_order_added():
+    router = TopicRouter()
+    calls = []
+    first, second = named("first"), named("second")
+    router.add("simulation/servers/active", first)
+    router.add("simulation/servers/active", second)
+    router.add("simulation/servers/active", lambda message: calls.append(message.text))
+
+    message = router.dispatch(SimpleNamespace(topic="simulation/servers/active", payload=b"Active servers: 2",
+                                              qos=0, retain=False))
+    assert router.handlers("simulation/servers/active")[:2] == (first, second)
+    assert first.calls == second.calls == ["simulation/servers/active"]
+    assert calls == ["Active servers: 2"]
+    assert isinstance(message, Message)
+
+    # The same handler added twice is called twice, and removing it once leaves the other
+    router.add("simulation/servers/active", first)
+    router.dispatch(message)
+    assert first.calls == ["simulation/servers/active"] * 3
+    router.remove("simulation/servers/active", first)
+    router.dispatch(message)
+    assert len(first.calls) == 4
+
+
+@pytest.mark.parametrize("topicFilter", ["", "a/#/b", "a/b#", "a+/b", "a/+b", "##"])
+def test_invalid_filters_rejected(topicFilter):
+    with pytest.raises(ValueError):
+        checkTopicFilter(topicFilter)
+    with pytest.raises(ValueError):
+        TopicRouter().add(topicFilter, named("handler"))
\ No newline at end of file
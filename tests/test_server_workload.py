@@ -0,0 +1,88 @@
+from cluster import ScalingConfig
+from server_workload import WorkloadCluster, loadBalancers
+import copy
+import numpy as np
+import pytest
+
+
+def test_round_robin_carries_on_between_ticks():
+    cluster = WorkloadCluster(serversActive=4, seed=1)
+    assert cluster.balance(np.ones(6)).tolist() == [0, 1, 2, 3, 0, 1]
+    assert cluster.balance(np.ones(3)).tolist() == [2, 3, 0]
+    assert cluster.nextServer == 1
+
+
+def test_least_loaded_picks_the_server_with_least_waiting():
+    cluster = WorkloadCluster(serversActive=3, seed=1, balancer="least-loaded")
+    cluster.backlog = np.array([5.0, 0.0, 3.0])
+    # Batches sent earlier in the tick count towards a server's load, ties go to the lowest server
+    assert cluster.balance(np.array([2.0, 2.0, 2.0, 4.0])).tolist() == [1, 1, 2, 1]
+    assert cluster.backlog.tolist() == [5.0, 0.0, 3.0]
+
+
+def test_power_of_two_picks_the_less_loaded_of_two():
+    cluster = WorkloadCluster(serversActive=4, seed=2, balancer="power-of-two")
+    cluster.backlog = np.array([1000.0, 0.0, 0.0, 0.0])
+    costs = np.ones(200)
+
+    # Draw the same pairs the balancer will, from a copy of its random stream
+    choices = copy.deepcopy(cluster.npRng).integers(4, size=(len(costs), 2)).tolist()
+    assigned = cluster.balance(costs).tolist()
+
+    pending = cluster.backlog.tolist()
+    for server, (first, second) in zip(assigned, choices):
+        assert server in (first, second)
+        assert pending[server] == min(pending[first], pending[second])
+        pending[server] += 1
+    # The overloaded server is only picked when both choices are it
+    assert assigned.count(0) == sum(pair == [0, 0] for pair in choices)
+
+
+@pytest.mark.parametrize("balancer", loadBalancers)
+def test_seeded_clusters_repeat(balancer):
+    runs = []
+    for _ in range(2):
+        cluster = WorkloadCluster(avgVcpuUtil=60, serversActive=4, seed="workload", balancer=balancer)
+        for _ in range(50):
+            cluster.stepUtil()
+        runs.append((cluster.avgVcpuUtil, cluster.serverUtil.tolist(), cluster.backlog.tolist()))
+    assert runs[0] == runs[1]
+
+    # Every request is sent to a server, so the utilisation stays close to the request rate
+    cluster = WorkloadCluster(avgVcpuUtil=50, serversActive=4, seed=3, balancer=balancer, rates=iter([200.0] * 20))
+    for _ in range(20):
+        cluster.stepUtil()
+    assert cluster.serverUtil.mean() == pytest.approx(50, abs=5)
+    assert len(cluster.serverUtil) == len(cluster.backlog) == 4
+
+
+def test_scale_in_spreads_the_removed_work_over_the_rest():
+    cluster = WorkloadCluster(serversActive=4, seed=1)
+    cluster.serverUtil = np.array([10.0, 20.0, 30.0, 60.0])
+    cluster.backlog = np.array([0.0, 0.0, 5.0, 15.0])
+    cluster.nextServer = 3
+
+    cluster.rebalance(2)
+    assert cluster.serverUtil.tolist() == [55.0, 65.0]
+    assert cluster.backlog.tolist() == [10.0, 10.0]
+    assert cluster.avgVcpuUtil == 60
+    assert cluster.nextServer == 1
+
+    # Utilisation can't go past 100%, but no waiting work is lost
+    cluster.serverUtil = np.array([90.0, 80.0])
+    cluster.rebalance(1)
+    assert cluster.serverUtil.tolist() == [100.0]
+    assert cluster.backlog.tolist() == [20.0]
+
+
+def test_scaling_through_commands_resizes_each_server():
+    cluster = WorkloadCluster(avgVcpuUtil=40, serversActive=2, seed=1, config=ScalingConfig(drainDelay=10))
+    cluster.handleCommand("!scaleto 5")
+    assert cluster.serverUtil.tolist() == [40.0, 40.0, 0.0, 0.0, 0.0]
+    assert cluster.avgVcpuUtil == 16
+
+    # Draining servers hand over their work as soon as they leave service
+    cluster.handleCommand("!scaleto 3")
+    assert cluster.serverStates == (3, 0, 0, 2)
+    assert len(cluster.serverUtil) == len(cluster.backlog) == 3
+    assert cluster.serverUtil.sum() == pytest.approx(80)
\ No newline at end of file
@@ -0,0 +1,69 @@
+from telemetry import (ServerStates, Telemetry, decodeServerStates, encodeServerStates, decodeSnapshot, decodeTelemetry,
+                       encodeSnapshot, encodeTelemetry, headerStruct, isBinary, payloadText)
+from types import SimpleNamespace
+import pytest
+
+
+@pytest.mark.parametrize("clusterId", [None, "cluster-1", "klúster-ä"])
+def test_telemetry_round_trip(clusterId):
+    payload = encodeTelemetry(clusterId, 87, 300, timestamp=1700000000.25)
+    assert isBinary(payload)
+    assert len(payload) == headerStruct.size + len((clusterId or "").encode())
+
+    expected = Telemetry(clusterId, 1700000000.25, 87, 300)
+    assert decodeTelemetry("simulation/servers/snapshot", payload) == expected
+    assert decodeSnapshot(payload) == [expected]
+
+
+def test_snapshot_round_trip_with_several_clusters():
+    clusters = [SimpleNamespace(clusterId=f"cluster-{i}", avgVcpuUtil=10 * i, serversActive=i + 1) for i in range(5)]
+    payload = encodeSnapshot(clusters, timestamp=12.5)
+    assert decodeSnapshot(payload) == [Telemetry(c.clusterId, 12.5, c.avgVcpuUtil, c.serversActive) for c in clusters]
+    assert payloadText("simulation/snapshots/batch-0", payload).count("\n") == 4
+
+
+@pytest.mark.parametrize("cut", [1, headerStruct.size - 1])
+def test_truncated_header_is_not_decoded(cut):
+    payload = encodeTelemetry("cluster-1", 50, 2, timestamp=1.0)[:cut]
+    assert isBinary(payload)
+    assert decodeTelemetry("simulation/cluster-1/servers/avg_cpu_util", payload) is None
+    assert decodeSnapshot(payload) == []
+    assert payloadText("simulation/cluster-1/servers/avg_cpu_util", payload) == "Invalid binary telemetry"
+
+
+def test_truncated_records_are_dropped():
+    first = encodeTelemetry("cluster-1", 50, 2, timestamp=1.0)
+    second = encodeTelemetry("cluster-2", 60, 3, timestamp=1.0)
+    assert decodeTelemetry("simulation/servers/snapshot", first[:-1]) is None
+
+    # Records before the cut are kept, a snapshot stops at the first record which is incomplete
+    for cut in [1, headerStruct.size, len(second) - 1]:
+        assert decodeSnapshot(first + second[:cut]) == [Telemetry("cluster-1", 1.0, 50, 2)]
+
+
+@pytest.mark.parametrize("topic, text, expected", [
+    ("simulation/servers/avg_cpu_util", "Avg CPU utilisation: 42%", Telemetry(None, None, 42, None)),
+    ("simulation/cluster-3/servers/active", "Active servers: 4", Telemetry("cluster-3", None, None, 4)),
+    ("simulation/servers/active", "Active servers: many", None),
+    ("simulation/servers/active", "Something else", None)
+])
+def test_text_telemetry(topic, text, expected):
+    assert not isBinary(text.encode())
+    assert decodeTelemetry(topic, text.encode()) == expected
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("states", [ServerStates(0, 0, 0, 0), ServerStates(3, 1, 2, 4), ServerStates(65535, 0, 1, 0)])
+def test_server_states_round_trip(states, binary):
+    payload = encodeServerStates(states, binary)
+    if not binary:
+        assert payload == f"Server states: {states.active} active, {states.pending} pending, " \
+                          f"{states.booting} booting, {states.draining} draining"
+        payload = payload.encode()
+    assert decodeServerStates(payload) == states
+
+
+@pytest.mark.parametrize("payload", [b"Server states: 2 active, 1 pending", b"Server states: x active, 0 pending, 0 booting, 0 draining",
+                                     b"Active servers: 2", b"\xa7\x01\x00", b""])
+def test_invalid_server_states_decode_to_none(payload):
+    assert decodeServerStates(payload) is None
\ No newline at end of file
@@ -0,0 +1,121 @@
+from cluster import capacityWarning, highWarning, lowWarning
+from warning_handler import WarningHandler, WarningState, WarningWorker, logCommandTopic
+import threading
+import time
+
+
+class FakePublish:
+    """Records every command published, and signals when one arrives for threads to wait on"""
+    def __init__(self) -> None:
+        self.sent = []
+        self.event = threading.Event()
+
+
+    def __call__(self, topic: str, command: str) -> None:
+        self.sent.append((topic, command))
+        self.event.set()
+
+
+    def waitFor(self, count: int, timeout: float = 5) -> None:
+        deadline = time.monotonic() + timeout
+        while len(self.sent) < count:
+            assert time.monotonic() < deadline, f"Expected {count} commands, got {self.sent}"
+            self.event.wait(0.01)
+            self.event.clear()
+
+
+def test_warning_moves_cluster_to_cooldown_and_back():
+    publish = FakePublish()
+    handler = WarningHandler(publish)
+    topic = "simulation/cluster-1/warnings"
+
+    assert handler.handleWarning(topic, highWarning)
+    assert handler.states[topic] == WarningState.COOLDOWN
+    assert handler.cooling == 1
+    assert publish.sent == [(logCommandTopic, "!startlog"), ("simulation/cluster-1/commands", "!scaleout")]
+
+    handler.finishWarning(topic)
+    assert handler.states[topic] == WarningState.IDLE
+    assert handler.cooling == 0
+    assert publish.sent[-1] == (logCommandTopic, "!stoplog")
+
+    # Finishing an idle cluster again does nothing
+    handler.finishWarning(topic)
+    assert len(publish.sent) == 3
+
+
+def test_warnings_during_cooldown_are_suppressed():
+    publish = FakePublish()
+    handler = WarningHandler(publish)
+    topic = "simulation/warnings"
+
+    assert handler.handleWarning(topic, lowWarning)
+    assert not handler.handleWarning(topic, lowWarning)
+    assert not handler.handleWarning(topic, highWarning)
+    assert (handler.handled, handler.suppressed, handler.ignored) == (1, 2, 0)
+    assert publish.sent == [(logCommandTopic, "!startlog"), ("simulation/commands", "!scalein")]
+
+    # Once the cooldown is over the cluster's warnings are handled again, starting a new log
+    handler.finishWarning(topic)
+    assert handler.handleWarning(topic, highWarning)
+    assert publish.sent[-2:] == [(logCommandTopic, "!startlog"), ("simulation/commands", "!scaleout")]
+
+
+def test_warnings_without_a_command_are_ignored():
+    publish = FakePublish()
+    handler = WarningHandler(publish)
+
+    assert not handler.handleWarning("simulation/warnings", capacityWarning)
+    assert (handler.handled, handler.suppressed, handler.ignored) == (0, 0, 1)
+    assert "simulation/warnings" not in handler.states
+    assert publish.sent == []
+
+
+def test_log_started_once_and_stopped_by_last_cluster():
+    publish = FakePublish()
+    notes = []
+    handler = WarningHandler(publish, notify=notes.append)
+    topics = [f"simulation/cluster-{i}/warnings" for i in range(3)]
+
+    for topic in topics:
+        assert handler.handleWarning(topic, highWarning)
+    assert [command for _, command in publish.sent].count("!startlog") == 1
+    assert handler.cooling == 3
+    assert len(notes) == 3
+
+    # Logging carries on until every cluster has finished its cooldown
+    handler.finishWarning(topics[1])
+    handler.finishWarning(topics[0])
+    assert "!stoplog" not in [command for _, command in publish.sent]
+    handler.finishWarning(topics[2])
+    assert publish.sent[-1] == (logCommandTopic, "!stoplog")
+
+
+def test_worker_ends_cooldown_on_its_timer():
+    publish = FakePublish()
+    worker = WarningWorker(publish, cooldown=0.2)
+    try:
+        worker.submit("simulation/cluster-1/warnings", highWarning)
+        worker.submit("simulation/cluster-1/warnings", highWarning)
+        publish.waitFor(3)
+    finally:
+        worker.stop()
+
+    assert publish.sent == [(logCommandTopic, "!startlog"), ("simulation/cluster-1/commands", "!scaleout"),
+                            (logCommandTopic, "!stoplog")]
+    assert (worker.handled, worker.suppressed) == (1, 1)
+    assert worker.cooling == 0
+
+
+def test_worker_stop_ends_running_cooldowns():
+    publish = FakePublish()
+    worker = WarningWorker(publish, cooldown=60)
+    worker.submit("simulation/cluster-1/warnings", lowWarning)
+    worker.submit("simulation/cluster-2/warnings", highWarning)
+    publish.waitFor(3)
+    worker.stop()
+
+    assert not worker.thread.is_alive()
+    assert worker.cooling == 0
+    assert publish.sent[-1] == (logCommandTopic, "!stoplog")
+    assert [command for _, command in publish.sent].count("!stoplog") == 1
\ No newline at end of file
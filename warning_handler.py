@@ -0,0 +1,137 @@
+from cluster import baseTopic, warningCommands
+from enum import Enum
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+# Handles cluster warnings the way the monitor app does: log, send the scaling command, then stop logging once the
+# cooldown has passed. Each cluster has its own state, so a warning from one cluster never holds up another
+#
+#   IDLE      --warning-->   COOLDOWN   !startlog (if nothing is being logged yet) and the scaling command are sent
+#   COOLDOWN  --warning-->   COOLDOWN   the warning is counted as suppressed, the last command is still taking effect
+#   COOLDOWN  --timer-->     IDLE       !stoplog (once no other cluster is cooling down)
+#
+# The logger has a single log for every cluster, so it is started by the first cluster to handle a warning and
+# stopped by the last one to finish
+
+# Seconds the monitor keeps logging after handling a warning, further warnings from the cluster are suppressed
+monitorCooldown = 10
+
+logCommandTopic = f"{baseTopic}/commands"
+
+
+class WarningState(Enum):
+    IDLE = "idle"
+    COOLDOWN = "cooldown"
+
+
+def commandTopic(warningTopic: str) -> str:
+    """Returns the command topic of the cluster a warning topic belongs to"""
+    return warningTopic[:-len("warnings")] + "commands"
+
+
+class WarningHandler:
+    """Per-cluster warning state machine, which leaves the timing of each cooldown to the caller
+
+    publish(topic, command) sends a command, and notify(message) is told about each warning handled
+    """
+    def __init__(self, publish, cooldown: float = monitorCooldown, notify=None) -> None:
+        self.publish = publish
+        self.cooldown = cooldown
+        self.notify = notify
+
+        self.states = {}        # Warning topic -> WarningState, clusters which haven't sent a warning are idle
+        self.cooling = 0        # Clusters currently in cooldown
+
+        self.handled = 0
+        self.suppressed = 0
+        self.ignored = 0        # Warnings with no scaling command, e.g. the cluster being at capacity
+
+
+    def handleWarning(self, warningTopic: str, warning: str) -> bool:
+        """Responds to a warning, returns True if a command was sent and finishWarning needs scheduling"""
+        command = warningCommands.get(warning)
+        if command is None:
+            self.ignored += 1
+            return False
+
+        if self.states.get(warningTopic, WarningState.IDLE) == WarningState.COOLDOWN:
+            self.suppressed += 1
+            return False
+
+        self.states[warningTopic] = WarningState.COOLDOWN
+        self.handled += 1
+        if self.cooling == 0:
+            self.publish(logCommandTopic, "!startlog")  # Start logging server cluster metrics to keep a history of the alert
+        self.cooling += 1
+
+        topic = commandTopic(warningTopic)
+        self.publish(topic, command)                    # Resolve the problem the server cluster is experiencing
+        if self.notify:
+            self.notify(f"Sent `{command}` to {topic} in response to `{warning}`")
+        return True
+
+
+    def finishWarning(self, warningTopic: str) -> None:
+        """Ends the cooldown of a cluster"""
+        if self.states.get(warningTopic) != WarningState.COOLDOWN:
+            return
+
+        self.states[warningTopic] = WarningState.IDLE
+        self.cooling -= 1
+        if self.cooling == 0:
+            self.publish(logCommandTopic, "!stoplog")
+
+
+class WarningWorker(WarningHandler):
+    """Handles warnings on a single background thread, with cooldowns kept on a timer heap instead of sleeping"""
+    def __init__(self, publish, cooldown: float = monitorCooldown, notify=None) -> None:
+        super().__init__(publish, cooldown, notify)
+
+        # Warnings are handed over from the MQTT thread
+        self.warnings = queue.SimpleQueue()
+
+        # Heap of (due time, sequence, warning topic) for the end of each cooldown
+        self.timers = []
+        self.sequence = itertools.count()
+
+        self.isRunning = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, warningTopic: str, warning: str) -> None:
+        """Queues a warning to be handled, this is safe to call from any thread"""
+        self.warnings.put((warningTopic, warning))
+
+
+    def run(self) -> None:
+        while self.isRunning:
+            # Sleep until the next cooldown ends, or a warning arrives
+            timeout = max(0, self.timers[0][0] - time.monotonic()) if self.timers else None
+            try:
+                item = self.warnings.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item[0] is not None:
+                warningTopic, warning = item
+                if self.handleWarning(warningTopic, warning):
+                    heapq.heappush(self.timers, (time.monotonic() + self.cooldown, next(self.sequence), warningTopic))
+
+            while self.timers and self.timers[0][0] <= time.monotonic():
+                _, _, warningTopic = heapq.heappop(self.timers)
+                self.finishWarning(warningTopic)
+
+
+    def stop(self) -> None:
+        """Stops the worker, ending any cooldowns still running so logging is stopped"""
+        self.isRunning = False
+        self.warnings.put((None, None))     # Wakes the worker up
+        self.thread.join()
+
+        while self.timers:
+            _, _, warningTopic = heapq.heappop(self.timers)
+            self.finishWarning(warningTopic)
\ No newline at end of file